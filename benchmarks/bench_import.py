@@ -0,0 +1,74 @@
+"""Measure import time of insteonlocal.Hub and the cost of constructing Hub
+objects and of the first device catalog lookup.
+
+    python benchmarks/bench_import.py [runs]
+"""
+import os
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 10
+CONSTRUCT_RUNS = 1000
+
+IMPORT_SCRIPT = ("from time import perf_counter; t = perf_counter(); "
+                 "import insteonlocal.Hub; print(perf_counter() - t)")
+
+def import_time(runs=RUNS):
+    """Median seconds to import insteonlocal.Hub in a fresh interpreter"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], env=env)
+        times.append(float(output))
+    return median(times)
+
+
+def construct_time(runs=CONSTRUCT_RUNS):
+    """Mean seconds to construct a Hub, and seconds for the first catalog
+    lookup in this process"""
+    sys.path.insert(0, ROOT)
+    import logging
+    from insteonlocal.Hub import Hub
+    from insteonlocal.DeviceRegistry import DeviceRegistry
+
+    logger = logging.getLogger('bench')
+    start = perf_counter()
+    for _ in range(runs):
+        hub = Hub('127.0.0.1', 'user', 'pass', logger=logger,
+                  registry=DeviceRegistry(logger, path=False))
+        hub.close()
+    construct = (perf_counter() - start) / runs
+
+    start = perf_counter()
+    hub.get_device_model('01', '20')
+    first_lookup = perf_counter() - start
+    return construct, first_lookup
+
+
+def main():
+    """Print the measurements"""
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    print("import insteonlocal.Hub: %.1f ms (median of %d)" % (import_time(runs) * 1000, runs))
+    construct, first_lookup = construct_time()
+    print("Hub(...):                %.3f ms" % (construct * 1000))
+    print("first catalog lookup:    %.1f ms" % (first_lookup * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""Offline benchmark suite. Measures buffer parsing, command encoding,
+command cache cost and end to end command latency against the bundled hub
+simulator, and writes the results as JSON so runs of different versions
+can be compared.
+
+    python benchmarks/bench_suite.py [--quick] [--output results.json]
+                                     [--compare old_results.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+from statistics import median
+from time import perf_counter, strftime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# pylint: disable=wrong-import-position
+from insteonlocal.BufferReader import BufferReader
+from insteonlocal.Codec import encode_direct
+from insteonlocal.DeviceRegistry import DeviceRegistry
+from insteonlocal.Hub import Hub
+from insteonlocal.HubSimulator import HubSimulator
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+VERSION = '0.51'
+REPEATS = 5
+QUICK_SCALE = 10 # --quick divides iteration counts by this
+SIMULATOR_LATENCY = 0.02
+DEVICE_ID = '112233'
+
+# buffers recorded from hubs: a dimmer turned on and queried, a scene
+# command with its cleanup, and an ALDB walk
+RECORDED_MESSAGES = [
+    '02621122330F11FF06', '025011223344AA112B11FF',
+    '02621122330F190006', '025011223344AA112B00FF',
+    '0261011100000006', '02580006',
+    '02690006', '0257E201112233012045',
+    '026A0006', '0257E201445566022A45',
+    '02621122331F2E0001000000000000000000000000D106',
+    '025111223344AA111B2E0001010000201C0F0000000000000000',
+]
+
+def recorded_linear():
+    """Pre-2015 hub buffer: messages from the start, zero filled"""
+    text = ''.join(RECORDED_MESSAGES)
+    return text + '0' * (1000 - len(text))
+
+
+def recorded_ring():
+    """2015 hub ring buffer: 200 chars wrapped at the write pointer"""
+    text = ''.join(RECORDED_MESSAGES[:6])
+    pointer = len(text) % 200
+    return (text + '0' * 200)[:200] + format(pointer, '02X')
+
+
+def measure(func, iterations, repeats=REPEATS):
+    """Call func iterations times per repeat. Returns throughput and per
+    call latency from the repeats"""
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        for _ in range(iterations):
+            func()
+        times.append((perf_counter() - start) / iterations)
+    return summarize(times, iterations)
+
+
+def measure_calls(func, calls):
+    """Time each of calls calls of func. For slow calls like hub commands"""
+    times = []
+    for _ in range(calls):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return summarize(times, 1)
+
+
+def summarize(times, iterations):
+    """Reduce per call seconds to a result record"""
+    ordered = sorted(times)
+    best = ordered[0]
+    return {
+        'iterations': iterations,
+        'samples': len(times),
+        'ops_per_sec': 1 / median(ordered) if median(ordered) else None,
+        'median_us': median(ordered) * 1e6,
+        'min_us': best * 1e6,
+        'p95_us': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1e6,
+        'max_us': ordered[-1] * 1e6,
+    }
+
+
+def offline_hub(logger):
+    """Hub that never reaches the network, for the in-process benchmarks"""
+    return Hub('127.0.0.1', 'user', 'pass', logger=logger,
+               registry=DeviceRegistry(logger, path=False))
+
+
+def bench_parser(logger, scale):
+    """get_buffer_status on recorded buffers, with the download replaced by
+    the recording"""
+    results = {}
+    hub = offline_hub(logger)
+    for name, text in (('linear', recorded_linear()), ('ring', recorded_ring())):
+        hub.read_buffer_text = lambda text=text: text
+
+        def parse():
+            # a fresh reader parses the whole recording every time
+            hub.buffer_reader = BufferReader(logger)
+            hub.get_buffer_status(DEVICE_ID)
+
+        results['get_buffer_status_' + name] = measure(parse, 2000 // scale)
+    hub.close()
+    return results
+
+
+def bench_encoder(scale):
+    """URL and checksum encoding done by direct_command"""
+    hub_url = 'http://127.0.0.1:25105'
+
+    def standard():
+        return hub_url + '/3?' + encode_direct(DEVICE_ID, '11', 'FF') + '=I=3'
+
+    def extended():
+        return hub_url + '/3?' + encode_direct(DEVICE_ID, '11', 'FF',
+                                               '02000000000000000000000000') + '=I=3'
+
+    return {
+        'direct_command_url_standard': measure(standard, 100000 // scale),
+        'direct_command_url_extended': measure(extended, 100000 // scale),
+    }
+
+
+def bench_cache(logger, scale):
+    """Command cache reads and writes"""
+    hub = offline_hub(logger)
+    response = {'success': True, 'cmd2': 'FF'}
+    hub.set_command_response_from_cache(response, DEVICE_ID, '19', '00')
+    results = {
+        'set_command_response_from_cache': measure(
+            lambda: hub.set_command_response_from_cache(response, DEVICE_ID, '19', '00'),
+            100000 // scale),
+        'get_command_response_from_cache_hit': measure(
+            lambda: hub.get_command_response_from_cache(DEVICE_ID, '19', '00'),
+            100000 // scale),
+        'get_command_response_from_cache_miss': measure(
+            lambda: hub.get_command_response_from_cache('AABBCC', '19', '00'),
+            100000 // scale),
+    }
+    hub.close()
+    return results
+
+
+def bench_end_to_end(logger, scale, ring=True):
+    """Dimmer.on and get_device_status against the simulator. Includes the
+    hub command rate limit, as callers see it"""
+    results = {}
+    with HubSimulator(latency=SIMULATOR_LATENCY, ring=ring) as simulator:
+        simulator.add_device(DEVICE_ID, 'dimmer')
+        hub = Hub('127.0.0.1', 'admin', 'password', port=str(simulator.port),
+                  logger=logger, registry=DeviceRegistry(logger, path=False))
+        dimmer = hub.dimmer(DEVICE_ID)
+        calls = max(3, 40 // scale)
+        suffix = '_ring' if ring else '_linear'
+
+        levels = iter(range(calls * 2))
+        results['dimmer_on' + suffix] = measure_calls(
+            lambda: dimmer.on(next(levels) % 100), calls)
+
+        def uncached_status():
+            # neither cached nor tracked, so the device is really queried
+            hub.clear_device_command_cache(DEVICE_ID)
+            hub.state_tracker.forget(DEVICE_ID)
+            hub.get_device_status(DEVICE_ID)
+
+        results['get_device_status_uncached' + suffix] = measure_calls(uncached_status, calls)
+        results['get_device_status_cached' + suffix] = measure(
+            lambda: hub.get_device_status(DEVICE_ID), 10000 // scale)
+        results['simulator' + suffix] = simulator.stats()
+        hub.close()
+    return results
+
+
+def compare(results, old_path):
+    """Print median change against an earlier results file"""
+    with open(old_path) as old_file:
+        old = json.load(old_file)
+    print("\ncompared with %s (%s):" % (old_path, old.get('version')))
+    for name, result in sorted(results['results'].items()):
+        before = old['results'].get(name, {}).get('median_us')
+        if before and 'median_us' in result:
+            print("  %-42s %10.1f us -> %10.1f us (%+.0f%%)"
+                  % (name, before, result['median_us'],
+                     (result['median_us'] / before - 1) * 100))
+
+
+def main():
+    """Run the suite, print a summary and write the JSON results"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true', help='fewer iterations')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--skip-end-to-end', action='store_true')
+    args = parser.parse_args()
+
+    logger = logging.getLogger('insteonlocal.bench')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    scale = QUICK_SCALE if args.quick else 1
+
+    results = {}
+    results.update(bench_parser(logger, scale))
+    results.update(bench_encoder(scale))
+    results.update(bench_cache(logger, scale))
+    if not args.skip_end_to_end:
+        results.update(bench_end_to_end(logger, scale, ring=True))
+        results.update(bench_end_to_end(logger, scale, ring=False))
+
+    report = {
+        'version': VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'quick': args.quick,
+        'results': results,
+    }
+    for name, result in sorted(results.items()):
+        if 'median_us' in result:
+            print("%-44s %12.1f us  %12.0f ops/s"
+                  % (name, result['median_us'], result['ops_per_sec']))
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print("results written to %s" % args.output)
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
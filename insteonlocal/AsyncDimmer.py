@@ -0,0 +1,108 @@
+import pprint
+from insteonlocal.Codec import level_to_hex
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+class AsyncDimmer():
+    """This class defines an asyncio object for an INSTEON Dimmer"""
+    def __init__(self, hub, device_id):
+        self.device_id = device_id.upper()
+        self.hub = hub
+        self.logger = hub.logger
+
+
+    async def status(self, return_led=0):
+        """Get status from device"""
+        status = await self.hub.get_device_status(self.device_id, return_led)
+        self.logger.info("Dimmer %s status: %s", self.device_id,
+                         pprint.pformat(status))
+        return status
+
+
+    async def command(self, name, cmd1, cmd2, check_cmd2=None):
+        """Send command to dimmer and wait for the response"""
+        self.logger.info("Dimmer %s %s", self.device_id, name)
+
+        await self.hub.direct_command(self.device_id, cmd1, cmd2)
+        success = await self.hub.check_success(self.device_id, cmd1,
+                                               check_cmd2 or cmd2)
+        if success:
+            self.logger.info("Dimmer %s %s: command succeeded", self.device_id, name)
+            await self.hub.run(self.hub.hub.clear_device_command_cache, self.device_id)
+        else:
+            self.logger.error("Dimmer %s %s: command failed", self.device_id, name)
+
+        return success
+
+
+    async def on(self, level):
+        """Turn light on at saved ramp rate"""
+        return await self.command('on', '11', level_to_hex(level))
+
+
+    async def on_saved(self):
+        """Turn light on to saved state using 'fast'"""
+        return await self.command('on_saved', '12', '00')
+
+
+    async def off(self):
+        """Turn light off at saved ramp rate"""
+        return await self.command('off', '13', '00')
+
+
+    async def off_instant(self):
+        """Turn light off"""
+        return await self.command('off_instant', '14', '00')
+
+
+    async def change_level(self, level):
+        """Change light level"""
+        return await self.command('change_level', '21', level_to_hex(level))
+
+
+    async def brighten_step(self):
+        """Brighten light by one step"""
+        return await self.command('brighten_step', '15', '00')
+
+
+    async def dim_step(self):
+        """Dim light by one step"""
+        return await self.command('dim_step', '16', '00')
+
+
+    async def start_change(self, direction):
+        """Start changing light level manually. Direction should be 'up' or 'down'"""
+        if direction == 'up':
+            level = '01'
+        elif direction == 'down':
+            level = '00'
+        else:
+            self.logger.error("Dimmer %s start_change: %s is invalid, use up or down",
+                              self.device_id, direction)
+            return False
+
+        return await self.command('start_change', '17', level)
+
+
+    async def stop_change(self):
+        """Stop changing light level manually"""
+        return await self.command('stop_change', '18', '00')
+
+
+    async def beep(self):
+        """Make dimmer beep. Not all devices support this"""
+        self.logger.info("Dimmer %s beep", self.device_id)
+
+        await self.hub.direct_command(self.device_id, '30', '00')
+        return await self.hub.check_success(self.device_id, '30', '00')
@@ -0,0 +1,61 @@
+import pprint
+from insteonlocal.Codec import FAN_LEVEL_HEX
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+class AsyncFan():
+    """This class defines an asyncio object for an INSTEON FanLinc"""
+    def __init__(self, hub, device_id):
+        self.device_id = device_id.upper()
+        self.hub = hub
+        self.logger = hub.logger
+
+
+    async def status(self):
+        """Get status from device"""
+        status = await self.hub.get_device_status(self.device_id, level='03')
+        self.logger.info("Fan %s status: %s", self.device_id,
+                         pprint.pformat(status))
+        return status
+
+
+    async def command(self, name, cmd1, cmd2):
+        """Send extended fan command and wait for the response"""
+        self.logger.info("Fan %s %s", self.device_id, name)
+
+        await self.hub.direct_command(self.device_id, cmd1, cmd2, '02')
+        success = await self.hub.check_success(self.device_id, cmd1, cmd2)
+        if success:
+            self.logger.info("Fan %s %s: command succeeded", self.device_id, name)
+            await self.hub.run(self.hub.hub.clear_device_command_cache, self.device_id)
+        else:
+            self.logger.error("Fan %s %s: command failed", self.device_id, name)
+
+        return success
+
+
+    async def on(self, level):
+        """Turn fan on at saved ramp rate"""
+        new_level = FAN_LEVEL_HEX.get(level)
+        if new_level is None:
+            self.logger.error("Fan %s on: %s is invalid, use off, low, medium or high",
+                              self.device_id, level)
+            return False
+
+        return await self.command('on', '11', new_level)
+
+
+    async def off(self):
+        """Turn fan off at saved ramp rate"""
+        return await self.command('off', '13', '00')
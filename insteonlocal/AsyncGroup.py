@@ -0,0 +1,64 @@
+from insteonlocal.CommandScheduler import SCENE
+from insteonlocal.Codec import encode_scene
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+class AsyncGroup():
+    """asyncio group lighting functions. Valid group id 1-255 (decimal)"""
+    def __init__(self, hub, group_id):
+        self.group_id = group_id
+        self.hub = hub
+        self.logger = hub.logger
+
+
+    async def on(self):
+        """Turn group on"""
+        self.logger.info("\ngroupOn: group %s", self.group_id)
+        return await self.scene_command('11')
+
+
+    async def off(self):
+        """Turn group off"""
+        self.logger.info("\ngroupOff: group %s", self.group_id)
+        return await self.scene_command('13')
+
+
+    async def scene_command(self, command):
+        """Wrapper to send posted scene command and get response"""
+        self.logger.info("scene_command: Group %s Command %s", self.group_id, command)
+        command_url = (self.hub.hub.hub_url + '/0?' + encode_scene(command, self.group_id)
+                       + "=I=0")
+        return await self.hub.send_command(command_url, SCENE)
+
+
+    async def enter_link_mode(self):
+        """Enter linking mode for a group. Press and hold button on device
+        after sending this command"""
+        self.logger.info("enter_link_mode Group %s", self.group_id)
+        await self.scene_command('09')
+        return await self.hub.get_buffer_status()
+
+
+    async def enter_unlink_mode(self):
+        """Enter unlinking mode for a group"""
+        self.logger.info("enter_unlink_mode Group %s", self.group_id)
+        await self.scene_command('0A')
+        return await self.hub.get_buffer_status()
+
+
+    async def cancel_link_unlink_mode(self):
+        """Cancel linking or unlinking mode"""
+        self.logger.info("cancel_link_unlink_mode")
+        await self.scene_command('08')
+        return await self.hub.get_buffer_status()
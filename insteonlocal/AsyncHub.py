@@ -0,0 +1,518 @@
+import asyncio
+import functools
+import pprint
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from collections import OrderedDict, deque
+from insteonlocal.Hub import Hub, POLL_MIN_DELAY, POLL_MAX_DELAY, SWEEP_WINDOW, ALDB_TIMEOUT, \
+    ID_REQUEST_TIMEOUT
+from insteonlocal.CommandCorrelator import ACK_TIMEOUT, hop_count
+from insteonlocal.BufferPoller import POLL_INTERVAL
+from insteonlocal.CommandScheduler import INTERACTIVE, STATUS, DISCOVERY
+from insteonlocal.AsyncDimmer import AsyncDimmer
+from insteonlocal.AsyncSwitch import AsyncSwitch
+from insteonlocal.AsyncFan import AsyncFan
+from insteonlocal.AsyncOnOffOutlet import AsyncOnOffOutlet
+from insteonlocal.AsyncGroup import AsyncGroup
+from insteonlocal.LinkWalk import LinkWalk
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+MAX_WORKERS = 4
+
+class AsyncHub(object):
+    """asyncio interface to the insteon hub. Waits use asyncio.sleep so they
+    never block the event loop. Single HTTP round trips are handed to a small
+    shared worker pool running over the hub's pooled session, so hundreds of
+    devices can be driven from one loop without a thread per call. Commands
+    wait for their turn at the rate limit on a pool of their own, so buffer
+    reads never queue behind them"""
+    def __init__(self, ip_addr, username, password, port="25105", timeout=10, logger=None,
+                 max_workers=MAX_WORKERS, hub=None):
+        if hub is None:
+            hub = Hub(ip_addr, username, password, port, timeout, logger,
+                      pool_maxsize=max_workers)
+        self.hub = hub
+        self.logger = hub.logger
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.send_executor = ThreadPoolExecutor(max_workers=max_workers)
+
+
+    @classmethod
+    def from_hub(cls, hub, max_workers=MAX_WORKERS):
+        """Wrap an existing Hub object"""
+        return cls(hub.ip_addr, hub.username, hub.password, hub.port,
+                   hub.timeout, hub.logger, max_workers=max_workers, hub=hub)
+
+
+    def run(self, func, *args, **kwargs):
+        """Run a blocking hub call on the worker pool"""
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor,
+                                    functools.partial(func, *args, **kwargs))
+
+
+    def send(self, func, *args, **kwargs):
+        """Run a hub call that waits in the command scheduler on the send
+        pool"""
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.send_executor,
+                                    functools.partial(func, *args, **kwargs))
+
+
+    def brightness_to_hex(self, level):
+        """Convert numeric brightness percentage into hex for insteon"""
+        return self.hub.brightness_to_hex(level)
+
+
+    def get_device_category(self, cat, subcat=None):
+        """Return the device category and name given the category id"""
+        return self.hub.get_device_category(cat, subcat)
+
+
+    def get_device_model(self, cat, sub_cat, key=''):
+        """Return the model name given cat/subcat or product key"""
+        return self.hub.get_device_model(cat, sub_cat, key)
+
+
+    def classify(self, records):
+        """Describe devices from a list of id request responses"""
+        return self.hub.classify(records)
+
+
+    async def direct_command(self, device_id, command, command2, extended_payload=None,
+                             priority=INTERACTIVE):
+        """Send posted direct command"""
+        return await self.send(self.hub.direct_command, device_id, command,
+                               command2, extended_payload, priority)
+
+
+    async def direct_command_hub(self, command, priority=INTERACTIVE):
+        """Send direct hub command"""
+        return await self.send(self.hub.direct_command_hub, command, priority)
+
+
+    async def direct_command_short(self, command, priority=INTERACTIVE):
+        """Send short-form command"""
+        return await self.send(self.hub.direct_command_short, command, priority)
+
+
+    async def send_command(self, command_url, priority=INTERACTIVE):
+        """Post a command through the hub's priority scheduler"""
+        return await self.send(self.hub.send_command, command_url, priority)
+
+
+    async def post_direct_command(self, command_url):
+        """Send raw command via post"""
+        return await self.run(self.hub.post_direct_command, command_url)
+
+
+    async def get_buffer_status(self, device_from=None):
+        """Read from buffer. Optionally pass in device to only get response
+        from that device"""
+        return await self.run(self.hub.get_buffer_status, device_from)
+
+
+    async def clear_buffer(self):
+        """Clear the hub buffer"""
+        return await self.run(self.hub.clear_buffer)
+
+
+    async def check_success(self, device_id, sent_cmd1, sent_cmd2, timeout=ACK_TIMEOUT):
+        """Check if last command succeeded by waiting for its ack in the
+        buffer. Returns as soon as the ack or a nak shows up, or False after
+        timeout seconds"""
+        device_id = device_id.upper()
+
+        self.logger.info('check_success: for device %s cmd1 %s cmd2 %s',
+                         device_id, sent_cmd1, sent_cmd2)
+
+        with self.hub.tracer.task_span('check_success', device=device_id, cmd1=sent_cmd1,
+                                       cmd2=sent_cmd2) as span:
+            correlator = self.hub.correlator
+            pending = correlator.register(device_id, sent_cmd1, sent_cmd2, timeout)
+            start = time()
+            deadline = start + timeout
+            delay = POLL_MIN_DELAY
+            try:
+                while not pending.future.done():
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        break
+
+                    if self.hub.poller is not None and self.hub.poller.is_running():
+                        await asyncio.wait([asyncio.wrap_future(pending.future)],
+                                           timeout=remaining)
+                        continue
+
+                    await asyncio.sleep(min(delay, remaining))
+                    delay = min(delay * 2, POLL_MAX_DELAY)
+                    await self.get_buffer_status(device_id)
+            finally:
+                correlator.release(pending)
+
+            outcome = self.hub.response_outcome(pending)
+            self.hub.metrics.observe('response_wait_seconds', time() - start, device=device_id,
+                                     cmd1=sent_cmd1, outcome=outcome)
+            span.set('outcome', outcome)
+
+            if outcome == 'ack':
+                self.logger.info("check_success: Response device %s cmd %s cmd2 %s SUCCESS",
+                                 device_id, sent_cmd1, sent_cmd2)
+                hops = hop_count(pending.future.result())
+                if hops is not None:
+                    span.set('hops', hops[0])
+                    span.set('max_hops', hops[1])
+                return True
+            if outcome == 'nak':
+                self.logger.info("check_success: NAK for device %s cmd %s cmd2 %s",
+                                 device_id, sent_cmd1, sent_cmd2)
+            elif outcome == 'superseded':
+                self.logger.info("check_success: %s", pending.future.exception())
+            else:
+                self.logger.info("check_success: No valid response found for device %s "
+                                 "cmd %s cmd2 %s", device_id, sent_cmd1, sent_cmd2)
+            return False
+
+
+    async def id_request(self, device_id):
+        """Get the device for the ID. Cat is status['id_high'], sub cat is
+        status['id_mid']"""
+        self.logger.info("\nid_request for device %s", device_id)
+        device_id = device_id.upper()
+
+        return await self.hub.single_flight.do_async((device_id, '10', '00'),
+                                                     self.send_id_request, device_id)
+
+
+    async def send_id_request(self, device_id, timeout=ID_REQUEST_TIMEOUT):
+        """Send ID request and poll the buffer until the device's broadcast
+        shows up. Returns the broadcast record, or None on timeout"""
+        reader = self.hub.buffer_reader
+        mark = reader.mark()
+        await self.direct_command(device_id, '10', '00', priority=DISCOVERY)
+        deadline = time() + timeout
+        delay = POLL_MIN_DELAY
+
+        while time() < deadline:
+            if self.hub.poller is None or not self.hub.poller.is_running():
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, POLL_MAX_DELAY)
+            await self.get_buffer_status()
+
+            records, mark = reader.messages_since(mark)
+            record = self.hub.id_broadcast(device_id, records)
+            if record is not None:
+                return record
+
+        self.logger.info("id_request: no broadcast from device %s", device_id)
+        return None
+
+
+    async def get_device_status(self, device_id, return_led=0, level=None):
+        """Do a separate query to get device status. This can tell if device
+        is on/off, lighting level, etc."""
+        self.logger.info("\nget_device_status for device %s", device_id)
+        device_id = device_id.upper()
+        status = False
+
+        if not level:
+            if return_led == 1:
+                level = '01'
+            else:
+                level = '00'
+
+        with self.hub.tracer.task_span('get_device_status', device=device_id, cmd1='19',
+                                       cmd2=level) as span:
+            state = self.hub.known_state(device_id, level)
+            if state is not None:
+                span.set('outcome', 'state')
+                return state.as_status()
+
+            if self.hub.command_cache.has_device(device_id):
+                status = await self.run(self.hub.get_command_response_from_cache,
+                                        device_id, '19', level)
+            else:
+                self.hub.metrics.inc('cache_lookups_total', result='miss', cmd='19')
+
+            span.set('cached', bool(status))
+            if not status:
+                self.logger.info("no cached status for device %s", device_id)
+                status = await self.hub.single_flight.do_async((device_id, '19', level),
+                                                               self.query_status, device_id,
+                                                               level)
+            else:
+                self.logger.info("got cached status for device %s", device_id)
+            span.set('outcome', 'ack' if status and status.get('success') else 'no response')
+
+        return status
+
+
+    async def query_status(self, device_id, level):
+        """Send status request, retrying until the device answers"""
+        await self.direct_command(device_id, '19', level, priority=STATUS)
+
+        attempts = 1
+        resends = 0
+        await asyncio.sleep(1)
+
+        status = await self.get_buffer_status(device_id)
+        while 'success' not in status and attempts < 9:
+            status = await self.run(self.hub.get_command_response_from_cache,
+                                    device_id, '19', level)
+            if not status:
+                if attempts % 3 == 0:
+                    await self.direct_command(device_id, '19', level, priority=STATUS)
+                    resends += 1
+                else:
+                    await asyncio.sleep(1)
+                status = await self.get_buffer_status(device_id)
+            attempts += 1
+        self.hub.metrics.observe('command_retries', resends, device=device_id, cmd1='19')
+        if status and status.get('success'):
+            await self.run(self.hub.set_command_response_from_cache,
+                           status, device_id, '19', level)
+
+        return status
+
+
+    async def get_many_device_status(self, device_ids, return_led=0, window=SWEEP_WINDOW,
+                                     timeout=ACK_TIMEOUT, use_cache=True):
+        """Query status of many devices, keeping up to window queries
+        outstanding. Async iterator of (device_id, status) in arrival order,
+        status is False for devices that did not answer within timeout"""
+        level = '01' if return_led == 1 else '00'
+        correlator = self.hub.correlator
+        queue = deque(device_id.upper() for device_id in device_ids)
+        outstanding = {}
+        delay = POLL_MIN_DELAY
+
+        try:
+            while queue or outstanding:
+                while queue and len(outstanding) < window:
+                    device_id = queue.popleft()
+                    if use_cache:
+                        status = self.hub.get_cached_status(device_id, level)
+                        if status:
+                            yield device_id, status
+                            continue
+                    await self.direct_command(device_id, '19', level, priority=STATUS)
+                    pending = correlator.register(device_id, '19', level, timeout)
+                    outstanding[device_id] = pending
+                    delay = POLL_MIN_DELAY
+
+                if not outstanding:
+                    continue
+
+                now = time()
+                for device_id, pending in list(outstanding.items()):
+                    if pending.future.done():
+                        status = await self.run(self.hub.sweep_result, pending, level)
+                    elif pending.deadline <= now:
+                        self.logger.info("status sweep: no response from device %s", device_id)
+                        status = False
+                    else:
+                        continue
+                    del outstanding[device_id]
+                    correlator.release(pending)
+                    yield device_id, status
+
+                if not outstanding:
+                    continue
+
+                remaining = min(p.deadline for p in outstanding.values()) - time()
+                if self.hub.poller is not None and self.hub.poller.is_running():
+                    await asyncio.wait([asyncio.wrap_future(p.future)
+                                        for p in outstanding.values()],
+                                       timeout=max(remaining, 0),
+                                       return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(max(min(delay, remaining), 0))
+                    delay = min(delay * 2, POLL_MAX_DELAY)
+                    await self.get_buffer_status()
+        finally:
+            for pending in outstanding.values():
+                correlator.release(pending)
+
+
+    async def get_linked(self):
+        """Get a list of currently linked devices from the hub. If the walk
+        timed out the list is partial and hub.linked_complete is False"""
+        self.logger.info("\nget_linked")
+        linked_devices = OrderedDict()
+        async for device_id, device in self.iter_linked():
+            linked_devices[device_id] = device
+        self.logger.info("get_linked: Final device list: %s", pprint.pformat(linked_devices))
+        return linked_devices
+
+
+    async def iter_linked(self, timeout=ALDB_TIMEOUT):
+        """Walk the hub's link database. Async iterator of (device_id, device)
+        yielding each linked device as soon as it is identified. Devices in
+        the registry are yielded right away, id requests for the rest run as
+        tasks alongside the walk. Timed out records restart the walk like
+        Hub.iter_linked"""
+        registry = self.hub.registry
+        groups = OrderedDict()
+        lookups = OrderedDict()
+        self.hub.linked_complete = None
+        try:
+            walk = LinkWalk(self.logger)
+            while not walk.done:
+                record = walk.take(await self.read_aldb_record(walk.command, timeout))
+                if record is None:
+                    continue
+
+                device_id = record.get('id_high', '') + record.get('id_mid', '') \
+                            + record.get('id_low', '')
+                if device_id not in groups:
+                    groups[device_id] = []
+                    device = self.hub.known_device(device_id, groups)
+                    if device is None:
+                        lookups[device_id] = asyncio.ensure_future(self.id_request(device_id))
+                    else:
+                        yield device_id, device
+                groups[device_id].append(record.get('group', ''))
+
+                for device_id, lookup in list(lookups.items()):
+                    if lookup.done():
+                        del lookups[device_id]
+                        yield device_id, self.hub.linked_device(device_id, lookup, groups)
+
+            for device_id, lookup in list(lookups.items()):
+                await asyncio.wait([lookup])
+                del lookups[device_id]
+                yield device_id, self.hub.linked_device(device_id, lookup, groups)
+
+            if walk.complete:
+                for device_id, group_list in groups.items():
+                    registry.set_groups(device_id, group_list)
+            self.hub.linked_complete = walk.complete
+        finally:
+            for lookup in lookups.values():
+                lookup.cancel()
+            await self.run(registry.save)
+
+
+    async def read_aldb_record(self, command, timeout=ALDB_TIMEOUT):
+        """Send get first/next ALL-Link record and poll the buffer until the
+        0257 record shows up. Returns the record, None when there are no
+        more records or False on timeout"""
+        reader = self.hub.buffer_reader
+        mark = reader.mark()
+        await self.direct_command_hub(command, DISCOVERY)
+        deadline = time() + timeout
+        delay = POLL_MIN_DELAY
+        acked = False
+
+        while time() < deadline:
+            if self.hub.poller is None or not self.hub.poller.is_running():
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, POLL_MAX_DELAY)
+            await self.get_buffer_status()
+
+            records, mark = reader.messages_since(mark)
+            for record in records:
+                im_code = record.get('im_code', '')
+                if im_code == command[2:]:
+                    if record.get('ack_or_nak', '') == '15':
+                        return None
+                    acked = True
+                elif im_code == '57' and acked:
+                    return record
+
+        self.logger.info("read_aldb_record: timed out waiting for link record")
+        return False
+
+
+    async def identify(self, device_id):
+        """Return device identity from the registry, or from an id request
+        for unknown devices"""
+        device_id = device_id.upper()
+        identity = self.hub.registry.get(device_id)
+        if identity is not None:
+            return identity
+        dev_info = await self.id_request(device_id)
+        return await self.run(self.hub.register_identity, device_id, dev_info)
+
+
+    async def device(self, device_id):
+        """Create the async device object matching the device's category"""
+        kind = self.hub.device_kind(device_id, await self.identify(device_id))
+        if kind is None:
+            return None
+        return getattr(self, kind)(device_id)
+
+
+    def start_poller(self, interval=POLL_INTERVAL):
+        """Start the hub's background buffer poller"""
+        return self.hub.start_poller(interval)
+
+
+    def stop_poller(self):
+        """Stop the hub's background buffer poller"""
+        self.hub.stop_poller()
+
+
+    def subscribe(self, callback, id_from=None, im_code=None, cmd1=None, loop=None):
+        """Deliver new buffer messages to callback(record) on the event loop.
+        callback may be a plain function or a coroutine function"""
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        def deliver(record):
+            """Hand record from poller thread over to the loop"""
+            if asyncio.iscoroutinefunction(callback):
+                asyncio.run_coroutine_threadsafe(callback(record), loop)
+            else:
+                loop.call_soon_threadsafe(callback, record)
+
+        return self.hub.subscribe(deliver, id_from, im_code, cmd1)
+
+
+    def unsubscribe(self, subscription_id):
+        """Remove a buffer message subscription"""
+        return self.hub.unsubscribe(subscription_id)
+
+
+    def close(self):
+        """Stop the worker pools and close pooled connections"""
+        self.executor.shutdown(wait=False)
+        self.send_executor.shutdown(wait=False)
+        self.hub.close()
+
+
+    def group(self, group_id):
+        """Create async group object"""
+        return AsyncGroup(self, group_id)
+
+
+    def dimmer(self, device_id):
+        """Create async dimmer object"""
+        return AsyncDimmer(self, device_id)
+
+
+    def switch(self, device_id):
+        """Create async switch object"""
+        return AsyncSwitch(self, device_id)
+
+
+    def fan(self, device_id):
+        """Create async fan object"""
+        return AsyncFan(self, device_id)
+
+
+    def onoffoutlet(self, device_id):
+        """Create async outlet object"""
+        return AsyncOnOffOutlet(self, device_id)
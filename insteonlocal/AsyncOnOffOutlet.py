@@ -0,0 +1,74 @@
+import pprint
+from insteonlocal.Codec import OUTLET_BOTTOM_PAYLOAD
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+class AsyncOnOffOutlet():
+    """Creates an asyncio object representing an INSTEON On/Off Device With
+    Independent Top/Bottom like 2633-222 (2 39)"""
+    def __init__(self, hub, device_id):
+        self.device_id = device_id
+        self.hub = hub
+        self.logger = hub.logger
+
+
+    async def status(self, return_led=1):
+        """Get status from device"""
+        status = await self.hub.get_device_status(self.device_id, return_led)
+        self.logger.info("On/Off Outlet %s status: %s", self.device_id,
+                         pprint.pformat(status))
+        return status
+
+
+    async def command(self, name, cmd1, cmd2, extended_payload=None):
+        """Send command to outlet and wait for the response"""
+        self.logger.info("On/Off Outlet %s %s", self.device_id, name)
+
+        await self.hub.direct_command(self.device_id, cmd1, cmd2, extended_payload)
+        success = await self.hub.check_success(self.device_id, cmd1, cmd2)
+        if success:
+            self.logger.info("On/Off Outlet %s %s: command succeeded", self.device_id, name)
+            await self.hub.run(self.hub.hub.clear_device_command_cache, self.device_id)
+        else:
+            self.logger.error("On/Off Outlet %s %s: command failed", self.device_id, name)
+
+        return success
+
+
+    async def top_on(self):
+        """Turn top outlet on"""
+        return await self.command('top_on', '11', 'FF')
+
+
+    async def top_off(self):
+        """Turn top outlet off"""
+        return await self.command('top_off', '13', 'FF')
+
+
+    async def bottom_on(self):
+        """Turn bottom outlet on"""
+        return await self.command('bottom_on', '11', 'FF', OUTLET_BOTTOM_PAYLOAD)
+
+
+    async def bottom_off(self):
+        """Turn bottom outlet off"""
+        return await self.command('bottom_off', '13', 'FF', OUTLET_BOTTOM_PAYLOAD)
+
+
+    async def beep(self):
+        """Make outlet beep. Not all devices support this"""
+        self.logger.info("On/Off Outlet %s beep", self.device_id)
+
+        await self.hub.direct_command(self.device_id, '30', '00')
+        return await self.hub.check_success(self.device_id, '30', '00')
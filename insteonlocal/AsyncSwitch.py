@@ -0,0 +1,62 @@
+import pprint
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+class AsyncSwitch():
+    """Creates an asyncio Switch object representing an INSTEON Toggle Device"""
+    def __init__(self, hub, device_id):
+        self.device_id = device_id
+        self.hub = hub
+        self.logger = hub.logger
+
+
+    async def status(self, return_led=0):
+        """Get status from device"""
+        status = await self.hub.get_device_status(self.device_id, return_led)
+        self.logger.info("Switch %s status: %s", self.device_id,
+                         pprint.pformat(status))
+        return status
+
+
+    async def command(self, name, cmd1, cmd2):
+        """Send command to switch and wait for the response"""
+        self.logger.info("Switch %s %s", self.device_id, name)
+
+        await self.hub.direct_command(self.device_id, cmd1, cmd2)
+        success = await self.hub.check_success(self.device_id, cmd1, cmd2)
+        if success:
+            self.logger.info("Switch %s %s: command succeeded", self.device_id, name)
+            await self.hub.run(self.hub.hub.clear_device_command_cache, self.device_id)
+        else:
+            self.logger.error("Switch %s %s: command failed", self.device_id, name)
+
+        return success
+
+
+    async def on(self):
+        """Turn switch on"""
+        return await self.command('on', '11', 'FF')
+
+
+    async def off(self):
+        """Turn switch off"""
+        return await self.command('off', '13', 'FF')
+
+
+    async def beep(self):
+        """Make switch beep. Not all devices support this"""
+        self.logger.info("Switch %s beep", self.device_id)
+
+        await self.hub.direct_command(self.device_id, '30', '00')
+        return await self.hub.check_success(self.device_id, '30', '00')
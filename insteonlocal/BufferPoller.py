@@ -0,0 +1,179 @@
+import threading
+import itertools
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+POLL_INTERVAL = 0.5 #seconds
+
+class Subscription(object):
+    """Callback plus optional filters on id_from, im_code and cmd1. Each
+    filter may be a single value or a collection of values"""
+    def __init__(self, callback, id_from=None, im_code=None, cmd1=None):
+        self.callback = callback
+        self.id_from = self.make_filter(id_from)
+        self.im_code = self.make_filter(im_code)
+        self.cmd1 = self.make_filter(cmd1)
+
+
+    @staticmethod
+    def make_filter(value):
+        """Normalize a filter value into a set of upper case strings"""
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = [value]
+        return frozenset(v.upper() for v in value)
+
+
+    def matches(self, record):
+        """Check if message record passes this subscription's filters"""
+        if self.id_from is not None and record.get('id_from', '') not in self.id_from:
+            return False
+        if self.im_code is not None and record.get('im_code', '') not in self.im_code:
+            return False
+        if self.cmd1 is not None and record.get('cmd1', '') not in self.cmd1:
+            return False
+        return True
+
+
+class BufferPoller(object):
+    """Background thread that owns /buffstatus.xml. Each poll downloads the
+    buffer once through the hub's BufferReader, which parses only the
+    messages that are new since the last poll, and fans them out to
+    subscribers"""
+    def __init__(self, hub, interval=POLL_INTERVAL):
+        self.hub = hub
+        self.logger = hub.logger
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.snapshot_ready = threading.Condition(self.lock)
+        self.subscriptions = {}
+        self.subscription_ids = itertools.count(1)
+
+        self.msgs = []
+        self.poll_count = 0
+        self.error_count = 0
+        self.dispatched_count = 0
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+
+    def subscribe(self, callback, id_from=None, im_code=None, cmd1=None):
+        """Register callback(record) for new messages matching the filters.
+        Returns an id to pass to unsubscribe"""
+        subscription = Subscription(callback, id_from, im_code, cmd1)
+        with self.lock:
+            subscription_id = next(self.subscription_ids)
+            self.subscriptions[subscription_id] = subscription
+        return subscription_id
+
+
+    def unsubscribe(self, subscription_id):
+        """Remove a subscription"""
+        with self.lock:
+            return self.subscriptions.pop(subscription_id, None) is not None
+
+
+    def start(self):
+        """Start polling in a daemon thread"""
+        if self.is_running():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='insteonlocal-poller')
+        self.thread.daemon = True
+        self.thread.start()
+        self.logger.info("BufferPoller started with interval %s", self.interval)
+
+
+    def stop(self, timeout=None):
+        """Stop polling and wait for the thread to finish"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.thread = None
+        with self.lock:
+            self.snapshot_ready.notify_all()
+        self.logger.info("BufferPoller stopped")
+
+
+    def is_running(self):
+        """Check if poll thread is alive"""
+        return self.thread is not None and self.thread.is_alive() \
+               and not self.stop_event.is_set()
+
+
+    def run(self):
+        """Poll loop"""
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as err: # pylint: disable=broad-except
+                self.error_count += 1
+                self.logger.error("BufferPoller: poll failed: %s", err)
+            self.stop_event.wait(self.interval)
+
+
+    def poll(self):
+        """Read new buffer messages once and dispatch them"""
+        new_msgs = self.hub.read_new_messages()
+        msgs = self.hub.buffer_reader.messages()
+
+        with self.lock:
+            self.msgs = msgs
+            self.poll_count += 1
+            subscriptions = list(self.subscriptions.values())
+            self.snapshot_ready.notify_all()
+
+        self.dispatch(new_msgs, subscriptions)
+        return new_msgs
+
+
+    def dispatch(self, records, subscriptions):
+        """Send records to matching subscribers"""
+        for record in records:
+            for subscription in subscriptions:
+                if not subscription.matches(record):
+                    continue
+                self.dispatched_count += 1
+                try:
+                    subscription.callback(record)
+                except Exception as err: # pylint: disable=broad-except
+                    self.logger.error("BufferPoller: subscriber failed: %s", err)
+
+
+    def wait_for_snapshot(self, timeout=None):
+        """Wait for the next completed poll and return the parsed messages
+        currently in the buffer"""
+        if timeout is None:
+            timeout = self.interval + self.hub.timeout
+        with self.lock:
+            poll_count = self.poll_count
+            self.snapshot_ready.wait_for(
+                lambda: self.poll_count != poll_count or not self.is_running(),
+                timeout)
+            return self.msgs
+
+
+    def stats(self):
+        """Return poller counters"""
+        with self.lock:
+            return {
+                'polls': self.poll_count,
+                'errors': self.error_count,
+                'dispatched': self.dispatched_count,
+                'subscriptions': len(self.subscriptions),
+                'buffered_msgs': len(self.msgs),
+            }
@@ -0,0 +1,194 @@
+import threading
+from collections import deque
+from insteonlocal.MessageParser import parse_messages
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+RING_BUFFER_LENGTH = 202 # 2015 hub: 200 chars of ring plus 2 char write pointer
+RING_DATA_LENGTH = 200
+MAX_MESSAGE_LENGTH = 50 # longest message, 0251 extended received
+HISTORY_SIZE = 32 # parsed messages kept as the current buffer view
+
+def resync(text):
+    """Skip a partly overwritten message at the start of ring text. Returns
+    text from the first position where complete messages parse back to back
+    up to the end of the text or the zero fill"""
+    for start in range(0, min(len(text), MAX_MESSAGE_LENGTH)):
+        if text[start:start + 2] != '02':
+            continue
+        records, consumed = parse_messages(text[start:])
+        if records and 'im_code_desc' in records[0] \
+           and (start + consumed == len(text) or text.startswith('0000', start + consumed)):
+            return text[start:]
+    return ''
+
+
+class BufferReader(object):
+    """Stateful reader for the hub buffer. Remembers where the previous read
+    stopped and parses only text written since then. For the 2015 hub's
+    ring buffer it unwraps text written across the end of the ring and
+    reports when the write pointer lapped us and messages were lost"""
+    def __init__(self, logger, history=HISTORY_SIZE):
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.msgs = deque(maxlen=history)
+
+        # 2015 ring state
+        self.ring_data = None
+        self.ring_pointer = 0
+        # older hubs' linear buffer, text already parsed
+        self.linear_text = ''
+        # start of a ring message cut off by the previous read
+        self.carry = ''
+
+        self.lost = False
+        # the last read may not continue the previous one: the ring lapped,
+        # the first read found it wrapped, or the buffer was cleared
+        self.gap = False
+        self.reads = 0
+        self.parsed_chars = 0
+        self.new_msgs = 0
+        self.laps = 0
+        self.resets = 0
+
+
+    def read(self, raw_text):
+        """Take the full buffer text and return records for messages new
+        since the previous read"""
+        with self.lock:
+            self.reads += 1
+            self.gap = False
+            if len(raw_text) == RING_BUFFER_LENGTH:
+                new_text = self.carry + self.unwrap_ring(raw_text)
+                records, consumed = parse_messages(new_text, self.logger)
+                leftover = new_text[consumed:]
+                if leftover.startswith('02') and len(leftover) < MAX_MESSAGE_LENGTH:
+                    self.carry = leftover
+                else:
+                    self.carry = ''
+            else:
+                new_text = self.advance_linear(raw_text)
+                records, consumed = parse_messages(new_text, self.logger)
+                # remember only complete messages, so a message cut off at
+                # the end or padding overwritten later is read again
+                self.linear_text = raw_text[:len(raw_text) - len(new_text) + consumed]
+
+            self.parsed_chars += len(new_text)
+            self.new_msgs += len(records)
+            self.msgs.extend(records)
+            return records
+
+
+    def unwrap_ring(self, raw_text):
+        """Return ring text written since the last read, in write order"""
+        data = raw_text[:RING_DATA_LENGTH]
+        pointer = int(raw_text[RING_DATA_LENGTH:], 16) % RING_DATA_LENGTH
+        last_data = self.ring_data
+        last_pointer = self.ring_pointer
+        self.ring_data = data
+        self.ring_pointer = pointer
+        self.lost = False
+
+        if last_data is None:
+            # first read, nothing to compare against. Unless the ring has
+            # never wrapped and is still zero filled after the pointer, text
+            # from the pointer on was written before the text ahead of it
+            self.logger.info('BufferReader: first ring read, pointer %s', pointer)
+            if not data[pointer:].strip('0'):
+                return resync(data[0:pointer])
+            self.gap = True
+            return resync(data[pointer:] + data[:pointer])
+
+        if pointer >= last_pointer:
+            new_text = data[last_pointer:pointer]
+            untouched = ((0, last_pointer), (pointer, RING_DATA_LENGTH))
+        else:
+            new_text = data[last_pointer:] + data[:pointer]
+            untouched = ((pointer, last_pointer),)
+
+        # text outside the newly written span must be unchanged, otherwise
+        # the writer went all the way around the ring between reads
+        for start, end in untouched:
+            if data[start:end] != last_data[start:end]:
+                self.lost = True
+                self.gap = True
+                self.laps += 1
+                self.carry = ''
+                self.logger.error('BufferReader: hub buffer lapped since last read, '
+                                  'messages were lost')
+                # the whole ring is newer than our last read
+                return resync(data[pointer:] + data[:pointer])
+
+        return new_text
+
+
+    def advance_linear(self, raw_text):
+        """Return linear buffer text appended since the last read"""
+        self.lost = False
+        if self.linear_text and raw_text.startswith(self.linear_text):
+            return raw_text[len(self.linear_text):]
+
+        # buffer was cleared, start over
+        if self.linear_text:
+            self.resets += 1
+            self.gap = True
+        self.msgs.clear()
+        return raw_text
+
+
+    def messages(self):
+        """Return the records currently in the buffer view"""
+        with self.lock:
+            return list(self.msgs)
+
+
+    def mark(self):
+        """Return the current position in the message stream, to pass to
+        messages_since later"""
+        with self.lock:
+            return self.new_msgs
+
+
+    def messages_since(self, mark):
+        """Return records parsed since mark that are still in the buffer
+        view, plus a new mark"""
+        with self.lock:
+            count = min(self.new_msgs - mark, len(self.msgs))
+            if count <= 0:
+                return [], self.new_msgs
+            return list(self.msgs)[-count:], self.new_msgs
+
+
+    def reset(self):
+        """Forget all read state, e.g. after clearing the hub buffer"""
+        with self.lock:
+            self.msgs.clear()
+            self.ring_data = None
+            self.ring_pointer = 0
+            self.linear_text = ''
+            self.carry = ''
+            self.resets += 1
+
+
+    def stats(self):
+        """Return reader counters"""
+        with self.lock:
+            return {
+                'reads': self.reads,
+                'parsed_chars': self.parsed_chars,
+                'new_msgs': self.new_msgs,
+                'laps': self.laps,
+                'resets': self.resets,
+                'lost': self.lost,
+            }
@@ -0,0 +1,80 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Encoder for outgoing insteon frames. Everything that can be is looked up
+# in tables built at import, so encoding a command is a few string joins.
+
+SEND_MESSAGE = '0262'
+STANDARD_FLAGS = '0F' # direct message, max hops 3
+EXTENDED_FLAGS = '1F' # extended direct message, max hops 3
+EXTENDED_DATA_LENGTH = 13 # user data bytes before the checksum byte
+
+BYTE_HEX = tuple(format(value, '02X') for value in range(256))
+
+# brightness percentage 0-100 to the cmd2 on level 00-FF
+LEVEL_HEX = tuple(BYTE_HEX[level * 255 // 100] for level in range(101))
+
+# fan speed name to the FanLinc cmd2 speed
+FAN_LEVEL_HEX = {'off': '00', 'low': '55', 'medium': 'AA', 'high': 'FF'}
+
+# I2CS checksum: two's complement of the low byte of cmd1 + cmd2 + data
+CHECKSUM_HEX = tuple(BYTE_HEX[-value & 0xFF] for value in range(256))
+
+EXTENDED_PADDING = '00' * EXTENDED_DATA_LENGTH
+
+# extended data selecting the bottom outlet of an OnOffOutlet
+OUTLET_BOTTOM_PAYLOAD = '02000000000000000000000000'
+
+def level_to_hex(level):
+    """Convert brightness percentage into the cmd2 level, clamped to 0-100"""
+    level = int(level)
+    if level < 0:
+        level = 0
+    elif level > 100:
+        level = 100
+    return LEVEL_HEX[level]
+
+
+def checksum(cmd1, cmd2, data):
+    """Extended message checksum over hex cmd1, cmd2 and user data"""
+    return CHECKSUM_HEX[sum(bytes.fromhex(cmd1 + cmd2 + data)) & 0xFF]
+
+
+def encode_standard(device_id, cmd1, cmd2):
+    """Standard direct message to send to the IM, as hex"""
+    return SEND_MESSAGE + device_id + STANDARD_FLAGS + cmd1 + cmd2
+
+
+def encode_extended(device_id, cmd1, cmd2, data=''):
+    """Extended direct message with I2CS checksum, as hex. data is up to 13
+    user data bytes in hex and is zero padded"""
+    data = (data + EXTENDED_PADDING)[:EXTENDED_DATA_LENGTH * 2]
+    return (SEND_MESSAGE + device_id + EXTENDED_FLAGS + cmd1 + cmd2 + data
+            + checksum(cmd1, cmd2, data))
+
+
+def encode_direct(device_id, cmd1, cmd2, extended_payload=None):
+    """Standard or extended (if a payload is passed) direct message, as hex"""
+    if extended_payload:
+        return encode_extended(device_id, cmd1, cmd2, extended_payload)
+    return encode_standard(device_id, cmd1, cmd2)
+
+
+def encode_scene(cmd1, group_id):
+    """Group (scene) command as sent to the hub's /0? endpoint"""
+    return cmd1 + group_id
+
+
+def to_bytes(frame):
+    """Raw bytes of a hex frame, e.g. for a serial PLM"""
+    return bytes.fromhex(frame)
@@ -0,0 +1,223 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from time import time
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+CACHE_SIZE = 1024 # entries
+MAX_STALE = 300 #seconds an expired entry may still be served while refreshing
+CACHE_FILE = '.state'
+
+# Cache backends store command responses per device under a command key.
+# get returns {'ttl': expiry timestamp, 'response': response} or None.
+# Expired entries are still returned so callers can serve them stale while
+# a refresh runs.
+
+class MemoryCache(object):
+    """In-process TTL+LRU command response cache with a bounded size"""
+    def __init__(self, max_entries=CACHE_SIZE, max_stale=MAX_STALE):
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.device_keys = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.sets = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def get(self, device_id, key):
+        """Return cached entry or None"""
+        now = time()
+        with self.lock:
+            entry = self.entries.get((device_id, key))
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry['ttl'] + self.max_stale < now:
+                self.remove((device_id, key))
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end((device_id, key))
+            if entry['ttl'] < now:
+                self.stale += 1
+            else:
+                self.hits += 1
+            return entry
+
+
+    def set(self, device_id, key, response, ttl):
+        """Store response for ttl seconds"""
+        with self.lock:
+            self.sets += 1
+            self.entries[(device_id, key)] = {'ttl': int(time()) + ttl, 'response': response}
+            self.entries.move_to_end((device_id, key))
+            self.device_keys.setdefault(device_id, set()).add(key)
+
+            while len(self.entries) > self.max_entries:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.evictions += 1
+
+
+    def remove(self, entry_key):
+        """Drop one entry. Caller holds the lock"""
+        self.entries.pop(entry_key, None)
+        device_id, key = entry_key
+        keys = self.device_keys.get(device_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.device_keys[device_id]
+
+
+    def has_device(self, device_id):
+        """Check if anything is cached for the device"""
+        with self.lock:
+            return device_id in self.device_keys
+
+
+    def clear_device(self, device_id):
+        """Drop all entries for the device"""
+        with self.lock:
+            for key in list(self.device_keys.get(device_id, ())):
+                self.remove((device_id, key))
+
+
+    def stats(self):
+        """Return cache counters"""
+        with self.lock:
+            lookups = self.hits + self.stale + self.misses
+            return {
+                'backend': 'memory',
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale': self.stale,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'sets': self.sets,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class FileCache(object):
+    """Persistent cache keeping one <device>.state JSON file per device, so
+    several processes can share cached responses"""
+    def __init__(self, logger, cache_dir=None):
+        self.logger = logger
+        self.cache_dir = cache_dir or tempfile.gettempdir()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.sets = 0
+
+
+    def filename(self, device_id):
+        """Path of the device's state file"""
+        return os.path.join(self.cache_dir, device_id + CACHE_FILE)
+
+
+    def get_cache_from_file(self, device_id):
+        """Load the device's state file"""
+        filename = self.filename(device_id)
+        attempts = 0
+
+        if not os.path.exists(filename):
+            return {}
+
+        while True:
+            try:
+                with open(filename) as cachefile:
+                    return json.load(cachefile)
+            except ValueError:
+                self.logger.info("couldn't decode cachefile")
+                if attempts >= 3:
+                    return {}
+                attempts += 1
+            except (IOError, OSError):
+                return {}
+
+
+    def write_cache_file(self, cache, device_id):
+        """Atomically replace the device's state file"""
+        filename = self.filename(device_id)
+        self.logger.info("writing cache file for %s", device_id)
+
+        with open(filename + '.temp', 'w') as cachefile:
+            json.dump(cache, cachefile)
+
+        os.replace(filename + '.temp', filename)
+
+
+    def get(self, device_id, key):
+        """Return cached entry or None"""
+        command_cache = self.get_cache_from_file(device_id)
+        entry = command_cache.get(device_id, {}).get(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            elif entry['ttl'] < time():
+                self.stale += 1
+            else:
+                self.hits += 1
+        return entry
+
+
+    def set(self, device_id, key, response, ttl):
+        """Store response for ttl seconds"""
+        with self.lock:
+            self.sets += 1
+            command_cache = self.get_cache_from_file(device_id)
+            command_cache.setdefault(device_id, {})
+            command_cache[device_id][key] = {'ttl': int(time()) + ttl,
+                                             'response': dict(response)}
+            self.write_cache_file(command_cache, device_id)
+
+
+    def has_device(self, device_id):
+        """Check if a state file exists for the device"""
+        return os.path.exists(self.filename(device_id))
+
+
+    def clear_device(self, device_id):
+        """Empty the device's state file"""
+        with self.lock:
+            self.write_cache_file({device_id: {}}, device_id)
+
+
+    def stats(self):
+        """Return cache counters"""
+        with self.lock:
+            lookups = self.hits + self.stale + self.misses
+            return {
+                'backend': 'file',
+                'hits': self.hits,
+                'stale': self.stale,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'sets': self.sets,
+            }
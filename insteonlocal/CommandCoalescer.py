@@ -0,0 +1,113 @@
+import threading
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+COALESCE_WINDOW = 0.0 #seconds a level command waits for newer ones before queuing
+
+# commands that set the load to a level given in cmd2, so a newer one makes
+# an unsent older one pointless. On/off without a level (12, 13, 14) are
+# separate intents and are always sent, dropping an unsent level change
+LEVEL_COMMANDS = ('11', '21')
+
+def is_level_command(cmd1, extended_payload=None):
+    """Check if a direct command can be replaced by a newer one for the
+    same device. Extended commands address sub-loads and are never merged"""
+    return cmd1 in LEVEL_COMMANDS and not extended_payload
+
+
+class CommandSlot(object):
+    """The one unsent level command of a device. Holds the newest command
+    until the scheduler lets the slot through"""
+    def __init__(self, device_id, pending, command_url):
+        self.device_id = device_id
+        self.pending = pending
+        self.command_url = command_url
+        self.replaced = 0
+
+
+class CommandCoalescer(object):
+    """Keeps at most one unsent level command per device. A newer level
+    command for a device whose previous one is still waiting for its turn
+    takes that command's place instead of being queued behind it"""
+    def __init__(self, logger, window=COALESCE_WINDOW):
+        self.logger = logger
+        self.window = window
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.opened = 0
+        self.coalesced = 0
+
+
+    def replace(self, device_id, pending, command_url):
+        """Put a command in place of the device's unsent one. Returns the
+        replaced pending command, or None if nothing is waiting and the
+        command has to be sent by the caller"""
+        with self.lock:
+            slot = self.slots.get(device_id)
+            if slot is None:
+                return None
+            replaced = slot.pending
+            slot.pending = pending
+            slot.command_url = command_url
+            slot.replaced += 1
+            self.coalesced += 1
+
+        self.logger.info("coalescer: device %s command replaced by %s",
+                         device_id, command_url)
+        return replaced
+
+
+    def cancel(self, device_id):
+        """Drop the device's unsent command, for a newer command that is
+        sent without a slot. Returns the dropped pending command or None"""
+        with self.lock:
+            slot = self.slots.pop(device_id, None)
+            if slot is None:
+                return None
+            replaced = slot.pending
+            slot.pending = None
+            slot.command_url = None
+            self.coalesced += 1
+
+        self.logger.info("coalescer: device %s unsent command dropped", device_id)
+        return replaced
+
+
+    def open(self, device_id, pending, command_url):
+        """Start a slot for a command the caller is about to send"""
+        slot = CommandSlot(device_id, pending, command_url)
+        with self.lock:
+            self.slots[device_id] = slot
+            self.opened += 1
+        return slot
+
+
+    def take(self, slot):
+        """Close the slot when its turn to be sent comes. Returns the newest
+        (command_url, pending), both None if the slot was cancelled"""
+        with self.lock:
+            if self.slots.get(slot.device_id) is slot:
+                del self.slots[slot.device_id]
+            return slot.command_url, slot.pending
+
+
+    def stats(self):
+        """Return coalescing counters"""
+        with self.lock:
+            return {
+                'waiting': len(self.slots),
+                'opened': self.opened,
+                'coalesced': self.coalesced,
+                'window': self.window,
+            }
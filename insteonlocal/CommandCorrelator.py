@@ -0,0 +1,323 @@
+import threading
+from concurrent.futures import Future
+from time import time
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+ACK_TIMEOUT = 5 #seconds
+ANY = None # wildcard for expected cmd1/cmd2
+
+# commands whose direct ack carries data instead of echoing cmd1/cmd2.
+# status request (19) answers with ALDB delta in cmd1 and level in cmd2
+DATA_RESPONSE_COMMANDS = ('19',)
+
+ACK_FLAGS = ('2',) # direct ack
+NAK_FLAGS = ('A',) # direct nak
+
+def hop_count(record):
+    """Return (hops taken, max hops) from the message flags of a received
+    standard or extended message, or None for other records"""
+    im_code = record.get('im_code', '')
+    if im_code == '50':
+        flags = record.get('flag2', '')
+    elif im_code == '51':
+        flags = record.get('flags', '')[1:2]
+    else:
+        return None
+    try:
+        value = int(flags, 16)
+    except ValueError:
+        return None
+    max_hops = value & 3
+    hops_left = (value >> 2) & 3
+    return max_hops - hops_left, max_hops
+
+
+class CommandNak(Exception):
+    """Raised through a pending command's future when the IM or the device
+    returned a NAK"""
+    def __init__(self, pending, record):
+        super(CommandNak, self).__init__("NAK for device %s cmd1 %s cmd2 %s" %
+                                         (pending.device_id, pending.cmd1, pending.cmd2))
+        self.record = record
+
+
+class CommandSuperseded(Exception):
+    """Raised through a pending command's future when a newer command for
+    the device took its place before it was sent, so it never ran"""
+    def __init__(self, pending, final):
+        super(CommandSuperseded, self).__init__(
+            "device %s cmd1 %s cmd2 %s replaced by cmd1 %s cmd2 %s before it was sent" %
+            (pending.device_id, pending.cmd1, pending.cmd2, final.cmd1, final.cmd2))
+        self.final = final
+
+
+class PendingCommand(object):
+    """A sent direct command waiting for its ack"""
+    def __init__(self, device_id, cmd1, cmd2, expect_cmd1, expect_cmd2, deadline):
+        self.device_id = device_id
+        self.cmd1 = cmd1
+        self.cmd2 = cmd2
+        self.expect_cmd1 = expect_cmd1
+        self.expect_cmd2 = expect_cmd2
+        self.deadline = deadline
+        self.sent_at = time()
+        self.mark = None # buffer reader position when posted, None until then
+        self.echoed = False # the IM echo of this command was read
+        self.settled = threading.Event() # set once posted or known never to be
+        self.send_error = None # what stopped the post, if anything
+        self.extended = False # set by the sender for extended messages
+        self.local = False # completed without an ack of its own, skipped or superseded
+        self.future = Future()
+
+
+    @property
+    def key(self):
+        """Lookup key for this command"""
+        return (self.device_id, self.cmd1, self.cmd2)
+
+
+    def is_echo(self, record):
+        """Check if record is the IM echo of this command"""
+        return record.get('im_code', '') == '62' \
+               and record.get('id', '') == self.device_id \
+               and record.get('cmd1', '') == self.cmd1 \
+               and record.get('cmd2', '') == self.cmd2
+
+
+    def is_response(self, record):
+        """Check if record is a direct ack/nak from this device. Returns
+        'ack', 'nak' or None"""
+        im_code = record.get('im_code', '')
+        if im_code == '50':
+            flag = record.get('flag1', '')
+        elif im_code == '51':
+            flag = record.get('flags', '')[0:1]
+        else:
+            return None
+
+        if record.get('id_from', '') != self.device_id:
+            return None
+
+        cmd1 = record.get('cmd1', '')
+        if flag in NAK_FLAGS:
+            if self.expect_cmd1 is ANY or cmd1 == self.expect_cmd1:
+                return 'nak'
+            return None
+
+        if flag not in ACK_FLAGS:
+            return None
+        if self.expect_cmd1 is not ANY and cmd1 != self.expect_cmd1:
+            return None
+        if self.expect_cmd2 is not ANY and record.get('cmd2', '') != self.expect_cmd2:
+            return None
+        return 'ack'
+
+
+class CommandCorrelator(object):
+    """Matches buffer messages to sent commands. Each sent command gets a
+    pending future keyed by (device_id, cmd1, cmd2) that resolves on the
+    matching ack, fails fast on a nak and is dropped after its deadline.
+    Ack latency, naks and timeouts go to metrics if passed, and each ack
+    is handed to on_ack(pending, record)"""
+    def __init__(self, logger, metrics=None, on_ack=None):
+        self.logger = logger
+        self.metrics = metrics
+        self.on_ack = on_ack
+        # futures are completed under the lock so concurrent match calls
+        # can't both complete one. Reentrant so done callbacks may call back
+        self.lock = threading.RLock()
+        self.pending = {}
+        self.acks = 0
+        self.naks = 0
+        self.expired = 0
+        self.skipped = 0
+        self.superseded = 0
+
+
+    def register(self, device_id, cmd1, cmd2, timeout=ACK_TIMEOUT, fresh=False):
+        """Get or create the pending entry for a command. Waiters get the
+        entry of the last sent command, even if it completed already.
+        Senders pass fresh=True to start over once that entry is done"""
+        device_id = device_id.upper()
+        key = (device_id, cmd1, cmd2)
+        deadline = time() + timeout
+        with self.lock:
+            pending = self.pending.get(key)
+            if pending is not None and not (fresh and pending.future.done()):
+                pending.deadline = max(pending.deadline, deadline)
+                return pending
+
+            if cmd1 in DATA_RESPONSE_COMMANDS:
+                expect_cmd1, expect_cmd2 = ANY, ANY
+            else:
+                expect_cmd1, expect_cmd2 = cmd1, cmd2
+            pending = PendingCommand(device_id, cmd1, cmd2, expect_cmd1,
+                                     expect_cmd2, deadline)
+            self.pending[key] = pending
+            return pending
+
+
+    def release(self, pending):
+        """Forget a pending command once its caller is done with it"""
+        with self.lock:
+            if self.pending.get(pending.key) is pending:
+                del self.pending[pending.key]
+
+
+    def posted(self, pending, mark):
+        """Note that pending's command is about to be posted. mark is the
+        buffer reader position, messages read before it are not its
+        responses"""
+        with self.lock:
+            if pending.mark is None:
+                pending.mark = mark
+                pending.sent_at = time()
+        pending.settled.set()
+
+
+    def match(self, records, first, gap=False):
+        """Resolve pending commands from newly read records, in buffer
+        order. first is the reader position of records[0]. A command only
+        counts responses read after it was posted and after its own echo, so
+        an identical echo and ack still sitting in the buffer from an
+        earlier command are not mistaken for its own. gap says the records
+        may not follow the previous read, so echoes of commands posted
+        before it may have been overwritten and aren't required"""
+        now = time()
+        with self.lock:
+            pendings = [pending for pending in self.pending.values()
+                        if pending.mark is not None and not pending.future.done()]
+
+        for pending in pendings:
+            if gap and pending.mark <= first:
+                pending.echoed = True
+            for index, record in enumerate(records):
+                if first + index < pending.mark:
+                    continue
+                if pending.is_echo(record):
+                    if record.get('ack_or_nak', '') == '15':
+                        self.fail(pending, record)
+                        break
+                    pending.echoed = True
+                    continue
+                if not pending.echoed:
+                    continue
+                response = pending.is_response(record)
+                if response == 'ack':
+                    self.resolve(pending, record)
+                    break
+                elif response == 'nak':
+                    self.fail(pending, record)
+                    break
+
+        self.prune(now)
+
+
+    def resolve(self, pending, record):
+        """Complete pending command with its ack record. No-op if it is
+        complete already"""
+        with self.lock:
+            if pending.future.done():
+                return
+            self.acks += 1
+            pending.future.set_result(record)
+        latency = time() - pending.sent_at
+        self.logger.info("correlator: ack for device %s cmd1 %s cmd2 %s after %.3fs",
+                         pending.device_id, pending.cmd1, pending.cmd2, latency)
+        if self.metrics is not None:
+            self.metrics.observe('ack_latency_seconds', latency,
+                                 device=pending.device_id, cmd1=pending.cmd1)
+        if self.on_ack is not None:
+            try:
+                self.on_ack(pending, record)
+            except Exception as err: # pylint: disable=broad-except
+                self.logger.error("correlator: ack listener failed: %s", err)
+
+
+    def skip(self, pending, record):
+        """Complete a command that was not sent because the device is known
+        to be in the requested state already. Waiters see record as the ack;
+        ack listeners and latency metrics are not told"""
+        with self.lock:
+            if pending.future.done():
+                return
+            self.skipped += 1
+            pending.local = True
+            pending.future.set_result(record)
+
+
+    def supersede(self, pending, final):
+        """Fail an unsent command that final replaced. Its caller learns it
+        never ran instead of getting final's ack for a different level"""
+        if pending is final:
+            return
+        with self.lock:
+            if pending.future.done():
+                return
+            self.superseded += 1
+            pending.local = True
+            pending.future.set_exception(CommandSuperseded(pending, final))
+        pending.settled.set()
+
+
+    def abandon(self, pending, err):
+        """Fail a command that will never be posted because sending it
+        raised err"""
+        pending.send_error = err
+        with self.lock:
+            if not pending.future.done():
+                pending.future.set_exception(err)
+        pending.settled.set()
+
+
+    def fail(self, pending, record):
+        """Fail pending command with a nak. No-op if it is complete already"""
+        with self.lock:
+            if pending.future.done():
+                return
+            self.naks += 1
+            pending.future.set_exception(CommandNak(pending, record))
+        if self.metrics is not None:
+            self.metrics.inc('naks_total', device=pending.device_id, cmd1=pending.cmd1)
+        self.logger.info("correlator: nak for device %s cmd1 %s cmd2 %s",
+                         pending.device_id, pending.cmd1, pending.cmd2)
+
+
+    def prune(self, now=None):
+        """Drop pending commands past their deadline"""
+        now = now or time()
+        with self.lock:
+            for key, pending in list(self.pending.items()):
+                if pending.deadline < now:
+                    del self.pending[key]
+                    if not pending.future.done():
+                        self.expired += 1
+                        if self.metrics is not None:
+                            self.metrics.inc('ack_timeouts_total', device=pending.device_id,
+                                             cmd1=pending.cmd1)
+                        pending.future.cancel()
+
+
+    def stats(self):
+        """Return correlation counters"""
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'acks': self.acks,
+                'naks': self.naks,
+                'expired': self.expired,
+                'skipped': self.skipped,
+                'superseded': self.superseded,
+            }
@@ -0,0 +1,137 @@
+import threading
+from collections import deque
+from time import time
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# priority classes, lower goes first
+INTERACTIVE = 0
+SCENE = 1
+STATUS = 2
+DISCOVERY = 3
+PRIORITY_NAMES = ('interactive', 'scene', 'status', 'discovery')
+
+# a standard insteon message takes about 50ms on the powerline plus
+# retransmits and the ack, so a handful per second keeps the hub responsive
+COMMAND_RATE = 4.0 # commands per second
+COMMAND_BURST = 2 # commands that may go out back to back after a quiet period
+
+class TokenBucket(object):
+    """Token bucket rate limiter. Caller holds the scheduler lock"""
+    def __init__(self, rate=COMMAND_RATE, burst=COMMAND_BURST):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time()
+
+
+    def delay(self, now):
+        """Seconds until a token is available, 0 if one is available now"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+    def take(self):
+        """Consume one token"""
+        self.tokens -= 1
+
+
+class CommandScheduler(object):
+    """Orders outgoing hub commands by priority class and paces them with a
+    token bucket. There is no dispatcher thread: each caller waits until its
+    command is first in the highest non-empty priority queue and a token is
+    free, then sends it from its own thread"""
+    def __init__(self, logger, rate=COMMAND_RATE, burst=COMMAND_BURST):
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.turn = threading.Condition(self.lock)
+        self.bucket = TokenBucket(rate, burst)
+        self.queues = [deque() for _ in PRIORITY_NAMES]
+
+        self.sent = [0] * len(PRIORITY_NAMES)
+        self.total_wait = [0.0] * len(PRIORITY_NAMES)
+        self.max_wait = [0.0] * len(PRIORITY_NAMES)
+
+
+    def submit(self, func, *args, **kwargs):
+        """Wait for this command's turn, then run func(*args) and return its
+        result. Pass priority=<class> to pick the queue, default INTERACTIVE"""
+        priority = kwargs.pop('priority', INTERACTIVE)
+        ticket = object()
+        queue = self.queues[priority]
+        queued_at = time()
+
+        with self.lock:
+            queue.append(ticket)
+            try:
+                while True:
+                    if self.next_ticket() is ticket:
+                        delay = self.bucket.delay(time())
+                        if not delay:
+                            break
+                        self.turn.wait(delay)
+                    else:
+                        self.turn.wait()
+            except BaseException:
+                queue.remove(ticket)
+                self.turn.notify_all()
+                raise
+
+            queue.popleft()
+            self.bucket.take()
+            waited = time() - queued_at
+            self.sent[priority] += 1
+            self.total_wait[priority] += waited
+            self.max_wait[priority] = max(self.max_wait[priority], waited)
+            self.turn.notify_all()
+
+        if waited > 1:
+            self.logger.info("scheduler: %s command waited %.2fs",
+                             PRIORITY_NAMES[priority], waited)
+        return func(*args, **kwargs)
+
+
+    def next_ticket(self):
+        """Head of the highest priority non-empty queue. Caller holds the lock"""
+        for queue in self.queues:
+            if queue:
+                return queue[0]
+        return None
+
+
+    def set_rate(self, rate, burst=None):
+        """Retune the rate limit"""
+        with self.lock:
+            self.bucket.rate = float(rate)
+            if burst is not None:
+                self.bucket.capacity = float(burst)
+            self.turn.notify_all()
+
+
+    def stats(self):
+        """Return per priority class queue depth, sent count and wait times"""
+        with self.lock:
+            stats = {'rate': self.bucket.rate, 'burst': self.bucket.capacity}
+            for priority, name in enumerate(PRIORITY_NAMES):
+                sent = self.sent[priority]
+                stats[name] = {
+                    'queued': len(self.queues[priority]),
+                    'sent': sent,
+                    'avg_wait': self.total_wait[priority] / sent if sent else 0.0,
+                    'max_wait': self.max_wait[priority],
+                }
+            return stats
@@ -0,0 +1,122 @@
+import json
+import pkgutil
+import threading
+from collections import OrderedDict
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+OUTLET_CATEGORY = 'FE'
+OUTLET_SUBCATS = ('08', '39') # switch category subcats reported as outlets
+FANLINC_SUBCAT = '2E' # dimmer category subcat of the FanLinc
+
+CATALOG_LOCK = threading.Lock()
+CATALOG = [None]
+
+def get_catalog():
+    """Return the process wide catalog, building it on first use"""
+    if CATALOG[0] is None:
+        with CATALOG_LOCK:
+            if CATALOG[0] is None:
+                CATALOG[0] = DeviceCatalog.from_package()
+    return CATALOG[0]
+
+
+def load_json(name):
+    """Load a json data file shipped with the package"""
+    raw = pkgutil.get_data('insteonlocal', 'data/' + name)
+    return json.loads(raw.decode('utf-8'))
+
+
+class DeviceCatalog(object):
+    """Device categories and models with lookup indexes by cat:subcat,
+    product key, SKU and category type. Read only once built, so one
+    instance is shared by all hubs"""
+    def __init__(self, categories, models):
+        self.categories = categories
+        self.models = models
+
+        self.by_key = {}
+        self.by_sku = {}
+        for model in models.values():
+            # models without a product key are only found by cat:subcat
+            if model.get('key'):
+                self.by_key.setdefault(model['key'].upper(), model)
+            if model.get('sku'):
+                self.by_sku.setdefault(model['sku'].upper(), []).append(model)
+
+        self.by_type = {}
+        for cat, category in categories.items():
+            self.by_type.setdefault(category['type'].lower(), []).append(cat)
+
+
+    @classmethod
+    def from_package(cls):
+        """Build the catalog from the json files shipped in insteonlocal/data"""
+        return cls(load_json('device_categories.json'), load_json('device_models.json'))
+
+
+    def category(self, cat, subcat=None):
+        """Return the category record for cat, or False if unknown. Outlet
+        subcats of the switch category get the outlet category"""
+        if cat == '02' and subcat in OUTLET_SUBCATS:
+            return self.categories[OUTLET_CATEGORY]
+        return self.categories.get(cat, False)
+
+
+    def model(self, cat, sub_cat, key=''):
+        """Return the model record by cat:subcat, falling back to product
+        key, or False if unknown"""
+        model = self.models.get(cat + ':' + sub_cat)
+        if model is None and key:
+            model = self.by_key.get(key.upper())
+        return model or False
+
+
+    def models_by_sku(self, sku):
+        """Return all model records sold under sku"""
+        return list(self.by_sku.get(sku.upper(), ()))
+
+
+    def categories_by_type(self, cat_type):
+        """Return category ids with the given type, e.g. dimmer"""
+        return list(self.by_type.get(cat_type.lower(), ()))
+
+
+    def describe(self, cat, sub_cat):
+        """Return category and model names for cat/subcat"""
+        category = self.category(cat, sub_cat) or {}
+        model = self.model(cat, sub_cat) or {}
+        return {
+            'cat_name': category.get('name', 'unknown'),
+            'cat_type': category.get('type', 'unknown'),
+            'model_name': model.get('name', 'unknown'),
+            'cat': cat,
+            'sub_cat': sub_cat,
+            'sku': model.get('sku', 'unknown'),
+        }
+
+
+    def classify(self, records):
+        """Describe devices from a list of id request responses. The
+        broadcast response carries cat, subcat and firmware in the to
+        address. Returns an ordered dict keyed by device address"""
+        devices = OrderedDict()
+        for record in records:
+            device_id = record.get('id_from', '')
+            if not device_id:
+                continue
+            device = self.describe(record.get('id_high', ''), record.get('id_mid', ''))
+            device['firmware'] = record.get('id_low', '')
+            devices[device_id] = device
+        return devices
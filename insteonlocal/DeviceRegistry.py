@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import threading
+from time import time
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+REGISTRY_VERSION = 2 # bumped when stored identities need a fresh probe
+REGISTRY_FILE = 'insteonlocal_devices.json'
+MAX_AGE = 30 * 24 * 3600 #seconds before a device is probed again
+
+# fields kept per device address
+IDENTITY_FIELDS = ('cat', 'sub_cat', 'firmware', 'cat_name', 'cat_type',
+                   'model_name', 'sku')
+
+class DeviceRegistry(object):
+    """Persistent registry of device identities keyed by insteon address.
+    cat/subcat/firmware never change for an address, so devices found here
+    don't need another id request until the entry is older than max_age.
+    Pass path=False for an in-memory registry. The file is read on first
+    use, not when the registry is created"""
+    def __init__(self, logger, path=None, max_age=MAX_AGE):
+        self.logger = logger
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), REGISTRY_FILE)
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.devices = None
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+
+    def entries(self):
+        """Device table, loaded on first use. Caller holds the lock"""
+        if self.devices is None:
+            self.devices = self.load()
+        return self.devices
+
+
+    def load(self):
+        """Read the registry file, ignoring it if missing, unreadable or
+        written by another registry version"""
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as registry_file:
+                data = json.load(registry_file)
+        except (IOError, OSError, ValueError) as err:
+            self.logger.error("DeviceRegistry: couldn't read %s: %s", self.path, err)
+            return {}
+
+        if data.get('version') != REGISTRY_VERSION:
+            self.logger.info("DeviceRegistry: ignoring registry version %s", data.get('version'))
+            return {}
+        return data.get('devices', {})
+
+
+    def save(self):
+        """Atomically write the registry file if anything changed"""
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {'version': REGISTRY_VERSION, 'devices': self.devices}
+            try:
+                with open(self.path + '.temp', 'w') as registry_file:
+                    json.dump(data, registry_file, indent=1, sort_keys=True)
+                os.replace(self.path + '.temp', self.path)
+                self.dirty = False
+            except (IOError, OSError) as err:
+                self.logger.error("DeviceRegistry: couldn't write %s: %s", self.path, err)
+
+
+    def get(self, address):
+        """Return the known identity for address, or None if unknown or stale"""
+        address = address.upper()
+        with self.lock:
+            entry = self.entries().get(address)
+            if entry is None or entry.get('updated', 0) + self.max_age < time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry)
+
+
+    def update(self, address, device, firmware=''):
+        """Store identity fields from a describe_device record"""
+        address = address.upper()
+        with self.lock:
+            entry = self.entries().setdefault(address, {'groups': []})
+            for field in IDENTITY_FIELDS:
+                if field in device:
+                    entry[field] = device[field]
+            if firmware:
+                entry['firmware'] = firmware
+            entry['updated'] = int(time())
+            self.dirty = True
+
+
+    def set_groups(self, address, groups):
+        """Record the groups the address was seen linked in"""
+        address = address.upper()
+        with self.lock:
+            entry = self.entries().get(address)
+            if entry is None:
+                return
+            groups = sorted(set(groups))
+            if entry.get('groups') != groups:
+                entry['groups'] = groups
+                self.dirty = True
+
+
+    def forget(self, address):
+        """Drop an address so it is probed again"""
+        with self.lock:
+            if self.entries().pop(address.upper(), None) is not None:
+                self.dirty = True
+
+
+    def stats(self):
+        """Return registry counters"""
+        with self.lock:
+            return {
+                'devices': len(self.entries()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'path': self.path,
+            }
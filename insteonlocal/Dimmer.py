@@ -1,4 +1,5 @@
 import pprint
+from insteonlocal.Codec import level_to_hex
 #from time import sleep
 
 #    This program is free software: you can redistribute it and/or modify
@@ -34,15 +35,20 @@ class Dimmer():
         """Turn light on at saved ramp rate"""
         self.logger.info("Dimmer %s on level %s", self.device_id, level)
 
-        self.hub.direct_command(self.device_id, '11', self.hub.brightness_to_hex(level))
-
-        success = self.hub.check_success(self.device_id, '11', self.hub.brightness_to_hex(level))
-        if success:
-            self.logger.info("Dimmer %s on: Light turned on successfully",
-                             self.device_id)
-            self.hub.clear_device_command_cache(self.device_id)
-        else:
-            self.logger.error("Dimmer %s on: Light did not turn on", self.device_id)
+        tracer = self.hub.tracer
+        with tracer.span('Dimmer.on', device=self.device_id, level=level) as span:
+            with tracer.span('brightness_to_hex', level=level):
+                level_hex = level_to_hex(level)
+            self.hub.direct_command(self.device_id, '11', level_hex)
+
+            success = self.hub.check_success(self.device_id, '11', level_hex)
+            if success:
+                self.logger.info("Dimmer %s on: Light turned on successfully",
+                                 self.device_id)
+                self.hub.clear_device_command_cache(self.device_id)
+            else:
+                self.logger.error("Dimmer %s on: Light did not turn on", self.device_id)
+            span.set('outcome', 'success' if success else 'failed')
 
         return success
 
@@ -106,10 +112,9 @@ class Dimmer():
         self.logger.info("Dimmer %S change_level: level %s", self.device_id,
                          level)
 
-        self.hub.direct_command(self.device_id, '21',
-                                self.hub.brightness_to_hex(level))
-        success = self.hub.check_success(self.device_id, '21',
-                                         self.hub.brightness_to_hex(level))
+        level_hex = level_to_hex(level)
+        self.hub.direct_command(self.device_id, '21', level_hex)
+        success = self.hub.check_success(self.device_id, '21', level_hex)
         if success:
             self.logger.info("Dimmer %s change_level: Light level changed successfully",
                              self.device_id)
@@ -167,8 +172,7 @@ class Dimmer():
             return False
 
         self.hub.direct_command(self.device_id, '17', level)
-        success = self.hub.check_success(self.device_id, '17',
-                                         self.hub.brightness_to_hex(level))
+        success = self.hub.check_success(self.device_id, '17', level)
         if success:
             self.logger.info("Dimmer %s start_change: Light started changing successfully",
                              self.device_id)
@@ -1,4 +1,5 @@
 import pprint
+from insteonlocal.Codec import FAN_LEVEL_HEX
 
 #    This program is free software: you can redistribute it and/or modify
 #    it under the terms of the GNU General Public License as published by
@@ -33,14 +34,11 @@ class Fan():
         """Turn fan on at saved ramp rate"""
         self.logger.info("Fan %s on level %s", self.device_id, level)
 
-        if level == 'off':
-            new_level = '00'
-        elif level == 'low':
-            new_level = '55'
-        elif level == 'medium':
-            new_level = 'AA'
-        elif level == 'high':
-            new_level = 'FF'
+        new_level = FAN_LEVEL_HEX.get(level)
+        if new_level is None:
+            self.logger.error("Fan %s on: %s is invalid, use off, low, medium or high",
+                              self.device_id, level)
+            return False
 
         self.hub.direct_command(self.device_id, '11', new_level, '02')
 
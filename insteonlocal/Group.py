@@ -1,5 +1,7 @@
 #import pprint
 #from time import sleep
+from insteonlocal.CommandScheduler import SCENE
+from insteonlocal.Codec import encode_scene
 
 #    This program is free software: you can redistribute it and/or modify
 #    it under the terms of the GNU General Public License as published by
@@ -58,8 +60,11 @@ class Group():
     def scene_command(self, command):
         """Wrapper to send posted scene command and get response"""
         self.logger.info("scene_command: Group %s Command %s", self.group_id, command)
-        command_url = self.hub.hub_url + '/0?' + command + self.group_id + "=I=0"
-        return self.hub.post_direct_command(command_url)
+        command_url = self.hub.hub_url + '/0?' + encode_scene(command, self.group_id) + "=I=0"
+        response = self.hub.send_command(command_url, SCENE)
+        # scene members aren't reliably known, so no tracked state is trusted
+        self.hub.forget_states()
+        return response
 
 
     def enter_link_mode(self):
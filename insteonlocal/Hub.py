@@ -1,19 +1,35 @@
 import pprint
 import logging
 import logging.handlers
-import json
-from collections import OrderedDict
+import threading
+from collections import OrderedDict, deque
+from concurrent import futures
 from time import sleep, time
-from io import StringIO
-import pkg_resources
-import requests
-import os
-import tempfile
 from insteonlocal.Switch import Switch
 from insteonlocal.Group import Group
 from insteonlocal.Dimmer import Dimmer
 from insteonlocal.Fan import Fan
 from insteonlocal.OnOffOutlet import OnOffOutlet
+from insteonlocal.HubSession import HubSession, POOL_MAXSIZE
+from insteonlocal.BufferPoller import BufferPoller, POLL_INTERVAL
+from insteonlocal.MessageParser import parse_messages
+from insteonlocal.BufferReader import BufferReader
+from insteonlocal.CommandCache import MemoryCache
+from insteonlocal.RefreshScheduler import RefreshScheduler
+from insteonlocal.CommandScheduler import CommandScheduler, INTERACTIVE, STATUS, DISCOVERY
+from insteonlocal.SingleFlight import SingleFlight
+from insteonlocal.DeviceRegistry import DeviceRegistry, IDENTITY_FIELDS
+from insteonlocal.DeviceCatalog import get_catalog, FANLINC_SUBCAT, OUTLET_SUBCATS
+from insteonlocal.Codec import encode_direct, level_to_hex
+from insteonlocal.CommandCorrelator import CommandCorrelator, CommandNak, CommandSuperseded, \
+    ACK_TIMEOUT, hop_count
+from insteonlocal.Metrics import Metrics
+from insteonlocal.Tracing import NullTracer
+from insteonlocal.StateTracker import StateTracker, STATE_MAX_AGE, SKIP_MAX_AGE, target_level, \
+    status_record
+from insteonlocal.CommandCoalescer import CommandCoalescer, COALESCE_WINDOW, is_level_command
+from insteonlocal.LocalResponse import LocalResponse
+from insteonlocal.LinkWalk import LinkWalk
 
 #    This program is free software: you can redistribute it and/or modify
 #    it under the terms of the GNU General Public License as published by
@@ -36,28 +52,45 @@ from insteonlocal.OnOffOutlet import OnOffOutlet
 # switch on updates/broadcasts
 
 CACHE_TTL = 20 #seconds
-CACHE_FILE = '.state'
-LOCK_FILE = 'commands.lock'
+POLL_MIN_DELAY = 0.1 #seconds, first buffer check after sending a command
+POLL_MAX_DELAY = 0.5 #seconds, backoff limit between buffer checks
+SWEEP_WINDOW = 4 # status queries outstanding at once during a sweep
+ID_REQUEST_WORKERS = 4 # parallel id requests during link discovery
+ALDB_TIMEOUT = 5 #seconds to wait for each link record
+ID_REQUEST_TIMEOUT = 3 #seconds to wait for the id request broadcast
+BROADCAST_FLAG = '8' # flag1 of the broadcast answering an id request
+
+def is_error(response):
+    """Check if a response record says the command failed"""
+    return isinstance(response, dict) and bool(response.get('error'))
+
 
 class Hub(object):
-    """Class for local control of insteon hub"""
-    def __init__(self, ip_addr, username, password, port="25105", timeout=10, logger=None):
+    """Class for local control of insteon hub. One Hub can be shared by
+    many threads: http_code and buffer_status are kept per thread, and
+    io_lock serializes only posting commands to the hub and downloading
+    and parsing its buffer. Waits for acks happen outside the lock"""
+    def __init__(self, ip_addr, username, password, port="25105", timeout=10, logger=None,
+                 pool_maxsize=POOL_MAXSIZE, cache=None, registry=None, metrics=None,
+                 tracer=None, state_max_age=STATE_MAX_AGE, skip_redundant=False,
+                 skip_max_age=SKIP_MAX_AGE, coalesce=False, coalesce_window=COALESCE_WINDOW):
         self.ip_addr = ip_addr
         self.username = username
         self.password = password
         self.port = str(port)
-        self.http_code = 0
         self.timeout = timeout
 
-        self.buffer_status = OrderedDict()
+        # per thread results of the last http request and buffer read
+        self.local = threading.local()
+        # held while posting to the hub or reading its buffer, so frames
+        # reach the IM one at a time and buffer reads are parsed in order
+        self.io_lock = threading.RLock()
+        self.poller_lock = threading.Lock()
 
-        json_cats = pkg_resources.resource_string(__name__, 'data/device_categories.json')
-        json_cats_str = json_cats.decode('utf-8')
-        self.device_categories = json.loads(json_cats_str)
+        self.session = HubSession(self.username, self.password, timeout=self.timeout,
+                                  pool_maxsize=pool_maxsize)
 
-        json_models = pkg_resources.resource_string(__name__, 'data/device_models.json')
-        json_models_str = json_models.decode('utf-8')
-        self.device_models = json.loads(json_models_str)
+        self.poller = None
 
         self.hub_url = 'http://' + self.ip_addr + ':' + self.port
 
@@ -67,237 +100,504 @@ class Hub(object):
         else:
             self.logger = logger
 
+        # latency, retry, nak, buffer and cache instrumentation
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+
+        # spans for each stage of a command, pass Tracer(JsonLinesExporter(path))
+        if tracer is None:
+            tracer = NullTracer()
+        self.tracer = tracer
+
+        self.buffer_reader = BufferReader(self.logger)
+
+        # in-memory by default, pass FileCache to share state between processes
+        if cache is None:
+            cache = MemoryCache()
+        self.command_cache = cache
+        self.refresher = RefreshScheduler(self.logger)
+        self.scheduler = CommandScheduler(self.logger)
+        self.single_flight = SingleFlight()
+
+        # device identities survive restarts, pass DeviceRegistry(logger, path)
+        # to choose the file or path=False to keep it in memory
+        if registry is None:
+            registry = DeviceRegistry(self.logger)
+        self.registry = registry
+
+        # device states learned from acks, status responses and paddle
+        # broadcasts answer status requests without powerline traffic
+        self.state_tracker = StateTracker(self.logger, self.registry, state_max_age)
+        self.correlator = CommandCorrelator(self.logger, self.metrics,
+                                            self.state_tracker.command_acked)
+
+        # opt-in: don't send level commands for a level the device confirmed
+        # within skip_max_age seconds, and keep its status cached afterwards
+        self.skip_redundant = skip_redundant
+        self.skip_max_age = skip_max_age
+
+        # opt-in: a newer level command for a device replaces its unsent one
+        self.coalesce = coalesce
+        self.coalescer = CommandCoalescer(self.logger, coalesce_window)
+
+        # False when the last link database walk gave up before its end
+        self.linked_complete = None
+
         self.logger.info("Hub object initialized")
-        temp_dir = tempfile.gettempdir()
-        os.chdir(temp_dir)
 
 
+    @property
+    def http_code(self):
+        """Status code of this thread's last request to the hub"""
+        return getattr(self.local, 'http_code', 0)
+
+
+    @http_code.setter
+    def http_code(self, value):
+        self.local.http_code = value
+
+
+    @property
+    def buffer_status(self):
+        """Summary of this thread's last buffer read"""
+        status = getattr(self.local, 'buffer_status', None)
+        if status is None:
+            status = self.local.buffer_status = OrderedDict()
+        return status
+
+
+    @buffer_status.setter
+    def buffer_status(self, value):
+        self.local.buffer_status = value
+
+
+    @property
+    def catalog(self):
+        """Device catalog, loaded on first use and shared by all hubs"""
+        return get_catalog()
+
+
+    @property
+    def device_categories(self):
+        """Device category table"""
+        return get_catalog().categories
+
+
+    @property
+    def device_models(self):
+        """Device model table"""
+        return get_catalog().models
+
 
     def brightness_to_hex(self, level):
         """Convert numeric brightness percentage into hex for insteon"""
-        level_int = int(level)
-        new_int = int((level_int * 255)/100)
-        new_level = format(new_int, '02X')
-        self.logger.debug("brightness_to_hex: %s to %s", level, str(new_level))
-        return str(new_level)
+        return level_to_hex(level)
 
 
     def post_direct_command(self, command_url):
         """Send raw command via post"""
         self.logger.info("post_direct_command: %s", command_url)
-        req = requests.post(command_url, timeout=self.timeout,
-                            auth=requests.auth.HTTPBasicAuth(self.username,
-                                                             self.password))
-        self.http_code = req.status_code
-        req.raise_for_status()
+        with self.tracer.span('post_direct_command') as span, self.io_lock:
+            start = time()
+            req = self.session.post(command_url)
+            span.set('endpoint', self.observe_http(command_url, start))
+            self.http_code = req.status_code
+            span.set('http_code', req.status_code)
+            req.raise_for_status()
         return req
 
 
     def get_direct_command(self, command_url):
         """Send raw command via get"""
         self.logger.info("get_direct_command: %s", command_url)
-        req = requests.get(command_url, timeout=self.timeout,
-                           auth=requests.auth.HTTPBasicAuth(self.username,
-                                                            self.password))
-        self.http_code = req.status_code
-        req.raise_for_status()
+        with self.tracer.span('get_direct_command') as span:
+            start = time()
+            req = self.session.get(command_url)
+            span.set('endpoint', self.observe_http(command_url, start))
+            self.http_code = req.status_code
+            span.set('http_code', req.status_code)
+            req.raise_for_status()
         return req
 
 
-    def direct_command(self, device_id, command, command2, extended_payload=None):
+    def observe_http(self, command_url, start):
+        """Record a round trip to the hub by endpoint, e.g. /3 or
+        /buffstatus.xml. Returns the endpoint"""
+        endpoint = command_url[len(self.hub_url):].split('?')[0]
+        self.metrics.observe('http_request_seconds', time() - start, endpoint=endpoint)
+        return endpoint
+
+
+    def send_command(self, command_url, priority=INTERACTIVE):
+        """Post a command once the scheduler lets it through. Commands go
+        out in priority order and within the powerline rate limit"""
+        return self.scheduler.submit(self.post_direct_command, command_url,
+                                     priority=priority)
+
+
+    def scheduler_stats(self):
+        """Return per priority class command queue metrics"""
+        return self.scheduler.stats()
+
+
+    def session_stats(self):
+        """Return http connection pool reuse statistics"""
+        return self.session.stats()
+
+
+    def metrics_snapshot(self):
+        """Return recorded latency, retry, nak, buffer poll and cache
+        metrics as a dict, plus the cache hit/miss/stale ratios"""
+        snapshot = self.metrics.snapshot()
+        lookups = {}
+        for entry in snapshot.get('cache_lookups_total', []):
+            result = entry['labels']['result']
+            lookups[result] = lookups.get(result, 0) + entry['value']
+        total = sum(lookups.values())
+        snapshot['cache_ratios'] = dict((result, float(lookups.get(result, 0)) / total
+                                         if total else 0.0)
+                                        for result in ('hit', 'miss', 'stale'))
+        return snapshot
+
+
+    def metrics_prometheus(self):
+        """Return recorded metrics in the Prometheus text format"""
+        return self.metrics.prometheus()
+
+
+    def close(self):
+        """Stop the poller and close pooled connections to the hub"""
+        self.stop_poller()
+        self.refresher.shutdown(wait=False)
+        self.session.close()
+
+
+    def direct_command(self, device_id, command, command2, extended_payload=None,
+                       priority=INTERACTIVE):
         """Wrapper to send posted direct command and get response. Level is 0-100.
-        extended_payload is 14 bytes/28 chars..but last 2 chars is a generated checksum so leave off"""
-        extended_payload = extended_payload or ''
-        if not extended_payload:
-            msg_type = '0'
-            msg_type_desc = 'Standard'
-        else:
-            msg_type = '1'
-            msg_type_desc = 'Extended'
-
-            extended_payload = extended_payload.ljust(26, '0')
-
-            ### Determine checksum to add onto the payload for I2CS support
-            checksum_payload_hex = [int("0x" + extended_payload[i:i+2],16) for i in range(0,len(extended_payload)-1,2)]
-            checksum_payload_hex.insert(0, int("0x" + command2, 16))
-            checksum_payload_hex.insert(0, int("0x" + command, 16))
-
-            # Get sum of all hex bytes
-            bytessum = 0
-            for ch in checksum_payload_hex:
-                bytessum += ch
-            bytessumStr = hex(bytessum)
-
-            # Get last byte of the bytessum
-            lastByte = bytessumStr[-2:]
-            lastByte = '0x' + lastByte.zfill(2)
-            # Determine compliment of last byte
-            lastByteHex = int(lastByte, 16)
-            lastCompliment = lastByteHex ^ 0xFF
-            # Add one to create checksum
-            checksum = hex(lastCompliment + 0x01)
-            # Remove 0x prefix
-            checksum_final = (format(int(checksum, 16), 'x'))
-            checksum_final = checksum_final.upper()
-            #print("final checksum")
-            #pprint.pprint(checksum_final)
-            extended_payload = extended_payload + checksum_final
-
-        self.logger.info("direct_command: Device: %s Command: %s Command 2: %s Extended: %s MsgType: %s", device_id, command, command2, extended_payload, msg_type_desc)
+        extended_payload is 14 bytes/28 chars..but last 2 chars is a generated checksum so leave off.
+        A coalesced or skipped command returns a LocalResponse instead of the post's response"""
+        self.logger.info("direct_command: Device: %s Command: %s Command 2: %s Extended: %s",
+                         device_id, command, command2, extended_payload or '')
         device_id = device_id.upper()
-        command_url = (self.hub_url + '/3?' + "0262"
-                       + device_id + msg_type + "F"
-                       + command + command2 + extended_payload + "=I=3")
-        return self.post_direct_command(command_url)
+        command_url = (self.hub_url + '/3?'
+                       + encode_direct(device_id, command, command2, extended_payload)
+                       + "=I=3")
+        with self.tracer.span('direct_command', device=device_id, cmd1=command,
+                              cmd2=command2, extended=bool(extended_payload),
+                              priority=priority) as span:
+            pending = self.correlator.register(device_id, command, command2, fresh=True)
+            pending.extended = bool(extended_payload)
+
+            coalesce = self.coalesce and is_level_command(command, extended_payload)
+            if coalesce:
+                replaced = self.coalescer.replace(device_id, pending, command_url)
+                if replaced is not None:
+                    # the queued command for this device sends ours instead,
+                    # its caller learns that its own never ran
+                    span.set('outcome', 'coalesced')
+                    self.metrics.inc('commands_coalesced_total', device=device_id,
+                                     cmd1=replaced.cmd1)
+                    self.correlator.supersede(replaced, pending)
+                    return self.wait_coalesced(command_url, pending)
+            elif self.coalesce and not extended_payload \
+                 and target_level(command, command2) is not None:
+                # an on or off sent now would be undone by the device's
+                # level change still waiting behind it, so that one is dropped
+                replaced = self.coalescer.cancel(device_id)
+                if replaced is not None:
+                    self.metrics.inc('commands_coalesced_total', device=device_id,
+                                     cmd1=replaced.cmd1)
+                    self.correlator.supersede(replaced, pending)
+
+            state = self.redundant_state(device_id, command, command2, extended_payload)
+            if state is not None:
+                self.logger.info("direct_command: device %s already at level %s, not sending",
+                                 device_id, state.level)
+                span.set('outcome', 'skipped')
+                self.metrics.inc('commands_skipped_total', device=device_id, cmd1=command)
+                self.correlator.skip(pending, self.skipped_record(device_id, command,
+                                                                  command2, state))
+                return self.local_response(command_url, 'skipped')
+
+            self.metrics.inc('commands_total', device=device_id, cmd1=command)
+            if coalesce:
+                return self.send_coalesced(device_id, pending, command_url, priority)
+            return self.scheduler.submit(self.post_pending, command_url, pending,
+                                         priority=priority)
+
+
+    def local_response(self, command_url, outcome):
+        """Response for a command handled without its own post"""
+        response = LocalResponse(command_url, outcome)
+        self.http_code = response.status_code
+        return response
+
+
+    def send_coalesced(self, device_id, pending, command_url, priority=INTERACTIVE):
+        """Send a level command through the device's coalescing slot. Until
+        the scheduler lets it through, and during the coalescing window
+        before that, newer level commands for the device replace it. Posts
+        the newest one. If that isn't ours, our command never ran and the
+        response says so"""
+        slot = self.coalescer.open(device_id, pending, command_url)
+        try:
+            if self.coalescer.window:
+                sleep(self.coalescer.window)
+            response = self.scheduler.submit(self.post_slot, slot, priority=priority)
+        except BaseException as err:
+            # never leave a slot open that nobody will send
+            latest = self.coalescer.take(slot)[1]
+            if latest is not None and latest is not pending:
+                self.correlator.abandon(latest, err)
+            raise
+        if slot.pending is not pending:
+            return self.local_response(command_url, 'superseded')
+        return response
 
 
-    def direct_command_hub(self, command):
+    def wait_coalesced(self, command_url, pending):
+        """Wait until the caller whose queued command ours replaced posts
+        ours, or a newer one replaces it in turn. Returns the matching
+        LocalResponse, or raises the error that stopped the post"""
+        pending.settled.wait()
+        if pending.send_error is not None:
+            raise pending.send_error
+        if pending.future.done() and not pending.future.cancelled() \
+           and isinstance(pending.future.exception(), CommandSuperseded):
+            return self.local_response(command_url, 'superseded')
+        return self.local_response(command_url, 'coalesced')
+
+
+    def post_slot(self, slot):
+        """Post the newest command of a coalescing slot, if it wasn't
+        cancelled"""
+        command_url, pending = self.coalescer.take(slot)
+        if pending is None:
+            return None
+        return self.post_pending(command_url, pending)
+
+
+    def post_pending(self, command_url, pending):
+        """Post a direct command, noting the buffer position first so only
+        responses read after the post can complete it. Ack latency counts
+        from here, not from the wait in the scheduler"""
+        with self.io_lock:
+            self.correlator.posted(pending, self.buffer_reader.mark())
+            return self.post_direct_command(command_url)
+
+
+    def coalesce_stats(self):
+        """Return how many level commands were replaced before being sent"""
+        return self.coalescer.stats()
+
+
+    def redundant_state(self, device_id, command, command2, extended_payload=None):
+        """With skip_redundant on, return the confirmed state that already
+        matches the level this command sets, or None if it must be sent.
+        Extended commands address sub-loads and are always sent. Like
+        known_state, only used while the poller reads paddle broadcasts"""
+        if not self.skip_redundant or extended_payload or not self.tracking():
+            return None
+        level = target_level(command, command2)
+        if level is None:
+            return None
+        state = self.state_tracker.confirmed_level(device_id, self.skip_max_age)
+        if state is None or state.level != level:
+            return None
+        return state
+
+
+    def skipped_record(self, device_id, command, command2, state):
+        """Stand-in ack for a command that was not sent"""
+        record = status_record(device_id, command, command2)
+        record['skipped'] = True
+        record['confirmed'] = state.updated
+        return record
+
+
+    def direct_command_hub(self, command, priority=INTERACTIVE):
         """Send direct hub command"""
         self.logger.info("direct_command_hub: Command %s", command)
         command_url = (self.hub_url + '/3?' + command + "=I=3")
-        return self.post_direct_command(command_url)
+        return self.send_command(command_url, priority)
 
 
-    def direct_command_short(self, command):
+    def direct_command_short(self, command, priority=INTERACTIVE):
         """Wrapper for short-form commands (doesn't need device id or flags byte)"""
         self.logger.info("direct_command_short: Command %s", command)
         command_url = (self.hub_url + '/3?' + command + "=I=0")
-        return self.post_direct_command(command_url)
+        return self.send_command(command_url, priority)
 
 
     def get_linked(self):
-        """Get a list of currently linked devices from the hub"""
-        linked_devices = {}
+        """Get a list of currently linked devices from the hub. If the walk
+        timed out the list is partial and linked_complete is False"""
         self.logger.info("\nget_linked")
+        linked_devices = OrderedDict(self.iter_linked())
+        self.logger.info("get_linked: Final device list: %s", pprint.pformat(linked_devices))
+        return linked_devices
 
-        #todo instead of sleep, create loop to keep checking buffer
-        self.direct_command_hub('0269')
-        sleep(1)
-        self.get_buffer_status()
-        msgs = self.buffer_status.get('msgs', [])
-        for entry in msgs:
-            im_code = entry.get('im_code', '')
-            #self.logger.info("get_linked entry {}".format(pprint.pformat(entry)))
-
-            if im_code == '57':
-                device_id = entry.get('id_high', '') + entry.get('id_mid', '') \
-                            + entry.get('id_low', '')
-                group = entry.get('group', '')
-                if device_id not in linked_devices:
-                    dev_info = self.id_request(device_id)
-                    dev_cat = dev_info.get('id_high', '')
-                    dev_sub_cat = dev_info.get('id_mid', '')
-                    dev_cat_record = self.get_device_category(dev_cat, dev_sub_cat)
-                    if dev_cat_record and 'name' in dev_cat_record:
-                        dev_cat_name = dev_cat_record['name']
-                        dev_cat_type = dev_cat_record['type']
-                    else:
-                        dev_cat_name = 'unknown'
-                        dev_cat_type = 'unknown'
 
-                    linked_dev_model = self.get_device_model(dev_cat, dev_sub_cat)
-                    if 'name' in linked_dev_model:
-                        dev_model_name = linked_dev_model['name']
+    def iter_linked(self, workers=ID_REQUEST_WORKERS, timeout=ALDB_TIMEOUT):
+        """Walk the hub's link database and yield (device_id, device) as soon
+        as each linked device is identified. Devices already in the registry
+        are yielded right away, id requests for the rest run on a small pool
+        while the walk continues. A device's group list keeps filling until
+        the walk is done. A record that times out restarts the walk from the
+        first record, skipping those already read, up to ALDB_RETRIES times.
+        After that the walk ends early, logged as an error, and
+        linked_complete is False"""
+        groups = OrderedDict()
+        lookups = OrderedDict()
+        executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self.linked_complete = None
+        try:
+            walk = LinkWalk(self.logger)
+            while not walk.done:
+                record = walk.take(self.read_aldb_record(walk.command, timeout))
+                if record is None:
+                    continue
+
+                device_id = record.get('id_high', '') + record.get('id_mid', '') \
+                            + record.get('id_low', '')
+                if device_id not in groups:
+                    groups[device_id] = []
+                    device = self.known_device(device_id, groups)
+                    if device is None:
+                        lookups[device_id] = executor.submit(self.id_request, device_id)
                     else:
-                        dev_model_name = 'unknown'
-
-                    if 'sku' in linked_dev_model:
-                        dev_sku = linked_dev_model['sku']
-                    else:
-                        dev_sku = 'unknown'
-
-                    self.logger.info("get_linked: Got first device: %s group %s "
-                                     "cat type %s cat name %s dev model name %s",
-                                     device_id, group, dev_cat_type,
-                                     dev_cat_name, dev_model_name)
-                    linked_devices[device_id] = {
-                        'cat_name': dev_cat_name,
-                        'cat_type': dev_cat_type,
-                        'model_name' : dev_model_name,
-                        'cat': dev_cat,
-                        'sub_cat': dev_sub_cat,
-                        'sku': dev_sku,
-                        'group': []
-                    }
-
-                linked_devices[device_id]['group'].append(group)
-
-        while self.buffer_status['success']:
-            self.direct_command_hub('026A')
-            sleep(1)
+                        yield device_id, device
+                groups[device_id].append(record.get('group', ''))
+
+                for device_id, lookup in list(lookups.items()):
+                    if lookup.done():
+                        del lookups[device_id]
+                        yield device_id, self.linked_device(device_id, lookup, groups)
+
+            for device_id, lookup in lookups.items():
+                yield device_id, self.linked_device(device_id, lookup, groups)
+
+            # group lists of a partial walk may be missing groups
+            if walk.complete:
+                for device_id, group_list in groups.items():
+                    self.registry.set_groups(device_id, group_list)
+            self.linked_complete = walk.complete
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.registry.save()
+
+
+    def known_device(self, device_id, groups):
+        """Build a linked device record from the registry, or None if the
+        address is unknown or stale and needs an id request"""
+        entry = self.registry.get(device_id)
+        if entry is None:
+            return None
+        self.logger.info("get_linked: Known device: %s", device_id)
+        device = {field: entry.get(field, '') for field in IDENTITY_FIELDS}
+        device['group'] = groups[device_id]
+        return device
+
+
+    def linked_device(self, device_id, lookup, groups):
+        """Build a linked device record from a finished id request"""
+        group_list = groups[device_id]
+        try:
+            dev_info = lookup.result() or {}
+        except Exception as err: # pylint: disable=broad-except
+            self.logger.error("get_linked: id request for %s failed: %s", device_id, err)
+            dev_info = {}
+        device = self.describe_device(device_id, group_list[0], dev_info)
+        device['group'] = group_list
+        if device['cat']:
+            self.registry.update(device_id, device)
+        return device
+
+
+    def identify(self, device_id):
+        """Return device identity (cat, sub_cat, firmware, model, sku...),
+        from the registry when known, otherwise from an id request"""
+        device_id = device_id.upper()
+        entry = self.registry.get(device_id)
+        if entry is not None:
+            return entry
+
+        return self.register_identity(device_id, self.id_request(device_id))
+
+
+    def register_identity(self, device_id, dev_info):
+        """Store an id request response in the registry and return the
+        identity, or None if the device didn't answer"""
+        device = self.describe_device(device_id, '', dev_info or {})
+        if not device['cat']:
+            return None
+        self.registry.update(device_id, device)
+        self.registry.save()
+        return self.registry.get(device_id)
+
+
+    def read_aldb_record(self, command, timeout=ALDB_TIMEOUT):
+        """Send get first (0269) or get next (026A) ALL-Link record and poll
+        the buffer until the 0257 record response shows up. Returns the
+        record, None once the hub naks because there are no more records,
+        or False if nothing arrived within timeout seconds"""
+        mark = self.buffer_reader.mark()
+        self.direct_command_hub(command, DISCOVERY)
+        deadline = time() + timeout
+        delay = POLL_MIN_DELAY
+        acked = False
+
+        while time() < deadline:
+            if self.poller is None or not self.poller.is_running():
+                sleep(delay)
+                delay = min(delay * 2, POLL_MAX_DELAY)
             self.get_buffer_status()
-            msgs = self.buffer_status.get('msgs', [])
-            for entry in msgs:
-                im_code = entry.get('im_code', '')
-                if im_code == '57':
-                    device_id = entry.get('id_high', '') + entry.get('id_mid', '') \
-                                + entry.get('id_low', '')
-                    group = entry.get('group', '')
-
-                    if device_id not in linked_devices:
-                        dev_info = self.id_request(device_id)
-                        dev_cat = dev_info.get('id_high', '')
-                        dev_sub_cat = dev_info.get('id_mid', '')
-                        dev_cat_record = self.get_device_category(dev_cat, sub_cat)
-                        if dev_cat_record and 'name' in dev_cat_record:
-                            dev_cat_name = dev_cat_record['name']
-                            dev_cat_type = dev_cat_record['type']
-                        else:
-                            dev_cat_name = 'unknown'
-                            dev_cat_type = 'unknown'
-
-                        linked_dev_model = self.get_device_model(dev_cat, dev_sub_cat)
-                        if 'name' in linked_dev_model:
-                            dev_model_name = linked_dev_model['name']
-                        else:
-                            dev_model_name = 'unknown'
-
-                        if 'sku' in linked_dev_model:
-                            dev_sku = linked_dev_model['sku']
-                        else:
-                            dev_sku = 'unknown'
-
-                        self.logger.info("get_linked: Got device: %s group %s "
-                                         + "cat type %s cat name %s dev model name %s",
-                                         device_id, group, dev_cat_type,
-                                         dev_cat_name, dev_model_name)
-                        linked_devices[device_id] = {
-                            'cat_name': dev_cat_name,
-                            'cat_type': dev_cat_type,
-                            'model_name' : dev_model_name,
-                            'cat': dev_cat,
-                            'sub_cat': dev_sub_cat,
-                            'sku': dev_sku,
-                            'group': []
-                        }
-
-                    linked_devices[device_id]['group'].append(group)
 
-        self.logger.info("get_linked: Final device list: %s", pprint.pformat(linked_devices))
-        return linked_devices
+            records, mark = self.buffer_reader.messages_since(mark)
+            for record in records:
+                im_code = record.get('im_code', '')
+                if im_code == command[2:]:
+                    if record.get('ack_or_nak', '') == '15':
+                        self.logger.info("read_aldb_record: no more link records")
+                        return None
+                    acked = True
+                elif im_code == '57' and acked:
+                    return record
+
+        self.logger.info("read_aldb_record: timed out waiting for link record")
+        return False
+
+
+    def describe_device(self, device_id, group, dev_info):
+        """Build a linked device record from an id_request response"""
+        dev_cat = dev_info.get('id_high', '')
+        dev_sub_cat = dev_info.get('id_mid', '')
+        device = self.catalog.describe(dev_cat, dev_sub_cat)
+
+        self.logger.info("get_linked: Got device: %s group %s "
+                         "cat type %s cat name %s dev model name %s",
+                         device_id, group, device['cat_type'],
+                         device['cat_name'], device['model_name'])
+        device['firmware'] = dev_info.get('id_low', '')
+        device['group'] = []
+        return device
 
 
     def get_device_category(self, cat, subcat=None):
         """Return the device category and name given the category id"""
-        if cat in self.device_categories:
-            if not subcat:
-                return self.device_categories[cat]
-            elif cat == '02' and subcat in ('08', '39'):
-                return self.device_categories['FE']
-        else:
-            return False
+        return self.catalog.category(cat, subcat)
 
 
     def get_device_model(self, cat, sub_cat, key=''):
         """Return the model name given cat/subcat or product key"""
-        if cat + ':' + sub_cat in self.device_models:
-            return self.device_models[cat + ':' + sub_cat]
-        else:
-            for i_key, i_val in self.device_models.items():
-                if 'key' in i_val:
-                    if i_val['key'] == key:
-                        return i_val
-            return False
+        return self.catalog.model(cat, sub_cat, key)
+
+
+    def classify(self, records):
+        """Describe devices from a list of id request responses"""
+        return self.catalog.classify(records)
 
 
     def id_request(self, device_id):
@@ -306,16 +606,43 @@ class Hub(object):
         self.logger.info("\nid_request for device %s", device_id)
         device_id = device_id.upper()
 
-        self.direct_command(device_id, '10', '00')
+        # concurrent callers for the same device share one request
+        return self.single_flight.do((device_id, '10', '00'), self.send_id_request, device_id)
 
-        sleep(2)
 
-        status = self.get_buffer_status(device_id)
-        if not status:
-            sleep(1)
-            status = self.get_buffer_status(device_id)
+    def send_id_request(self, device_id, timeout=ID_REQUEST_TIMEOUT):
+        """Send ID request and poll the buffer until the device's broadcast
+        with its cat, sub cat and firmware shows up. Returns the broadcast
+        record, or None if none arrived within timeout seconds"""
+        mark = self.buffer_reader.mark()
+        self.direct_command(device_id, '10', '00', priority=DISCOVERY)
+        deadline = time() + timeout
+        delay = POLL_MIN_DELAY
+
+        while time() < deadline:
+            if self.poller is None or not self.poller.is_running():
+                sleep(delay)
+                delay = min(delay * 2, POLL_MAX_DELAY)
+            self.get_buffer_status()
+
+            records, mark = self.buffer_reader.messages_since(mark)
+            record = self.id_broadcast(device_id, records)
+            if record is not None:
+                return record
+
+        self.logger.info("id_request: no broadcast from device %s", device_id)
+        return None
 
-        return status
+
+    def id_broadcast(self, device_id, records):
+        """Return the id request broadcast from device_id among records, or
+        None. Its direct ack carries the hub's address in the same place, so
+        only a standard message with the broadcast flag is an identity"""
+        for record in records:
+            if record.get('im_code', '') == '50' and record.get('id_from', '') == device_id \
+               and record.get('flag1', '') == BROADCAST_FLAG:
+                return record
+        return None
 
 
     def get_device_status(self, device_id, return_led=0, level=None):
@@ -336,166 +663,274 @@ class Hub(object):
             else:
                 level = '00'
 
-        if os.path.exists(device_id + CACHE_FILE):
-            status = self.get_command_response_from_cache(device_id, '19', level)
-
-        if not status:
-            self.logger.info("no cached status for device %s", device_id)
-            self.direct_command(device_id, '19', level)
+        with self.tracer.span('get_device_status', device=device_id, cmd1='19',
+                              cmd2=level) as span:
+            state = self.known_state(device_id, level)
+            if state is not None:
+                span.set('outcome', 'state')
+                return state.as_status()
 
-            attempts = 1
-            sleep(1)
-
-            status = self.get_buffer_status(device_id)
-            while 'success' not in status and attempts < 9:
+            if self.command_cache.has_device(device_id):
                 status = self.get_command_response_from_cache(device_id, '19', level)
-                if not status:
-                    if attempts % 3 == 0:
-                        self.direct_command(device_id, '19', level)
-                    else:
-                        sleep(1)
-                    status = self.get_buffer_status(device_id)
-                attempts += 1
-        else:
-            self.logger.info("got cached status for device %s", device_id)
+            else:
+                self.metrics.inc('cache_lookups_total', result='miss', cmd='19')
+
+            span.set('cached', bool(status))
+            if not status:
+                self.logger.info("no cached status for device %s", device_id)
+                # concurrent callers for the same device share one query
+                status = self.single_flight.do((device_id, '19', level), self.query_status,
+                                               device_id, level)
+            else:
+                self.logger.info("got cached status for device %s", device_id)
+            span.set('outcome', 'ack' if status and status.get('success') else 'no response')
 
         return status
 
-    def rebuild_cache(self, device_id, command, command2):
 
+    def known_state(self, device_id, level='00'):
+        """Tracked state fresh enough to answer a 19 00 status request, or
+        None. Only used while the poller runs, since without it paddle
+        broadcasts are never read. LED flag requests always go to the device"""
+        if level != '00' or not self.tracking():
+            return None
+        return self.state_tracker.known_level(device_id)
 
-        if os.path.exists(LOCK_FILE):
-            self.logger.info("cache building locked - killing proc %s", device_id)
-            os._exit(0)
-        else:
-            self.logger.info("no command lock - creating lock file %s", device_id)
-            file = open(LOCK_FILE, "w+")
-            json.dump({}, file)
-            file.close()
 
+    def tracking(self):
+        """Check if tracked states follow manual changes, which they only
+        do while the poller reads every paddle broadcast"""
+        return self.poller is not None and self.poller.is_running()
+
+
+    def forget_states(self):
+        """Drop all tracked device states, e.g. after a scene command changed
+        devices in ways no ack reports. With skip_redundant on, the statuses
+        cached from those states are dropped too"""
+        for device_id in self.state_tracker.clear():
+            if self.skip_redundant:
+                self.command_cache.clear_device(device_id)
 
-        self.logger.info("rebuilding cache for device %s", device_id)
-        self.direct_command(device_id, command, command2)
 
+    def device_state(self, device_id):
+        """Last tracked state of a device as a dict, or None"""
+        state = self.state_tracker.state(device_id.upper())
+        if state is None:
+            return None
+        return state.as_dict()
+
+
+    def state_stats(self):
+        """Return how often status requests were answered from tracked state"""
+        return self.state_tracker.stats()
+
+
+    def query_status(self, device_id, level):
+        """Send status request, retrying until the device answers"""
+        self.direct_command(device_id, '19', level, priority=STATUS)
 
         attempts = 1
+        resends = 0
         sleep(1)
 
         status = self.get_buffer_status(device_id)
         while 'success' not in status and attempts < 9:
-            status = self.get_buffer_status(device_id)
+            status = self.get_command_response_from_cache(device_id, '19', level)
             if not status:
                 if attempts % 3 == 0:
-                    self.direct_command(device_id, command, command2)
+                    self.direct_command(device_id, '19', level, priority=STATUS)
+                    resends += 1
                 else:
                     sleep(1)
                 status = self.get_buffer_status(device_id)
             attempts += 1
+        self.metrics.observe('command_retries', resends, device=device_id, cmd1='19')
+        if status and status.get('success'):
+            # keyed by the request so the next status lookup is a cache hit
+            self.set_command_response_from_cache(status, device_id, '19', level)
 
-        self.logger.info("removing cache lock file %s", device_id)
-        os.remove(LOCK_FILE)
-        os._exit(0)
+        return status
 
-    def get_cache_from_file(self, deviceid):
-        filename = deviceid + CACHE_FILE
-        cache_loaded = False
-        attempts = 0
-        data = {}
 
-        if not os.path.exists(filename):
-            file = open(filename, "w+")
-            json.dump({}, file)
-            file.close()
-            return {}
+    def get_many_device_status(self, device_ids, return_led=0, window=SWEEP_WINDOW,
+                               timeout=ACK_TIMEOUT, use_cache=True):
+        """Query status of many devices, keeping up to window queries
+        outstanding. Yields (device_id, status) as responses arrive, status is
+        False for devices that did not answer within timeout seconds"""
+        level = '01' if return_led == 1 else '00'
+        queue = deque(device_id.upper() for device_id in device_ids)
+        outstanding = {}
+        delay = POLL_MIN_DELAY
+
+        try:
+            while queue or outstanding:
+                while queue and len(outstanding) < window:
+                    device_id = queue.popleft()
+                    if use_cache:
+                        status = self.get_cached_status(device_id, level)
+                        if status:
+                            yield device_id, status
+                            continue
+                    self.direct_command(device_id, '19', level, priority=STATUS)
+                    pending = self.correlator.register(device_id, '19', level, timeout)
+                    outstanding[device_id] = pending
+                    delay = POLL_MIN_DELAY
+
+                if not outstanding:
+                    continue
+
+                now = time()
+                for device_id, pending in list(outstanding.items()):
+                    if pending.future.done():
+                        status = self.sweep_result(pending, level)
+                    elif pending.deadline <= now:
+                        self.logger.info("status sweep: no response from device %s", device_id)
+                        status = False
+                    else:
+                        continue
+                    del outstanding[device_id]
+                    self.correlator.release(pending)
+                    yield device_id, status
+
+                if not outstanding:
+                    continue
+
+                remaining = min(p.deadline for p in outstanding.values()) - time()
+                if self.poller is not None and self.poller.is_running():
+                    futures.wait([p.future for p in outstanding.values()],
+                                 max(remaining, 0), futures.FIRST_COMPLETED)
+                else:
+                    sleep(max(min(delay, remaining), 0))
+                    delay = min(delay * 2, POLL_MAX_DELAY)
+                    self.get_buffer_status()
+        finally:
+            for pending in outstanding.values():
+                self.correlator.release(pending)
+
+
+    def get_cached_status(self, device_id, level):
+        """Return an unexpired cached status response or False"""
+        entry = self.command_cache.get(device_id, self.create_key_from_command('19', level))
+        if entry is None:
+            self.metrics.inc('cache_lookups_total', result='miss', cmd='19')
+            return False
+        if entry['ttl'] < int(time()):
+            self.metrics.inc('cache_lookups_total', result='stale', cmd='19')
+            return False
+        self.metrics.inc('cache_lookups_total', result='hit', cmd='19')
+        return entry['response']
 
-        while not cache_loaded:
-            try:
-                with open(filename) as cachefile:
-                    data = json.load(cachefile)
-                    cachefile.close()
 
-                cache_loaded = True
-                break
-            except ValueError:
-                self.logger.info("couldn't decode cachefile")
-                if attempts >= 3:
-                    cache_loaded = True
-                else:
-                    attempts += 1
-        return data
+    def sweep_result(self, pending, level):
+        """Turn a finished status query into its ack record, caching it, or
+        False on a nak or timeout"""
+        if pending.future.cancelled() or pending.future.exception() is not None:
+            return False
+        status = OrderedDict(pending.future.result())
+        status['error'] = False
+        status['success'] = True
+        self.set_command_response_from_cache(status, pending.device_id, '19', level)
+        return status
 
-    def write_cache_file(self, cache, device_id):
-        filename = device_id + CACHE_FILE
-        self.logger.info("writing cache file for %s", device_id)
 
-        with open(filename + '.temp', 'w') as cachefile:
-            json.dump(cache, cachefile)
+    def single_flight_stats(self):
+        """Return how many status and id requests were shared with an
+        identical in-flight request instead of being sent"""
+        return self.single_flight.stats()
+
+    def rebuild_cache(self, device_id, command, command2):
+        """Query device again and store the fresh response in the cache.
+        Runs on the refresh scheduler's worker pool"""
+        self.logger.info("rebuilding cache for device %s", device_id)
+        status = self.query_device(device_id, command, command2, priority=STATUS)
+        if status:
+            self.set_command_response_from_cache(status, device_id, command, command2)
+        else:
+            self.logger.info("cache rebuild got no response from device %s", device_id)
+        return status
 
-        cachefile.close()
 
-        if os.path.exists(filename):
-            os.remove(filename)
+    def query_device(self, device_id, command, command2, attempts=3, priority=INTERACTIVE):
+        """Send a command and wait for the device's direct ack. Resends up
+        to attempts times. Returns the ack record or False"""
+        device_id = device_id.upper()
+        for attempt in range(attempts):
+            self.direct_command(device_id, command, command2, priority=priority)
+            pending = self.correlator.register(device_id, command, command2)
+            try:
+                record = self.wait_for_response(pending, device_id, time() + ACK_TIMEOUT)
+            except CommandNak:
+                self.metrics.observe('command_retries', attempt, device=device_id, cmd1=command)
+                return False
+            finally:
+                self.correlator.release(pending)
+            if record is not None:
+                self.metrics.observe('command_retries', attempt, device=device_id, cmd1=command)
+                return record
+        self.metrics.observe('command_retries', attempts - 1, device=device_id,
+                             cmd1=command)
+        return False
 
-        os.rename(filename + '.temp', filename)
 
     def get_command_response_from_cache(self, device_id, command, command2):
-        """Gets response"""
+        """Gets response. An expired response is returned as is while a
+        refresh is scheduled in the background"""
         key = self.create_key_from_command(command, command2)
-        command_cache = self.get_cache_from_file(device_id)
-
-        if device_id not in command_cache:
-            command_cache[device_id] = {}
-            return False
-        elif key not in command_cache[device_id]:
+        response = self.command_cache.get(device_id, key)
+        if response is None:
+            self.metrics.inc('cache_lookups_total', result='miss', cmd=command)
             return False
 
-        response = command_cache[device_id][key]
-        expired = False
         if response['ttl'] < int(time()):
-            self.logger.info("cache expired for device %s", device_id)
-            expired = True
-
-            if os.path.exists(LOCK_FILE):
-                self.logger.info("cache locked - will wait to rebuild %s", device_id)
-            else:
-                self.logger.info("cache unlocked - will rebuild %s", device_id)
-                newpid = os.fork()
-                if newpid == 0:
-                    self.rebuild_cache(device_id, command, command2)
-
-        if expired:
+            if is_error(response['response']):
+                # never serve a failure stale, e.g. from an older cache file
+                self.metrics.inc('cache_lookups_total', result='miss', cmd=command)
+                return False
+            self.metrics.inc('cache_lookups_total', result='stale', cmd=command)
             self.logger.info("returning expired cached device status %s", device_id)
+            self.refresher.schedule((device_id, command, command2), self.rebuild_cache,
+                                    device_id, command, command2)
         else:
+            self.metrics.inc('cache_lookups_total', result='hit', cmd=command)
             self.logger.info("returning unexpired cached device status %s", device_id)
 
         return response['response']
 
 
     def clear_device_command_cache(self, device_id):
-
-        command_cache = self.get_cache_from_file(device_id)
-
-        command_cache[device_id] = {}
-
-        self.write_cache_file(command_cache, device_id)
+        """Drop cached responses for device. Called after a command changed
+        the device, so with skip_redundant on the level the device just
+        acked is cached as its status instead"""
+        with self.tracer.span('clear_device_command_cache', device=device_id):
+            self.command_cache.clear_device(device_id)
+            if self.skip_redundant:
+                state = self.state_tracker.confirmed_level(device_id.upper(),
+                                                           self.skip_max_age)
+                if state is not None:
+                    self.set_command_response_from_cache(state.as_status(), device_id.upper(),
+                                                         '19', '00')
 
 
     def set_command_response_from_cache(self, response, device_id, command, command2):
-        """Sets response"""
-        if not device_id:
+        """Sets response. Failed responses are not cached, so an unreachable
+        device is asked again next time"""
+        if not device_id or is_error(response):
             return False
 
         key = self.create_key_from_command(command, command2)
-        ttl = int(time()) + CACHE_TTL
+        with self.tracer.span('cache_write', device=device_id, cmd1=command, cmd2=command2):
+            self.command_cache.set(device_id, key, response, CACHE_TTL)
+
 
-        command_cache = self.get_cache_from_file(device_id)
+    def cache_stats(self):
+        """Return command cache hit/miss/stale statistics"""
+        return self.command_cache.stats()
 
-        if device_id not in command_cache:
-            command_cache[device_id] = {}
 
-        command_cache[device_id][key] = {'ttl': ttl, 'response': response}
+    def refresh_stats(self):
+        """Return background cache refresh queue depth and latency"""
+        return self.refresher.stats()
 
-        self.write_cache_file(command_cache, device_id)
 
     def create_key_from_command(self, command, command2):
         """gets key"""
@@ -504,13 +939,21 @@ class Hub(object):
     def get_buffer_status(self, device_from=None):
         """Main method to read from buffer. Optionally pass in device to
         only get response from that device"""
-        device_from = device_from or ''
+        with self.tracer.span('get_buffer_status', device=device_from) as span:
+            if self.poller is not None and self.poller.is_running():
+                # background poller owns the buffer, use its next snapshot
+                # instead of downloading the buffer again
+                msgs = self.poller.wait_for_snapshot()
+            else:
+                self.read_new_messages()
+                msgs = self.buffer_reader.messages()
+            span.set('messages', len(msgs))
 
-        # only used if device_from passed in
-        return_record = OrderedDict()
-        return_record['success'] = False
-        return_record['error'] = True
+            return self.process_buffer(msgs, device_from)
 
+
+    def read_buffer_text(self):
+        """Download the raw buffer text from the hub"""
         command_url = self.hub_url + '/buffstatus.xml'
         self.logger.info("get_buffer_status: %s", command_url)
 
@@ -519,584 +962,202 @@ class Hub(object):
         raw_text = raw_text.replace('<response><BS>', '')
         raw_text = raw_text.replace('</BS></response>', '')
         raw_text = raw_text.strip()
-        buffer_length = len(raw_text)
         self.logger.info('get_buffer_status: Got raw text with size %s and contents: %s',
-                         buffer_length, raw_text)
-
-        if buffer_length == 202:
-            # 2015 hub
-            # the last byte in the buffer indicates where it stopped writing.
-            # checking for text after that position would show if the buffer
-            # has overlapped and allow ignoring the old stuff after
-            buffer_end = raw_text[-2:]
-            buffer_end_int = int(buffer_end, 16)
-            raw_text = raw_text[0:buffer_end_int]
-            self.logger.info('bufferEnd hex %s dec %s', buffer_end, buffer_end_int)
-            self.logger.info('get_buffer_status: non wrapped %s', raw_text)
-
-        self.buffer_status = OrderedDict()
-
-        self.buffer_status['error'] = False
-        self.buffer_status['success'] = True
-        self.buffer_status['message'] = ''
-        self.buffer_status['msgs'] = []
-
-        buffer_contents = StringIO(raw_text)
-
-        while True:
-
-            msg = buffer_contents.read(4)
-            if (len(msg) < 4) or (msg == '') or (msg == '0000'):
-                break
-
-            #im_start = msg[0:2]
-            im_cmd = msg[2:4]
-
-            response_record = OrderedDict()
-            response_record['im_code'] = im_cmd
-
-            # Standard Message Received
-            if im_cmd == '50':
-                msg = msg + buffer_contents.read(18)
-                response_record['im_code_desc'] = 'Standard Message Received'
-                response_record['raw'] = msg
-                response_record['id_from'] = msg[4:10]
-                # direct id high, group group_id, broadcast cat
-                response_record['id_high'] = msg[10:12]
-                # direct id mid, broadcast subcat
-                response_record['id_mid'] = msg[12:14]
-                # direct id low, broadcast firmware version
-                response_record['id_low'] = msg[14:16]
-                # 2 ack, 8 broadcast
-                response_record['flag1'] = msg[16:17]
-                # hop count B
-                response_record['flag2'] = msg[17:18]
-                # direct cmd, broadcast 01, status db delta
-                response_record['cmd1'] = msg[18:20]
-                # direct cmd 2, broadcast 00, status on level
-                response_record['cmd2'] = msg[20:22]
-
-            # Extended Mesage Received
-            elif im_cmd == '51':
-                msg = msg + buffer_contents.read(46)
-
-                response_record['im_code_desc'] = 'Extended Message Received'
-                response_record['raw'] = msg
-                response_record['id_from'] = msg[4:10]
-                # direct id high, group group_id, broadcast cat
-                response_record['id_high'] = msg[10:12]
-                # direct id mid, broadcast subcat
-                response_record['id_mid'] = msg[12:14]
-                # direct id low, broadcast firmware version
-                response_record['id_low'] = msg[14:16]
-                # 2 ack, 8 broadcast + hop count B
-                response_record['flags'] = msg[16:18]
-                # direct cmd, broadcast 01, status db delta
-                response_record['cmd1'] = msg[18:20]
-                # direct cmd 2, broadcast 00, status on level
-                response_record['cmd2'] = msg[20:22]
-                response_record['user_data_1'] = msg[22:24]
-                response_record['user_data_2'] = msg[24:26]
-                response_record['user_data_3'] = msg[26:28]
-                response_record['user_data_4'] = msg[28:30]
-                response_record['user_data_5'] = msg[30:32]
-                response_record['user_data_6'] = msg[32:34]
-                response_record['user_data_7'] = msg[34:36]
-                response_record['user_data_8'] = msg[36:38]
-                response_record['user_data_9'] = msg[38:40]
-                response_record['user_data_10'] = msg[40:42]
-                response_record['user_data_11'] = msg[42:44]
-                response_record['user_data_12'] = msg[44:46]
-                response_record['user_data_13'] = msg[46:48]
-                response_record['user_data_14'] = msg[48:50]
-
-            # X10 Received (not implemented)
-            elif im_cmd == '52':
-                self.logger.error('Not implemented handling of 0252 X10 Received')
-                break
-
-            # ALL-Linking Completed
-            elif im_cmd == '53':
-                msg = msg = buffer_contents.read(16)
-
-                response_record['im_code_desc'] = 'ALL-Linking Completed'
-                response_record['raw'] = msg
-                response_record['link_status'] = msg[4:6]
-
-                if response_record['link_status'] == '00':
-                    response_record['link_status_desc'] = 'IM is Responder'
-                elif response_record['link_status'] == '01':
-                    response_record['link_status_desc'] = 'IM is Controller'
-                elif response_record['link_status'] == 'FF':
-                    response_record['link_status_desc'] = 'Link Deleted'
-
-                response_record['group'] = msg[6:8]
-                response_record['id_high'] = msg[8:10]
-                response_record['id_mid'] = msg[10:12]
-                response_record['id_low'] = msg[12:14]
-                response_record['dev_cat'] = msg[14:16]
-                response_record['dev_subcat'] = msg[16:18]
-                response_record['dev_firmware_rev'] = msg[18:20] # or FF for newer devices
-
-            # Button Event Report
-            elif im_cmd == '54':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Button Event Report'
-                response_record['raw'] = msg
-                response_record['report_type'] = msg[4:6]
-                if response_record['report_type'] == "02":
-                    response_record['report_type_desc'] = "IM's SET Button tapped"
-                elif response_record['report_type'] == "03":
-                    response_record['report_type_desc'] = "IM's SET Button held"
-                elif response_record['report_type'] == "04":
-                    response_record['report_type_desc'] = "IM's SET Button released after hold"
-                elif response_record['report_type'] == "12":
-                    response_record['report_type_desc'] = "IM's Button 2 tapped"
-                elif response_record['report_type'] == "13":
-                    response_record['report_type_desc'] = "IM's Button 2 held"
-                elif response_record['report_type'] == "14":
-                    response_record['report_type_desc'] = "IM's Button 2 released after hold"
-                elif response_record['report_type'] == "22":
-                    response_record['report_type_desc'] = "IM's Button 3 tapped"
-                elif response_record['report_type'] == "23":
-                    response_record['report_type_desc'] = "IM's Button 3 held"
-                elif response_record['report_type'] == "24":
-                    response_record['report_type_desc'] = "IM's Button 3 released after hold"
-
-            # User Reset Detected
-            elif im_cmd == '55':
-                response_record['im_code_desc'] = 'User Reset Detected'
-                response_record['raw'] = msg
-                response_record['im_code_desc2'] = "User pushed and held IM's " \
-                                                   "SET Button on power up"
-
-            # ALL-Link Cleanup Failure Report
-            elif im_cmd == '56':
-                msg = msg + buffer_contents.read(10)
-
-                response_record['im_code_desc'] = 'ALL-Link Cleanup Failure Report'
-                response_record['raw'] = msg
-                response_record['group'] = msg[4:6]
-                # 01 means member did not acknlowedge all-link cleanup cmd
-                response_record['ack'] = msg[6:8]
-                response_record['id_high'] = msg[8:10]
-                response_record['id_mid'] = msg[10:12]
-                response_record['id_low'] = msg[12:14]
-
-            # ALL-Link Record Response
-            elif im_cmd == '57':
-                msg = msg + buffer_contents.read(20)
-
-                response_record['im_code_desc'] = 'ALL-Link Record Response'
-                response_record['raw'] = msg
-                response_record['flags'] = msg[4:6] # hub dev manual p 39
-                response_record['group'] = msg[6:8]
-                response_record['id_high'] = msg[8:10]
-                response_record['id_mid'] = msg[10:12]
-                response_record['id_low'] = msg[12:14]
-                response_record['link_data_1'] = msg[14:16]
-                response_record['link_data_2'] = msg[16:18]
-                response_record['link_data_3'] = msg[18:20]
-
-            # ALL-Link Cleanup Status Report
-            elif im_cmd == '58':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'ALL-Link Cleanup Status Report'
-                response_record['raw'] = msg
-                response_record['cleanup_status'] = msg[4:6]
-                if response_record['cleanup_status'] == '06':
-                    response_record['cleanup_status_desc'] = 'ALL-Link Cleanup ' \
-                                                            'sequence completed'
-                elif response_record['cleanup_status'] == '15':
-                    response_record['cleanup_status_desc'] = 'ALL-Link Cleanup ' \
-                                                             'sequence aborted due ' \
-                                                             'to INSTEON traffic'
-
-            # Database Record Found
-            elif im_cmd == '59':
-                msg = msg + buffer_contents.read(18)
-
-                response_record['im_code_desc'] = 'Database Record Found'
-                response_record['raw'] = msg
-                response_record['address_low'] = msg[4:6]
-                response_record['record_flags'] = msg[6:8]
-                response_record['group'] = msg[8:10]
-                response_record['id_high'] = msg[10:12]
-                response_record['id_mid'] = msg[12:14]
-                response_record['id_low'] = msg[14:16]
-                response_record['link_data_1'] = msg[16:18]
-                response_record['link_data_2'] = msg[18:20]
-                response_record['link_data_3'] = msg[20:22]
-
-            # Get IM Info
-            elif im_cmd == '60':
-                msg = msg + buffer_contents.read(14)
-
-                response_record['im_code_desc'] = 'Get IM Info'
-                response_record['raw'] = msg
-                response_record['id_high'] = msg[4:6]
-                response_record['id_mid'] = msg[6:8]
-                response_record['id_low'] = msg[8:10]
-                response_record['dev_cat'] = msg[10:12]
-                response_record['dev_subcat'] = msg[12:14]
-                response_record['dev_firmware_rev'] = msg[14:16]
-                response_record['ack_or_nak'] = msg[16:18] # 06 ack
-
-            # Send ALL-Link Command
-            elif im_cmd == '61':
-                msg = msg + buffer_contents.read(8)
-
-                response_record['im_code_desc'] = 'Send ALL-Link Command'
-                response_record['raw'] = msg
-                response_record['group'] = msg[4:6]
-                response_record['cmd'] = msg[6:8]
-                response_record['broadcast_cmd2'] = msg[8:10] # FF or 00
-                response_record['ack_or_nak'] = msg[10:12] # 06 ack
-
-            # Send Message (Pass through command to PLM)
-            elif im_cmd == '62':
-                msg = msg + buffer_contents.read(8)
-                response_record['id'] = msg[4:10]
-                response_record['flags'] = msg[10:12]
-
-                # Standard Message
-                if response_record['flags'][0] == '0':
-                    response_record['im_code_desc'] = 'Send Standard Message'
-                    msg = msg + buffer_contents.read(6)
-                    response_record['cmd1'] = msg[12:14]
-                    response_record['cmd2'] = msg[14:16]
-                    response_record['ack_or_nak'] = msg[16:18] # 06 ack 15 nak
-
-                # Extended Message
-                elif response_record['flags'][0] == '1':
-                    response_record['im_code_desc'] = 'Send Extended Message'
-                    msg = msg + buffer_contents.read(34)
-                    response_record['cmd1'] = msg[12:14]
-                    response_record['cmd2'] = msg[14:16]
-                    response_record['user_data_1'] = msg[16:18]
-                    response_record['user_data_2'] = msg[18:20]
-                    response_record['user_data_3'] = msg[20:22]
-                    response_record['user_data_4'] = msg[22:24]
-                    response_record['user_data_5'] = msg[24:26]
-                    response_record['user_data_6'] = msg[26:28]
-                    response_record['user_data_7'] = msg[28:30]
-                    response_record['user_data_8'] = msg[30:32]
-                    response_record['user_data_9'] = msg[32:34]
-                    response_record['user_data_10'] = msg[34:36]
-                    response_record['user_data_11'] = msg[36:38]
-                    response_record['user_data_12'] = msg[38:40]
-                    response_record['user_data_13'] = msg[40:42]
-                    response_record['user_data_14'] = msg[42:44]
-                    response_record['ack_or_nak'] = msg[44:46] # 06 ack 15 nak
-
-                # Not implemented
-                else:
-                    self.logger.error('Not implemented, message flag %s' % response_record['flags'])
+                         len(raw_text), raw_text)
+        return raw_text
+
+
+    def read_new_messages(self):
+        """Download the buffer and parse only messages written since the
+        previous read. The 2015 hub's 202 char ring buffer is unwrapped
+        using its trailing write pointer"""
+        with self.io_lock:
+            new_msgs = self.buffer_reader.read(self.read_buffer_text())
+            # matched read by read in buffer order, under the lock that
+            # orders reads and posts
+            self.correlator.match(new_msgs, self.buffer_reader.mark() - len(new_msgs),
+                                  self.buffer_reader.gap)
+            self.state_tracker.observe(new_msgs)
+        self.metrics.observe('buffer_poll_messages', len(new_msgs))
+        if self.buffer_reader.lost:
+            self.logger.error("read_new_messages: hub buffer wrapped past the last "
+                              "read, some messages were lost")
+        return new_msgs
+
+
+    def process_buffer(self, msgs, device_from=None):
+        """Update buffer status from parsed messages. Returns last record
+        from device_from if passed in"""
+        device_from = device_from or ''
 
-                response_record['raw'] = msg
+        # only used if device_from passed in
+        return_record = OrderedDict()
+        return_record['success'] = False
+        return_record['error'] = True
 
-            # Send X10 (not implemented)
-            elif im_cmd == '63':
-                self.logger.error('Not implemented handling of 0263 Send X10')
-                break
+        buffer_status = OrderedDict()
 
-            # Start ALL-Linking
-            elif im_cmd == '64':
-                msg = msg + buffer_contents.read(6)
-
-                response_record['im_code_desc'] = 'Start ALL-Linking'
-                response_record['raw'] = msg
-                response_record['link_type'] = msg[4:6]
-
-                if response_record['link_type'] == '00':
-                    response_record['link_type_desc'] = 'IM is Responder'
-                elif response_record['link_type'] == '01':
-                    response_record['link_type_desc'] = 'IM is Controller'
-                elif response_record['link_type'] == '03':
-                    response_record['link_type_desc'] = 'IM is Either Responder ' \
-                                                        'or Controller'
-                elif response_record['link_type'] == 'FF':
-                    response_record['link_type_desc'] = 'Link Deleted'
-
-                response_record['group'] = msg[6:8]
-                response_record['ack_or_nak'] = msg[8:10] # 06 ack 15 nak
-
-            # Cancel ALL-Linking
-            elif im_cmd == '65':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Cancel ALL-Linking'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # Set Host Device Category
-            elif im_cmd == '66':
-                msg = msg + buffer_contents.read(8)
-
-                response_record['im_code_desc'] = 'Set Host Device Category'
-                response_record['raw'] = msg
-                response_record['dev_cat'] = msg[4:6]
-                response_record['dev_subcat'] = msg[6:8]
-                response_record['dev_firmware_rev'] = msg[8:10] # or 00
-                response_record['ack_or_nak'] = msg[10:12] # 06 ack 15 nak
-
-            # Reset the IM
-            elif im_cmd == '67':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Reset the IM'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # Set INSTEON ACK Message Byte
-            elif im_cmd == '68':
-                msg = msg + buffer_contents.read(4)
-
-                response_record['im_code_desc'] = 'Set INSTEON ACK Message Byte'
-                response_record['raw'] = msg
-                response_record['cmd2_data'] = msg[4:6]
-                response_record['ack_or_nak'] = msg[6:8] # 06 ack 15 nak
-
-            # Get First ALL-Link Record
-            elif im_cmd == '69':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Get First ALL-Link Record'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # Get Next ALL-Link Record
-            elif im_cmd == '6A':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Get Next ALL-Link Record'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # Set IM Configuration
-            elif im_cmd == '6B':
-                msg = msg + buffer_contents.read(4)
-
-                response_record['im_code_desc'] = 'Set IM Configuration'
-                response_record['raw'] = msg
-                response_record['im_cfg_flags'] = msg[4:6]
-                response_record['ack_or_nak'] = msg[6:8] # 06 ack 15 nak
-
-            # Get ALL-Link Record for Sender
-            elif im_cmd == '6C':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Get ALL-Link Record for Sender'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # LED On
-            elif im_cmd == '6D':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'LED On'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # LED Off
-            elif im_cmd == '6E':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'LED Off'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # Manage ALL-Link Record
-            elif im_cmd == '6F':
-                msg = msg + buffer_contents.read(20)
-
-                response_record['im_code_desc'] = 'Manage ALL-Link Record'
-                response_record['raw'] = msg
-                response_record['ctrl_flags'] = msg[4:6]
-                response_record['record_flags'] = msg[6:8]
-                response_record['group'] = msg[8:10]
-                response_record['id_high'] = msg[10:12]
-                response_record['id_mid'] = msg[12:14]
-                response_record['id_low'] = msg[14:16]
-                response_record['link_data_1'] = msg[16:18]
-                response_record['link_data_2'] = msg[18:20]
-                response_record['link_data_3'] = msg[20:22]
-                response_record['ack_or_nak'] = msg[22:24] # 06 ack
-
-            # Set INSTEON ACK Message Two Bytes
-            elif im_cmd == '71':
-                msg = msg + buffer_contents.read(6)
-
-                response_record['im_code_desc'] = 'Set INSTEON ACK Message Two Bytes'
-                response_record['raw'] = msg
-                response_record['cmd1_data'] = msg[4:6]
-                response_record['cmd2_data'] = msg[6:8]
-                response_record['ack_or_nak'] = msg[8:10] # 06 ack
-
-            # RF Sleep
-            elif im_cmd == '72':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'RF Sleep'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack
-
-            # Get IM Configuration
-            elif im_cmd == '73':
-                msg = msg + buffer_contents.read(8)
-
-                response_record['im_code_desc'] = 'Get IM Configuration'
-                response_record['raw'] = msg
-                response_record['im_cfg_flags'] = msg[4:6]
-                response_record['spare1'] = msg[6:8]
-                response_record['spare2'] = msg[8:10]
-                response_record['ack_or_nak'] = msg[10:12] # 06 ack
-
-            # Cancel Cleanup
-            elif im_cmd == '74':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Cancel Cleanup'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # Read 8 bytes from Database
-            elif im_cmd == '75':
-                msg = msg + buffer_contents.read(30)
-
-                response_record['im_code_desc'] = 'Read 8 bytes from Database'
-                response_record['raw'] = msg
-                response_record['db_addr_high'] = msg[4:6]
-                response_record['db_addr_low'] = msg[6:8] # low nibble F, or 8
-                response_record['ack_or_nak'] = msg[8:10] # 06 ack
-                response_record['record'] = msg[10:34] # database record founnd
-                                                       # response 12 bytes
-
-            # Write 8 bytes to Database
-            elif im_cmd == '76':
-                msg = msg + buffer_contents.read(22)
-
-                response_record['im_code_desc'] = 'Write 8 bytes to Database'
-                response_record['raw'] = msg
-                response_record['db_addr_high'] = msg[4:6]
-                response_record['db_addr_low'] = msg[6:8] # low nibble F, or 8
-                response_record['record_flags'] = msg[8:10]
-                response_record['group'] = msg[10:12]
-                response_record['id_high'] = msg[12:14]
-                response_record['id_middle'] = msg[14:16]
-                response_record['id_low'] = msg[16:18]
-                response_record['link_data_1'] = msg[18:20]
-                response_record['link_data_2'] = msg[20:22]
-                response_record['link_data_3'] = msg[22:24]
-                response_record['ack_or_nak'] = msg[24:26] # 06 ac
-
-            # Beep
-            elif im_cmd == '77':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Beep'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack 15 nak
-
-            # Set Status
-            # IM reports Status in cmd2 of direct Status Request command (19)
-            elif im_cmd == '78':
-                msg = msg + buffer_contents.read(2)
-
-                response_record['im_code_desc'] = 'Set Status'
-                response_record['raw'] = msg
-                response_record['ack_or_nak'] = msg[4:6] # 06 ack
-
-            # Set Database Link Data for Next Link
-            elif im_cmd == '79':
-                msg = msg + buffer_contents.read(8)
-
-                response_record['im_code_desc'] = 'Set Database Link Data for Next Link'
-                response_record['raw'] = msg
-                response_record['link_data_1'] = msg[4:6]
-                response_record['link_data_2'] = msg[6:8]
-                response_record['link_data_3'] = msg[8:10]
-                response_record['ack_or_nak'] = msg[10:12] # 06 ack
-
-            # Set Application Retries for New Links
-            elif im_cmd == '7A':
-                msg = msg + buffer_contents.read(4)
-
-                response_record['im_code_desc'] = 'Set Application Retries for New Links'
-                response_record['raw'] = msg
-                response_record['num_retries'] = msg[4:6]
-                response_record['ack_or_nak'] = msg[6:8] # 06 ack
-
-            # Set RF Frequency Offset
-            elif im_cmd == '7B':
-                msg = msg + buffer_contents.read(4)
-
-                response_record['im_code_desc'] = 'Set RF Frequency Offset'
-                response_record['raw'] = msg
-                response_record['rf_freq_offset'] = msg[4:6]
-                response_record['ack_or_nak'] = msg[6:8] # 06 ack
-
-            # Set Acknowledge for TempLinc Command (not implemented)
-            elif im_cmd == '7C':
-                self.logger.error('Not implemented handling of 027C Set '
-                                  'Acknowledge for TempLinc command')
-                break
+        buffer_status['error'] = False
+        buffer_status['success'] = True
+        buffer_status['message'] = ''
+        buffer_status['msgs'] = msgs
+        buffer_status['lost'] = self.buffer_reader.lost
 
+        for response_record in msgs:
             if response_record.get('ack_or_nak', '') == '15':
-                self.buffer_status['error'] = True
-                self.buffer_status['success'] = False
-                self.buffer_status['message'] = 'Device returned nak'
+                buffer_status['error'] = True
+                buffer_status['success'] = False
+                buffer_status['message'] = 'Device returned nak'
 
             response_device_from = response_record.get('id_from', '')
             if device_from and device_from == response_device_from:
-                return_record = response_record
+                return_record = OrderedDict(response_record)
                 return_record['error'] = False
                 return_record['success'] = True
                 if 'cmd1' in response_record and 'cmd2' in response_record:
-                    self.set_command_response_from_cache(response_record, device_from, response_record['cmd1'], response_record['cmd2'])
+                    self.set_command_response_from_cache(return_record, device_from,
+                                                         response_record['cmd1'],
+                                                         response_record['cmd2'])
 
-            self.buffer_status['msgs'].append(response_record)
+        self.buffer_status = buffer_status
+        self.logger.debug("get_buffer_status: %s", pprint.pformat(buffer_status))
 
         # Return last status from this device
         return return_record
 
-        # Tell hub to clear buffer
-        self.clear_buffer()
 
-        #pprint.pprint(self.buffer_status)
-        self.logger.debug("get_buffer_status: %s", pprint.pformat(self.buffer_status))
+    def parse_buffer(self, raw_text):
+        """Parse raw buffer text into a list of message records"""
+        msgs, _ = parse_messages(raw_text, self.logger)
+        return msgs
+
+
+    def start_poller(self, interval=POLL_INTERVAL):
+        """Start background buffer poller. While it runs, get_buffer_status
+        reuses its snapshots instead of downloading the buffer itself"""
+        with self.poller_lock:
+            if self.poller is None:
+                self.poller = BufferPoller(self, interval)
+            else:
+                self.poller.interval = interval
+            self.poller.start()
+            return self.poller
+
+
+    def stop_poller(self):
+        """Stop background buffer poller"""
+        if self.poller is not None:
+            self.poller.stop()
+
+
+    def subscribe(self, callback, id_from=None, im_code=None, cmd1=None):
+        """Call callback(record) for each new buffer message matching the
+        filters. Messages are delivered once start_poller has been called"""
+        with self.poller_lock:
+            if self.poller is None:
+                self.poller = BufferPoller(self)
+        return self.poller.subscribe(callback, id_from, im_code, cmd1)
 
-        return self.buffer_status
+
+    def unsubscribe(self, subscription_id):
+        """Remove a buffer message subscription"""
+        if self.poller is None:
+            return False
+        return self.poller.unsubscribe(subscription_id)
 
 
-    def check_success(self, device_id, sent_cmd1, sent_cmd2):
-        """Check if last command succeeded by checking buffer"""
+    def check_success(self, device_id, sent_cmd1, sent_cmd2, timeout=ACK_TIMEOUT):
+        """Check if last command succeeded by waiting for its ack in the
+        buffer. Returns as soon as the ack or a nak shows up, or False after
+        timeout seconds"""
         device_id = device_id.upper()
 
         self.logger.info('check_success: for device %s cmd1 %s cmd2 %s',
                          device_id, sent_cmd1, sent_cmd2)
 
-        sleep(2)
-        status = self.get_buffer_status(device_id)
-        check_id = status.get('id_from', '')
-        cmd1 = status.get('cmd1', '')
-        cmd2 = status.get('cmd2', '')
-        if (check_id == device_id) and (cmd1 == sent_cmd1) and (cmd2 == sent_cmd2):
-            self.logger.info("check_success: Response device %s cmd %s cmd2 %s SUCCESS",
-                             check_id, cmd1, cmd2)
-            return True
-
-        self.logger.info("check_success: No valid response found for device %s cmd %s cmd2 %s",
-                         device_id, sent_cmd1, sent_cmd2)
-        return False
+        with self.tracer.span('check_success', device=device_id, cmd1=sent_cmd1,
+                              cmd2=sent_cmd2) as span:
+            pending = self.correlator.register(device_id, sent_cmd1, sent_cmd2, timeout)
+            try:
+                record = self.wait_for_response(pending, device_id, time() + timeout)
+            except CommandNak:
+                self.logger.info("check_success: NAK for device %s cmd %s cmd2 %s",
+                                 device_id, sent_cmd1, sent_cmd2)
+                span.set('outcome', 'nak')
+                return False
+            except CommandSuperseded as err:
+                self.logger.info("check_success: %s", err)
+                span.set('outcome', 'superseded')
+                return False
+            finally:
+                self.correlator.release(pending)
+
+            if record is not None:
+                self.logger.info("check_success: Response device %s cmd %s cmd2 %s SUCCESS",
+                                 device_id, record.get('cmd1', ''), record.get('cmd2', ''))
+                span.set('outcome', 'ack')
+                hops = hop_count(record)
+                if hops is not None:
+                    span.set('hops', hops[0])
+                    span.set('max_hops', hops[1])
+                return True
+
+            self.logger.info("check_success: No valid response found for device %s "
+                             "cmd %s cmd2 %s", device_id, sent_cmd1, sent_cmd2)
+            span.set('outcome', 'timeout')
+            return False
+
+
+    def wait_for_response(self, pending, device_id, deadline):
+        """Wait for pending command's ack until deadline. Polls the buffer
+        with a short backoff unless the background poller is feeding the
+        correlator already. Returns the ack record or None on timeout,
+        raises CommandNak on a nak and CommandSuperseded if a newer command
+        replaced it before it was sent"""
+        start = time()
+        delay = POLL_MIN_DELAY
+        while True:
+            if pending.future.done():
+                break
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+
+            if self.poller is not None and self.poller.is_running():
+                futures.wait([pending.future], remaining)
+                continue
+
+            sleep(min(delay, remaining))
+            delay = min(delay * 2, POLL_MAX_DELAY)
+            self.get_buffer_status(device_id)
+
+        outcome = self.response_outcome(pending)
+        self.metrics.observe('response_wait_seconds', time() - start, device=device_id,
+                             cmd1=pending.cmd1, outcome=outcome)
+
+        if outcome == 'timeout':
+            return None
+        return pending.future.result()
+
+
+    def response_outcome(self, pending):
+        """How the wait for pending's response ended: 'ack', 'nak',
+        'superseded' or 'timeout'"""
+        if not pending.future.done() or pending.future.cancelled():
+            return 'timeout'
+        if isinstance(pending.future.exception(), CommandSuperseded):
+            return 'superseded'
+        if pending.future.exception() is not None:
+            return 'nak'
+        return 'ack'
 
 
     def clear_buffer(self):
         """Clear the hub buffer"""
         command_url = self.hub_url + '/1?XB=M=1'
-        response = self.post_direct_command(command_url)
+        with self.io_lock:
+            response = self.post_direct_command(command_url)
+            self.buffer_reader.reset()
         self.logger.info("clear_buffer: %s", response)
         return response
 
@@ -1162,3 +1223,39 @@ class Hub(object):
         """Create outlet object"""
         outlet_obj = OnOffOutlet(self, device_id)
         return outlet_obj
+
+
+    def device(self, device_id):
+        """Create the device object matching the device's category. The
+        identity comes from the registry, so only unknown devices are probed"""
+        kind = self.device_kind(device_id, self.identify(device_id))
+        if kind is None:
+            return None
+        return getattr(self, kind)(device_id)
+
+
+    def device_kind(self, device_id, identity):
+        """Name of the factory method for a device identity, or None"""
+        if identity is None:
+            self.logger.error("device: could not identify device %s", device_id)
+            return None
+
+        cat = identity.get('cat', '')
+        sub_cat = identity.get('sub_cat', '')
+        if cat == '01' and sub_cat == FANLINC_SUBCAT:
+            return 'fan'
+        if cat == '01':
+            return 'dimmer'
+        if cat == '02' and sub_cat in OUTLET_SUBCATS:
+            return 'onoffoutlet'
+        if cat == '02':
+            return 'switch'
+
+        self.logger.error("device: unsupported category %s:%s for device %s",
+                          cat, sub_cat, device_id)
+        return None
+
+
+    def registry_stats(self):
+        """Return device registry size and hit/miss counters"""
+        return self.registry.stats()
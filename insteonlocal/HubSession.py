@@ -0,0 +1,103 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+POOL_CONNECTIONS = 1 # one hub per session, so one host pool is enough
+POOL_MAXSIZE = 2 # the hub's http server struggles with more than a couple
+
+class HubSession(object):
+    """Pooled keep-alive HTTP session for talking to a single hub. Auth is
+    set once and TCP connections are reused between commands and buffer
+    polls instead of opening a new one per request"""
+    def __init__(self, username, password, timeout=10,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 pool_block=True, max_retries=0):
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+
+        self.session = requests.Session()
+        self.session.auth = requests.auth.HTTPBasicAuth(username, password)
+        self.session.headers['Connection'] = 'keep-alive'
+
+        # pool_block makes callers wait for a free connection instead of
+        # opening extra throwaway connections beyond pool_maxsize
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block,
+                                   max_retries=max_retries)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self.lock = threading.Lock()
+        self.requests_sent = 0
+        self.errors = 0
+
+
+    def post(self, url):
+        """Send a post over the pooled session"""
+        return self.request('POST', url)
+
+
+    def get(self, url):
+        """Send a get over the pooled session"""
+        return self.request('GET', url)
+
+
+    def request(self, method, url):
+        """Send request over the pooled session and count it"""
+        with self.lock:
+            self.requests_sent += 1
+        try:
+            return self.session.request(method, url, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            with self.lock:
+                self.errors += 1
+            raise
+
+
+    def stats(self):
+        """Return connection reuse statistics. connections_opened is the
+        number of TCP connections urllib3 had to create, everything else
+        was served over an existing keep-alive connection"""
+        connections_opened = 0
+        pool_requests = 0
+        pools = self.adapter.poolmanager.pools
+        for pool_key in list(pools.keys()):
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            connections_opened += pool.num_connections
+            pool_requests += pool.num_requests
+
+        reused = max(pool_requests - connections_opened, 0)
+        if pool_requests:
+            reuse_ratio = float(reused) / pool_requests
+        else:
+            reuse_ratio = 0.0
+
+        return {
+            'requests': self.requests_sent,
+            'errors': self.errors,
+            'connections_opened': connections_opened,
+            'connections_reused': reused,
+            'reuse_ratio': reuse_ratio,
+            'pool_maxsize': self.pool_maxsize,
+        }
+
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
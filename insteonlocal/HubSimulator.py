@@ -0,0 +1,399 @@
+import argparse
+import base64
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from insteonlocal.BufferReader import RING_DATA_LENGTH
+from insteonlocal.Codec import BYTE_HEX
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Simulated insteon hub for offline testing and benchmarks. Serves the same
+# http endpoints as a 2242/2245 hub and answers commands from virtual
+# devices after a configurable powerline latency.
+
+HUB_ID = '44AA11'
+LATENCY = 0.05 #seconds from command to device response
+LINEAR_BUFFER_LENGTH = 2000 # pre-2015 hubs, cleared when full
+STEP = 8 # level change of a brighten/dim step
+
+# kind: (cat, sub_cat) reported in id requests and ALDB records
+DEVICE_KINDS = {
+    'dimmer': ('01', '20'),
+    'switch': ('02', '2A'),
+    'fan': ('01', '2E'),
+    'outlet': ('02', '39'),
+}
+
+ACK = '2B' # direct ack, max hops 3
+NAK = 'AB' # direct nak
+BROADCAST = '8B'
+GROUP_BROADCAST = 'CB' # all-link broadcast
+GROUP_CLEANUP = '4B' # all-link cleanup
+
+class VirtualDevice(object):
+    """Simulated insteon device state and command handling"""
+    def __init__(self, address, kind='dimmer', cat=None, sub_cat=None, firmware='45',
+                 groups=('01',)):
+        self.address = address.upper()
+        self.kind = kind
+        default_cat, default_sub_cat = DEVICE_KINDS[kind]
+        self.cat = cat or default_cat
+        self.sub_cat = sub_cat or default_sub_cat
+        self.firmware = firmware
+        self.groups = list(groups)
+        self.level = '00'
+        self.fan_level = '00' # FanLinc fan, light is level
+        self.bottom_level = '00' # outlet bottom, top is level
+        self.commands = 0
+
+
+    def on_level(self, cmd2):
+        """Level a device lands on for an on command"""
+        if self.kind == 'dimmer' or self.kind == 'fan':
+            return cmd2
+        return 'FF'
+
+
+    def set_level(self, level, extended):
+        """Apply a new level to the addressed load"""
+        if self.kind == 'fan' and extended.startswith('02'):
+            self.fan_level = level
+        elif self.kind == 'outlet' and extended.startswith('02'):
+            self.bottom_level = level
+        else:
+            self.level = level
+
+
+    def handle(self, cmd1, cmd2, extended=''):
+        """Apply a direct command. Returns (flags, cmd1, cmd2) of the
+        direct response, plus broadcast (cmd1, cmd2) or None"""
+        self.commands += 1
+        broadcast = None
+        if cmd1 in ('11', '12'):
+            level = self.on_level(cmd2) if cmd1 == '11' else 'FF'
+            self.set_level(level, extended)
+        elif cmd1 in ('13', '14'):
+            self.set_level('00', extended)
+        elif cmd1 == '21' and self.kind == 'dimmer':
+            self.level = cmd2
+        elif cmd1 in ('15', '16') and self.kind == 'dimmer':
+            step = STEP if cmd1 == '15' else -STEP
+            self.level = BYTE_HEX[max(0, min(255, int(self.level, 16) + step))]
+        elif cmd1 == '19':
+            if cmd2 == '03' and self.kind == 'fan':
+                return ACK, '00', self.fan_level, None
+            if cmd2 == '01' and self.kind == 'outlet':
+                # outlet status: bit 0 top, bit 1 bottom
+                bits = (self.level != '00') | (self.bottom_level != '00') << 1
+                return ACK, '00', BYTE_HEX[bits], None
+            return ACK, '00', self.level, None
+        elif cmd1 == '10':
+            broadcast = ('01', '00')
+        elif cmd1 not in ('17', '18', '30', '02'):
+            return NAK, cmd1, 'FF', None
+        return ACK, cmd1, cmd2, broadcast
+
+
+class HubSimulator(object):
+    """Threaded http server that behaves like an insteon hub. Supports the
+    2015 hub's 202 char ring buffer (ring=True) and the older linear
+    buffer, basic auth, virtual devices, an ALDB for 0269/026A, and
+    configurable latency and rate of dropped device responses"""
+    def __init__(self, username='admin', password='password', host='127.0.0.1', port=0,
+                 ring=True, latency=LATENCY, drop_rate=0.0, seed=None, logger=None):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.ring = ring
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.logger = logger
+
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.aldb = []
+        self.aldb_cursor = 0
+        self.clear_buffer()
+
+        self.requests = 0
+        self.commands = 0
+        self.dropped = 0
+
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+
+    @property
+    def port(self):
+        """Port the simulator listens on"""
+        return self.server.server_address[1]
+
+
+    def add_device(self, address, kind='dimmer', **kwargs):
+        """Add a virtual device and its ALDB records. Returns the device"""
+        device = VirtualDevice(address, kind, **kwargs)
+        with self.lock:
+            self.devices[device.address] = device
+            for group in device.groups:
+                self.aldb.append('0257' + 'E2' + group + device.address
+                                 + device.cat + device.sub_cat + device.firmware)
+        return device
+
+
+    def start(self):
+        """Serve in a daemon thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='insteonlocal-simulator')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        """Shut the server down"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+    def clear_buffer(self):
+        """Empty the message buffer, /1?XB=M=1"""
+        with self.lock:
+            self.ring_data = ['0'] * RING_DATA_LENGTH
+            self.ring_pointer = 0
+            self.linear = ''
+
+
+    def write(self, message):
+        """Append a message to the buffer"""
+        with self.lock:
+            if self.ring:
+                for char in message:
+                    self.ring_data[self.ring_pointer] = char
+                    self.ring_pointer = (self.ring_pointer + 1) % RING_DATA_LENGTH
+            else:
+                if len(self.linear) + len(message) > LINEAR_BUFFER_LENGTH:
+                    self.linear = ''
+                self.linear += message
+
+
+    def write_later(self, message, delay=None):
+        """Write a message after the powerline latency"""
+        timer = threading.Timer(self.latency if delay is None else delay,
+                                self.write, (message,))
+        timer.daemon = True
+        timer.start()
+
+
+    def buffer_text(self):
+        """Buffer as served by /buffstatus.xml"""
+        with self.lock:
+            if self.ring:
+                return ''.join(self.ring_data) + BYTE_HEX[self.ring_pointer]
+            return self.linear
+
+
+    def dropped_response(self):
+        """Decide whether the powerline loses this device response"""
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return True
+        return False
+
+
+    def command(self, frame):
+        """Handle a command frame posted to /3?"""
+        self.commands += 1
+        im_code = frame[2:4]
+        if im_code == '62':
+            self.direct_command(frame)
+        elif im_code in ('69', '6A'):
+            self.aldb_command(im_code)
+        else:
+            self.write(frame + '06')
+
+
+    def direct_command(self, frame):
+        """Echo a send message and queue the device's response"""
+        device_id = frame[4:10]
+        flags = frame[10:12]
+        cmd1 = frame[12:14]
+        cmd2 = frame[14:16]
+        extended = frame[16:] if flags[0:1] == '1' else ''
+        self.write(frame + '06')
+
+        device = self.devices.get(device_id)
+        if device is None or self.dropped_response():
+            return
+
+        response_flags, response_cmd1, response_cmd2, broadcast = \
+            device.handle(cmd1, cmd2, extended)
+        self.write_later('0250' + device_id + HUB_ID + response_flags
+                         + response_cmd1 + response_cmd2)
+        if broadcast is not None:
+            self.write_later('0250' + device_id + device.cat + device.sub_cat
+                             + device.firmware + BROADCAST + broadcast[0] + broadcast[1],
+                             self.latency * 2)
+
+
+    def press(self, address, cmd1='11', group='01'):
+        """Simulate someone using a device's paddle: the device changes
+        level and sends a group broadcast and then a cleanup to the hub"""
+        device = self.devices[address.upper()]
+        device.handle(cmd1, 'FF')
+        self.write('0250' + device.address + '0000' + group + GROUP_BROADCAST + cmd1 + '00')
+        self.write_later('0250' + device.address + HUB_ID + GROUP_CLEANUP + cmd1 + group)
+
+
+    def aldb_command(self, im_code):
+        """Get first/next ALL-Link record"""
+        with self.lock:
+            if im_code == '69':
+                self.aldb_cursor = 0
+            if self.aldb_cursor >= len(self.aldb):
+                record = None
+            else:
+                record = self.aldb[self.aldb_cursor]
+                self.aldb_cursor += 1
+
+        if record is None:
+            self.write('02' + im_code + '15')
+            return
+        self.write('02' + im_code + '06')
+        self.write_later(record, self.latency / 2)
+
+
+    def scene_command(self, frame):
+        """Handle a group command posted to /0?"""
+        self.commands += 1
+        cmd1 = frame[0:2]
+        group = frame[2:4]
+        self.write('0261' + group + cmd1 + '00' + '06')
+        for device in list(self.devices.values()):
+            if group in device.groups and cmd1 in ('11', '12', '13', '14'):
+                device.handle(cmd1, 'FF')
+        self.write_later('0258' + '06')
+
+
+    def authorized(self, header):
+        """Check a basic auth header"""
+        expected = base64.b64encode(('%s:%s' % (self.username, self.password))
+                                    .encode('utf-8')).decode('ascii')
+        return header == 'Basic ' + expected
+
+
+    def make_handler(self):
+        """Build the request handler class bound to this simulator"""
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Hub http endpoints"""
+            protocol_version = 'HTTP/1.1'
+
+            def reply(self, code, body=''):
+                """Send a response with keep-alive"""
+                data = body.encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def handle_request(self):
+                """Dispatch on the request path"""
+                simulator.requests += 1
+                if not simulator.authorized(self.headers.get('Authorization', '')):
+                    self.send_response(401)
+                    self.send_header('WWW-Authenticate', 'Basic realm="Insteon Hub"')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                path = self.path
+                if path.startswith('/buffstatus.xml'):
+                    self.reply(200, '<response><BS>' + simulator.buffer_text()
+                               + '</BS></response>')
+                    return
+                if path.startswith('/1?XB=M=1'):
+                    simulator.clear_buffer()
+                elif path.startswith('/3?'):
+                    simulator.command(path[3:].split('=')[0].upper())
+                elif path.startswith('/0?'):
+                    simulator.scene_command(path[3:].split('=')[0].upper())
+                else:
+                    self.reply(404)
+                    return
+                self.reply(200)
+
+            do_GET = handle_request
+            do_POST = handle_request
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                if simulator.logger is not None:
+                    simulator.logger.debug("simulator: " + format, *args)
+
+        return Handler
+
+
+    def stats(self):
+        """Return request counters"""
+        return {
+            'requests': self.requests,
+            'commands': self.commands,
+            'dropped': self.dropped,
+            'devices': len(self.devices),
+        }
+
+
+def main():
+    """Run a simulator from the command line"""
+    parser = argparse.ArgumentParser(description='Simulated insteon hub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=25105)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--linear', action='store_true', help='pre-2015 linear buffer')
+    parser.add_argument('--latency', type=float, default=LATENCY)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--devices', type=int, default=10, help='virtual devices per kind')
+    args = parser.parse_args()
+
+    simulator = HubSimulator(args.username, args.password, args.host, args.port,
+                             ring=not args.linear, latency=args.latency,
+                             drop_rate=args.drop_rate)
+    for index, kind in enumerate(sorted(DEVICE_KINDS)):
+        for number in range(args.devices):
+            simulator.add_device('%02X%04X' % (0x20 + index, number), kind)
+    simulator.start()
+    print('Simulated hub on http://%s:%s' % (args.host, simulator.port))
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+ALDB_RETRIES = 2 # restarts of the link database walk after a record timed out
+
+class LinkWalk(object):
+    """Progress of a walk through the hub's link database. Get next (026A)
+    can't be repeated without skipping a record, so a record that timed out
+    restarts the walk from get first (0269) and passes over the records
+    already read. After retries restarts the walk gives up and is marked
+    incomplete"""
+    def __init__(self, logger, retries=ALDB_RETRIES):
+        self.logger = logger
+        self.retries = retries
+        self.command = '0269'
+        self.position = 0 # records read since the walk (re)started
+        self.count = 0 # records handed out
+        self.restarts = 0
+        self.done = False
+        self.complete = True
+
+
+    def take(self, result):
+        """Take a read_aldb_record result: a record, None at the end of the
+        database or False on a timeout. Returns the record if it wasn't
+        handed out before a restart, otherwise None"""
+        if result is None:
+            self.done = True
+            return None
+
+        if result is False:
+            if self.restarts >= self.retries:
+                self.logger.error("get_linked: link record %s timed out %s times, "
+                                  "device list is partial", self.count + 1, self.restarts + 1)
+                self.done = True
+                self.complete = False
+                return None
+            self.restarts += 1
+            self.logger.info("get_linked: link record %s timed out, restarting the walk",
+                             self.count + 1)
+            self.command = '0269'
+            self.position = 0
+            return None
+
+        self.command = '026A'
+        self.position += 1
+        if self.position <= self.count:
+            return None
+        self.count += 1
+        return result
@@ -0,0 +1,58 @@
+from requests import HTTPError
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+class LocalResponse(object):
+    """Stands in for the requests.Response of a command that was handled
+    without its own post to the hub. outcome says how: 'skipped' because
+    the device is already at that level, 'coalesced' into the queued
+    command of another caller, which posts it, or 'superseded' by a newer
+    command before it was sent. A superseded command never ran, so its
+    response is falsy with status 409"""
+    reason = 'OK'
+    text = ''
+    content = b''
+
+    def __init__(self, url, outcome):
+        self.url = url
+        self.outcome = outcome
+        self.headers = {}
+        if outcome == 'superseded':
+            self.status_code = 409
+            self.reason = 'Superseded'
+        else:
+            self.status_code = 200
+
+
+    @property
+    def ok(self): # pylint: disable=invalid-name
+        """True unless the command never ran"""
+        return self.status_code < 400
+
+
+    def __bool__(self):
+        """Truthy like a requests.Response, unless the command never ran"""
+        return self.ok
+
+
+    def raise_for_status(self):
+        """Raise HTTPError like requests does if the command never ran"""
+        if not self.ok:
+            raise HTTPError('%s %s: %s' % (self.status_code, self.reason, self.url),
+                            response=self)
+
+
+    def __repr__(self):
+        """Short description with the outcome"""
+        return '<LocalResponse [%s %s]>' % (self.status_code, self.outcome)
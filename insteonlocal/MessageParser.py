@@ -0,0 +1,281 @@
+from insteonlocal.Records import record_class, UnknownMessage
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Message layouts from the hub developer guide. Field widths are in hex
+# characters and follow the leading 02 and im code. Fields of None means
+# handling is not implemented.
+
+USER_DATA = tuple('user_data_%d' % i for i in range(1, 15))
+
+LINK_CODE_DESC = {
+    '00': 'IM is Responder',
+    '01': 'IM is Controller',
+    '03': 'IM is Either Responder or Controller',
+    'FF': 'Link Deleted',
+}
+
+REPORT_TYPE_DESC = {
+    '02': "IM's SET Button tapped",
+    '03': "IM's SET Button held",
+    '04': "IM's SET Button released after hold",
+    '12': "IM's Button 2 tapped",
+    '13': "IM's Button 2 held",
+    '14': "IM's Button 2 released after hold",
+    '22': "IM's Button 3 tapped",
+    '23': "IM's Button 3 held",
+    '24': "IM's Button 3 released after hold",
+}
+
+CLEANUP_STATUS_DESC = {
+    '06': 'ALL-Link Cleanup sequence completed',
+    '15': 'ALL-Link Cleanup sequence aborted due to INSTEON traffic',
+}
+
+# im_code: (description, fields, extra). fields are (name, width) pairs laid
+# out one after another from offset 4. extra holds '_desc' lookups for
+# coded fields and constant values
+IM_MESSAGES = {
+    '50': ('Standard Message Received',
+           (('id_from', 6), ('id_high', 2), ('id_mid', 2), ('id_low', 2),
+            ('flag1', 1), ('flag2', 1), ('cmd1', 2), ('cmd2', 2)), {}),
+    '51': ('Extended Message Received',
+           (('id_from', 6), ('id_high', 2), ('id_mid', 2), ('id_low', 2),
+            ('flags', 2), ('cmd1', 2), ('cmd2', 2))
+           + tuple((name, 2) for name in USER_DATA), {}),
+    '52': ('X10 Received', None, {}),
+    '53': ('ALL-Linking Completed',
+           (('link_status', 2), ('group', 2), ('id_high', 2), ('id_mid', 2),
+            ('id_low', 2), ('dev_cat', 2), ('dev_subcat', 2),
+            ('dev_firmware_rev', 2)),
+           {'link_status': LINK_CODE_DESC}),
+    '54': ('Button Event Report', (('report_type', 2),),
+           {'report_type': REPORT_TYPE_DESC}),
+    '55': ('User Reset Detected', (),
+           {'im_code_desc2': "User pushed and held IM's SET Button on power up"}),
+    '56': ('ALL-Link Cleanup Failure Report',
+           (('group', 2), ('ack', 2), ('id_high', 2), ('id_mid', 2),
+            ('id_low', 2)), {}),
+    '57': ('ALL-Link Record Response',
+           (('flags', 2), ('group', 2), ('id_high', 2), ('id_mid', 2),
+            ('id_low', 2), ('link_data_1', 2), ('link_data_2', 2),
+            ('link_data_3', 2)), {}),
+    '58': ('ALL-Link Cleanup Status Report', (('cleanup_status', 2),),
+           {'cleanup_status': CLEANUP_STATUS_DESC}),
+    '59': ('Database Record Found',
+           (('address_low', 2), ('record_flags', 2), ('group', 2),
+            ('id_high', 2), ('id_mid', 2), ('id_low', 2), ('link_data_1', 2),
+            ('link_data_2', 2), ('link_data_3', 2)), {}),
+    '60': ('Get IM Info',
+           (('id_high', 2), ('id_mid', 2), ('id_low', 2), ('dev_cat', 2),
+            ('dev_subcat', 2), ('dev_firmware_rev', 2), ('ack_or_nak', 2)), {}),
+    '61': ('Send ALL-Link Command',
+           (('group', 2), ('cmd', 2), ('broadcast_cmd2', 2), ('ack_or_nak', 2)), {}),
+    '63': ('Send X10', None, {}),
+    '64': ('Start ALL-Linking',
+           (('link_type', 2), ('group', 2), ('ack_or_nak', 2)),
+           {'link_type': LINK_CODE_DESC}),
+    '65': ('Cancel ALL-Linking', (('ack_or_nak', 2),), {}),
+    '66': ('Set Host Device Category',
+           (('dev_cat', 2), ('dev_subcat', 2), ('dev_firmware_rev', 2),
+            ('ack_or_nak', 2)), {}),
+    '67': ('Reset the IM', (('ack_or_nak', 2),), {}),
+    '68': ('Set INSTEON ACK Message Byte', (('cmd2_data', 2), ('ack_or_nak', 2)), {}),
+    '69': ('Get First ALL-Link Record', (('ack_or_nak', 2),), {}),
+    '6A': ('Get Next ALL-Link Record', (('ack_or_nak', 2),), {}),
+    '6B': ('Set IM Configuration', (('im_cfg_flags', 2), ('ack_or_nak', 2)), {}),
+    '6C': ('Get ALL-Link Record for Sender', (('ack_or_nak', 2),), {}),
+    '6D': ('LED On', (('ack_or_nak', 2),), {}),
+    '6E': ('LED Off', (('ack_or_nak', 2),), {}),
+    '6F': ('Manage ALL-Link Record',
+           (('ctrl_flags', 2), ('record_flags', 2), ('group', 2),
+            ('id_high', 2), ('id_mid', 2), ('id_low', 2), ('link_data_1', 2),
+            ('link_data_2', 2), ('link_data_3', 2), ('ack_or_nak', 2)), {}),
+    '71': ('Set INSTEON ACK Message Two Bytes',
+           (('cmd1_data', 2), ('cmd2_data', 2), ('ack_or_nak', 2)), {}),
+    '72': ('RF Sleep', (('ack_or_nak', 2),), {}),
+    '73': ('Get IM Configuration',
+           (('im_cfg_flags', 2), ('spare1', 2), ('spare2', 2), ('ack_or_nak', 2)), {}),
+    '74': ('Cancel Cleanup', (('ack_or_nak', 2),), {}),
+    '75': ('Read 8 bytes from Database',
+           (('db_addr_high', 2), ('db_addr_low', 2), ('ack_or_nak', 2),
+            ('record', 24)), {}),
+    '76': ('Write 8 bytes to Database',
+           (('db_addr_high', 2), ('db_addr_low', 2), ('record_flags', 2),
+            ('group', 2), ('id_high', 2), ('id_middle', 2), ('id_low', 2),
+            ('link_data_1', 2), ('link_data_2', 2), ('link_data_3', 2),
+            ('ack_or_nak', 2)), {}),
+    '77': ('Beep', (('ack_or_nak', 2),), {}),
+    # IM reports Status in cmd2 of direct Status Request command (19)
+    '78': ('Set Status', (('ack_or_nak', 2),), {}),
+    '79': ('Set Database Link Data for Next Link',
+           (('link_data_1', 2), ('link_data_2', 2), ('link_data_3', 2),
+            ('ack_or_nak', 2)), {}),
+    '7A': ('Set Application Retries for New Links',
+           (('num_retries', 2), ('ack_or_nak', 2)), {}),
+    '7B': ('Set RF Frequency Offset', (('rf_freq_offset', 2), ('ack_or_nak', 2)), {}),
+    '7C': ('Set Acknowledge for TempLinc command', None, {}),
+}
+
+# Send Message (0262) layout depends on the first flags nibble: 0 standard,
+# 1 extended. Echoed by the IM with an ack/nak byte at the end
+SEND_MESSAGE_HEADER = (('id', 6), ('flags', 2))
+SEND_MESSAGE_VARIANTS = {
+    '0': ('Send Standard Message',
+          SEND_MESSAGE_HEADER + (('cmd1', 2), ('cmd2', 2), ('ack_or_nak', 2)), {}),
+    '1': ('Send Extended Message',
+          SEND_MESSAGE_HEADER + (('cmd1', 2), ('cmd2', 2))
+          + tuple((name, 2) for name in USER_DATA) + (('ack_or_nak', 2),), {}),
+}
+SEND_MESSAGE_FLAGS_OFFSET = 10
+
+
+class MessageSpec(object):
+    """Compiled layout of one IM message. record turns a raw message into a
+    lazy record, decode into a plain dict, encode does the reverse"""
+    def __init__(self, im_code, desc, fields, extra, variant=''):
+        self.im_code = im_code
+        self.desc = desc
+        self.implemented = fields is not None
+        fields = fields or ()
+
+        self.names = tuple(name for name, _ in fields)
+        self.slices = []
+        offset = 4
+        for _, width in fields:
+            self.slices.append((offset, offset + width))
+            offset += width
+        self.length = offset
+
+        self.lookups = tuple((name, value) for name, value in extra.items()
+                             if isinstance(value, dict))
+        self.constants = tuple((name, value) for name, value in extra.items()
+                               if not isinstance(value, dict))
+
+        self.decode = self.compile_decoder()
+        self.record = record_class(self, variant)
+
+
+    def compile_decoder(self):
+        """Generate a decode(msg) function for this layout that builds the
+        record as a single dict literal of plain slices"""
+        items = ['"im_code": %r' % self.im_code,
+                 '"im_code_desc": %r' % self.desc,
+                 '"raw": msg']
+        for name, (start, end) in zip(self.names, self.slices):
+            items.append('%r: msg[%d:%d]' % (name, start, end))
+        for name, value in self.constants:
+            items.append('%r: %r' % (name, value))
+
+        lines = ['def decode(msg):',
+                 '    record = {%s}' % ', '.join(items)]
+        namespace = {}
+        for name, lookup in self.lookups:
+            lookup_name = 'LOOKUP_' + name
+            namespace[lookup_name] = lookup
+            lines.append('    desc = %s.get(record[%r])' % (lookup_name, name))
+            lines.append('    if desc is not None:')
+            lines.append('        record[%r] = desc' % (name + '_desc'))
+        lines.append('    return record')
+
+        exec('\n'.join(lines), namespace) # pylint: disable=exec-used
+        return namespace['decode']
+
+
+    def encode(self, fields):
+        """Build raw message text from a mapping of field values. Missing
+        fields are zero filled"""
+        parts = ['02', self.im_code]
+        for name, (start, end) in zip(self.names, self.slices):
+            value = fields.get(name, '') or ''
+            parts.append(value.upper().rjust(end - start, '0')[:end - start])
+        return ''.join(parts)
+
+
+MESSAGE_SPECS = dict((im_code, MessageSpec(im_code, *spec))
+                     for im_code, spec in IM_MESSAGES.items())
+SEND_MESSAGE_SPECS = dict((flag, MessageSpec('62', *spec, variant=spec[0].split()[1]))
+                          for flag, spec in SEND_MESSAGE_VARIANTS.items())
+
+
+def get_spec(im_code, flags=''):
+    """Return compiled spec for an im code. flags picks the 0262 variant"""
+    if im_code == '62':
+        return SEND_MESSAGE_SPECS.get(flags[0:1])
+    return MESSAGE_SPECS.get(im_code)
+
+
+# im_code: (length, record class) for the hot path of parse_messages
+DECODERS = dict((im_code, (spec.length, spec.record))
+                for im_code, spec in MESSAGE_SPECS.items() if spec.implemented)
+SEND_DECODERS = dict((flag, (spec.length, spec.record))
+                     for flag, spec in SEND_MESSAGE_SPECS.items())
+
+
+def parse_messages(raw_text, logger=None):
+    """Parse buffer text into Record objects. Returns (records, consumed)
+    where consumed is how many chars made up complete messages, so a
+    message cut off at the end can be picked up on the next read"""
+    records = []
+    append = records.append
+    decoders = DECODERS
+    pos = 0
+    text_length = len(raw_text)
+
+    while pos + 4 <= text_length:
+        im_code = raw_text[pos + 2:pos + 4]
+        decoder = decoders.get(im_code)
+
+        if decoder is None:
+            if raw_text.startswith('0000', pos):
+                break
+            if im_code == '62':
+                flags_at = pos + SEND_MESSAGE_FLAGS_OFFSET
+                if flags_at + 1 > text_length:
+                    break
+                decoder = SEND_DECODERS.get(raw_text[flags_at])
+                if decoder is None:
+                    if logger:
+                        logger.error('Not implemented, message flag %s',
+                                     raw_text[flags_at:flags_at + 2])
+                    break
+            elif im_code in MESSAGE_SPECS:
+                if logger:
+                    logger.error('Not implemented handling of 02%s %s', im_code,
+                                 MESSAGE_SPECS[im_code].desc)
+                break
+            else:
+                # unknown code, keep it and move on to the next header
+                append(UnknownMessage(raw_text[pos:pos + 4]))
+                pos += 4
+                continue
+
+        end = pos + decoder[0]
+        if end > text_length:
+            break
+        append(decoder[1](raw_text[pos:end]))
+        pos = end
+
+    return records, pos
+
+
+def encode_message(im_code, fields=None, **kwargs):
+    """Build raw message text for im_code from field values, the reverse of
+    parse_messages"""
+    values = dict(fields or {})
+    values.update(kwargs)
+    spec = get_spec(im_code.upper(), values.get('flags', ''))
+    if spec is None or not spec.implemented:
+        raise ValueError('Cannot encode im code %s' % im_code)
+    return spec.encode(values)
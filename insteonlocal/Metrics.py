@@ -0,0 +1,183 @@
+import threading
+from bisect import bisect_left
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+PREFIX = 'insteonlocal_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) #seconds
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'http_request_seconds': ('histogram', 'HTTP round trip to the hub by endpoint',
+                             LATENCY_BUCKETS),
+    'ack_latency_seconds': ('histogram', 'Time from posting a command to its powerline ack',
+                            LATENCY_BUCKETS),
+    'response_wait_seconds': ('histogram', 'Time spent waiting for a command response '
+                                           'by outcome', LATENCY_BUCKETS),
+    'command_retries': ('histogram', 'Resends needed per command', COUNT_BUCKETS),
+    'buffer_poll_messages': ('histogram', 'New messages found per buffer read',
+                             COUNT_BUCKETS),
+    'commands_total': ('counter', 'Direct commands sent', None),
+    'commands_skipped_total': ('counter', 'Commands not sent because the device was known '
+                                          'to be in the requested state', None),
+    'commands_coalesced_total': ('counter', 'Level commands replaced by a newer one for the '
+                                            'same device before being sent', None),
+    'naks_total': ('counter', 'Commands answered with a nak', None),
+    'ack_timeouts_total': ('counter', 'Commands that got no ack before their deadline', None),
+    'cache_lookups_total': ('counter', 'Command cache lookups by result', None),
+}
+
+
+class Histogram(object):
+    """Bucketed distribution of observed values"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+
+    def observe(self, value):
+        """Add a value"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+
+    def cumulative(self):
+        """Yield (upper bound, count of values <= bound) pairs"""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+    def snapshot(self):
+        """Return the histogram as a dict"""
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'min': self.min,
+            'max': self.max,
+            'buckets': [[bound, count] for bound, count in self.cumulative()],
+        }
+
+
+class Metrics(object):
+    """Thread-safe counters and histograms keyed by name and labels, with a
+    snapshot dict and the Prometheus text exposition format"""
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+
+    def observe(self, name, value, **labels):
+        """Add value to the histogram name"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(METRICS[name][2])
+                self.histograms[key] = histogram
+            histogram.observe(value)
+
+
+    def inc(self, name, amount=1, **labels):
+        """Increase the counter name"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+
+    def reset(self):
+        """Forget all recorded values"""
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+
+    def snapshot(self):
+        """Return {name: [{'labels': {...}, ...values}]} for all metrics"""
+        result = {}
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                entry = histogram.snapshot()
+                entry['labels'] = dict(labels)
+                result.setdefault(name, []).append(entry)
+            for (name, labels), value in sorted(self.counters.items()):
+                result.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        return result
+
+
+    def prometheus(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            histograms = [(key, list(histogram.cumulative()), histogram.sum, histogram.count)
+                          for key, histogram in sorted(self.histograms.items())]
+            counters = sorted(self.counters.items())
+
+        described = set()
+        for (name, labels), buckets, total, count in histograms:
+            self.describe(lines, described, name)
+            metric = self.prefix + name
+            for bound, bucket_count in buckets:
+                bucket_labels = labels + (('le', format_bound(bound)),)
+                lines.append('%s_bucket%s %d' % (metric, format_labels(bucket_labels),
+                                                 bucket_count))
+            lines.append('%s_sum%s %r' % (metric, format_labels(labels), total))
+            lines.append('%s_count%s %d' % (metric, format_labels(labels), count))
+
+        for (name, labels), value in counters:
+            self.describe(lines, described, name)
+            lines.append('%s%s %d' % (self.prefix + name, format_labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+    def describe(self, lines, described, name):
+        """Add HELP and TYPE lines once per metric name"""
+        if name in described:
+            return
+        described.add(name)
+        metric_type, help_text = METRICS[name][0:2]
+        lines.append('# HELP %s%s %s' % (self.prefix, name, help_text))
+        lines.append('# TYPE %s%s %s' % (self.prefix, name, metric_type))
+
+
+def format_bound(bound):
+    """Prometheus le label value"""
+    if bound == float('inf'):
+        return '+Inf'
+    return repr(float(bound))
+
+
+def format_labels(labels):
+    """Prometheus label set, empty string if there are no labels"""
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                                          .replace('"', '\\"'))
+                             for key, value in labels)
@@ -1,4 +1,5 @@
 import pprint
+from insteonlocal.Codec import OUTLET_BOTTOM_PAYLOAD
 
 #    This program is free software: you can redistribute it and/or modify
 #    it under the terms of the GNU General Public License as published by
@@ -71,7 +72,7 @@ class OnOffOutlet():
         """ Turn bottom outlet on"""
         self.logger.info("On/Off Outlet Bottom %s on", self.device_id)
 
-        self.hub.direct_command(self.device_id, '11', 'FF', '02000000000000000000000000')
+        self.hub.direct_command(self.device_id, '11', 'FF', OUTLET_BOTTOM_PAYLOAD)
 
         success = self.hub.check_success(self.device_id, '11', 'FF')
 
@@ -91,7 +92,7 @@ class OnOffOutlet():
         """Turn top off"""
         self.logger.info("On/Off Outlet Bottom {} off".format(self.device_id))
 
-        self.hub.direct_command(self.device_id, '13', 'FF', '02000000000000000000000000')
+        self.hub.direct_command(self.device_id, '13', 'FF', OUTLET_BOTTOM_PAYLOAD)
 
         success = self.hub.check_success(self.device_id, '13', 'FF')
 
@@ -0,0 +1,159 @@
+from collections.abc import Mapping
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+MISSING = object()
+
+class Record(Mapping):
+    """Parsed IM message backed only by its raw text. Fields are sliced out
+    of the raw message when read, so a record costs one small object no
+    matter how many fields its message has. Reads like the dict records
+    parse_messages used to return; as_dict() gives a real dict"""
+    __slots__ = ('raw',)
+
+    # filled in per message layout by record_class
+    IM_CODE = ''
+    IM_CODE_DESC = ''
+    SPANS = {} # field name: (start, end) in raw
+    CONSTANTS = {}
+    LOOKUPS = {} # field_desc name: ((start, end), {value: desc})
+    KEYS = ()
+    DECODE = None
+
+    def __init__(self, raw):
+        self.raw = raw
+
+
+    def __getitem__(self, key):
+        span = self.SPANS.get(key)
+        if span is not None:
+            return self.raw[span[0]:span[1]]
+        if key == 'im_code':
+            return self.IM_CODE
+        if key == 'im_code_desc':
+            return self.IM_CODE_DESC
+        if key == 'raw':
+            return self.raw
+        value = self.CONSTANTS.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        lookup = self.LOOKUPS.get(key)
+        if lookup is not None:
+            (start, end), descs = lookup
+            value = descs.get(self.raw[start:end])
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+
+    def get(self, key, default=None):
+        span = self.SPANS.get(key)
+        if span is not None:
+            return self.raw[span[0]:span[1]]
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+
+    def __iter__(self):
+        for key in self.KEYS:
+            yield key
+        for key, ((start, end), descs) in self.LOOKUPS.items():
+            if self.raw[start:end] in descs:
+                yield key
+
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.raw)
+
+
+    def as_dict(self):
+        """Decode all fields into a plain dict"""
+        return self.DECODE(self.raw)
+
+
+class StandardMessage(Record):
+    """Standard message received (0250)"""
+    __slots__ = ()
+
+
+class ExtendedMessage(Record):
+    """Extended message received (0251)"""
+    __slots__ = ()
+
+
+class AllLinkRecord(Record):
+    """ALL-Link database record (0257)"""
+    __slots__ = ()
+
+
+class ImEcho(Record):
+    """IM echo of a sent standard or extended message (0262)"""
+    __slots__ = ()
+
+
+class ImMessage(Record):
+    """Any other IM message"""
+    __slots__ = ()
+
+
+class UnknownMessage(Record):
+    """Header of a message with an unknown im code"""
+    __slots__ = ()
+    KEYS = ('im_code', 'raw')
+
+    def __getitem__(self, key):
+        if key == 'im_code':
+            return self.raw[2:4]
+        if key == 'raw':
+            return self.raw
+        raise KeyError(key)
+
+
+    def as_dict(self):
+        """Decode all fields into a plain dict"""
+        return {'im_code': self.raw[2:4]}
+
+
+FAMILIES = {'50': StandardMessage, '51': ExtendedMessage, '57': AllLinkRecord,
+            '62': ImEcho}
+
+def record_class(spec, variant=''):
+    """Build the record class for a compiled MessageSpec. variant tells
+    apart layouts sharing an im code, like standard and extended 0262"""
+    base = FAMILIES.get(spec.im_code, ImMessage)
+    spans = dict(zip(spec.names, spec.slices))
+    attrs = {
+        '__slots__': (),
+        'IM_CODE': spec.im_code,
+        'IM_CODE_DESC': spec.desc,
+        'SPANS': spans,
+        'CONSTANTS': dict(spec.constants),
+        'LOOKUPS': dict((field + '_desc', (spans[field], descs))
+                        for field, descs in spec.lookups),
+        'KEYS': ('im_code', 'im_code_desc', 'raw') + spec.names
+                + tuple(field for field, _ in spec.constants),
+        'DECODE': staticmethod(spec.decode),
+        '__module__': __name__,
+    }
+    return type(base.__name__ + spec.im_code + variant, (base,), attrs)
@@ -0,0 +1,126 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+REFRESH_WORKERS = 2
+MAX_QUEUED = 32 # refreshes waiting for a worker before new ones are dropped
+
+class RefreshScheduler(object):
+    """Runs cache refreshes on a small bounded worker pool so stale entries
+    can be served right away. Only one refresh per key is queued or running
+    at a time"""
+    def __init__(self, logger, max_workers=REFRESH_WORKERS, max_queued=MAX_QUEUED):
+        self.logger = logger
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.lock = threading.Lock()
+        self.executor = None
+        self.in_flight = {}
+
+        self.queued = 0
+        self.running = 0
+        self.scheduled = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+
+    def schedule(self, key, func, *args):
+        """Queue func(*args) unless a refresh for key is already queued or
+        running. Returns True if a new refresh was queued"""
+        with self.lock:
+            if key in self.in_flight:
+                self.deduplicated += 1
+                return False
+            if self.queued >= self.max_queued:
+                self.dropped += 1
+                self.logger.info("refresh queue full, dropping refresh for %s", key)
+                return False
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                   thread_name_prefix='insteonlocal-refresh')
+            self.queued += 1
+            self.scheduled += 1
+            self.in_flight[key] = self.executor.submit(self.run, key, time(), func, args)
+            return True
+
+
+    def run(self, key, queued_at, func, args):
+        """Worker body, records latency and clears the in-flight entry"""
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            func(*args)
+            failed = False
+        except Exception as err: # pylint: disable=broad-except
+            failed = True
+            self.logger.error("refresh for %s failed: %s", key, err)
+
+        latency = time() - queued_at
+        with self.lock:
+            self.running -= 1
+            del self.in_flight[key]
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+
+
+    def is_pending(self, key):
+        """Check if a refresh for key is queued or running"""
+        with self.lock:
+            return key in self.in_flight
+
+
+    def shutdown(self, wait=True):
+        """Stop the worker pool. Queued refreshes that have not started are
+        cancelled"""
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        with self.lock:
+            for key, future in list(self.in_flight.items()):
+                if future.cancelled():
+                    self.queued -= 1
+                    del self.in_flight[key]
+
+
+    def stats(self):
+        """Return refresh counters, queue depth and latency in seconds"""
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                'queue_depth': self.queued,
+                'running': self.running,
+                'scheduled': self.scheduled,
+                'deduplicated': self.deduplicated,
+                'dropped': self.dropped,
+                'completed': self.completed,
+                'failed': self.failed,
+                'last_latency': self.last_latency,
+                'avg_latency': self.total_latency / finished if finished else 0.0,
+                'max_latency': self.max_latency,
+            }
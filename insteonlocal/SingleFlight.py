@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import Future
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+class SingleFlight(object):
+    """Coalesces concurrent calls for the same key. The first caller runs
+    the request, callers arriving while it is in flight wait for it and
+    get the same result (or exception) instead of sending their own"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+        self.executed = 0
+        self.saved = 0
+
+
+    def do(self, key, func, *args):
+        """Run func(*args) once for all concurrent callers with key"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+                self.executed += 1
+            else:
+                self.saved += 1
+
+        if not leader:
+            return call.result()
+
+        try:
+            call.set_result(func(*args))
+        except BaseException as err: # pylint: disable=broad-except
+            call.set_exception(err)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return call.result()
+
+
+    async def do_async(self, key, coro_func, *args):
+        """Await coro_func(*args) once for all concurrent coroutines with key.
+        The call runs as its own task, so cancelling any caller, the first
+        one included, leaves it running for the others"""
+        # imported here so the sync Hub doesn't pay for loading asyncio
+        import asyncio
+        loop = asyncio.get_event_loop()
+        with self.lock:
+            task = self.async_calls.get((loop, key))
+            if task is None:
+                task = asyncio.ensure_future(coro_func(*args))
+                self.async_calls[(loop, key)] = task
+                task.add_done_callback(lambda _: self.forget_async(loop, key, task))
+                self.executed += 1
+            else:
+                self.saved += 1
+
+        return await asyncio.shield(task)
+
+
+    def forget_async(self, loop, key, task):
+        """Drop a finished async call so the next caller starts a new one"""
+        if not task.cancelled():
+            # retrieved here so a failure nobody waits for anymore isn't logged
+            task.exception()
+        with self.lock:
+            if self.async_calls.get((loop, key)) is task:
+                del self.async_calls[(loop, key)]
+
+
+    def stats(self):
+        """Return how many requests ran and how many were saved by sharing
+        an in-flight one"""
+        with self.lock:
+            return {
+                'in_flight': len(self.calls) + len(self.async_calls),
+                'executed': self.executed,
+                'saved': self.saved,
+            }
@@ -0,0 +1,286 @@
+import threading
+from collections import OrderedDict
+from time import time
+from insteonlocal.MessageParser import IM_MESSAGES
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+STATE_MAX_AGE = 300 #seconds a known state answers status requests
+SKIP_MAX_AGE = 300 #seconds a confirmed state makes repeated commands redundant
+MIN_CONFIDENCE = 0.8
+
+# confidence by how the state was learned
+STATUS = 1.0 # status request response
+ACK = 0.95 # direct ack of a command we sent
+CLEANUP = 0.9 # all-link cleanup sent to the hub after a paddle press
+BROADCAST = 0.8 # all-link group broadcast from a paddle press
+
+GROUP_BROADCAST_FLAG = 'C'
+GROUP_CLEANUP_FLAG = '4'
+LOAD_GROUP = '01' # group 1 follows the load, other buttons don't
+SWITCH_CATEGORY = '02'
+
+ON_FAST_LEVEL = 'FF'
+OFF_LEVEL = '00'
+UNKNOWN = None
+CONFIRMED_SOURCES = ('ack', 'status') # states the device itself reported to us
+
+def status_record(device_id, cmd1, cmd2):
+    """Standard message record with the keys of a parsed 0250 response, for
+    answers that didn't come from the buffer. raw is None and fields
+    nothing was learned about (flags, the to address) are empty"""
+    desc, fields, _ = IM_MESSAGES['50']
+    record = OrderedDict()
+    record['im_code'] = '50'
+    record['im_code_desc'] = desc
+    record['raw'] = None
+    for name, _ in fields:
+        record[name] = ''
+    record['id_from'] = device_id
+    record['cmd1'] = cmd1
+    record['cmd2'] = cmd2
+    record['error'] = False
+    record['success'] = True
+    return record
+
+
+def target_level(cmd1, cmd2):
+    """Level a direct command leaves the load at, or None if it can't be
+    known in advance"""
+    if cmd1 in ('11', '21'):
+        return cmd2
+    if cmd1 == '12':
+        return ON_FAST_LEVEL
+    if cmd1 in ('13', '14'):
+        return OFF_LEVEL
+    return None
+
+
+class DeviceState(object):
+    """What is known about a device's load. level is the hex level, or None
+    when only on/off is known (e.g. a dimmer turned on at its local on
+    level) or nothing is (a manual change in progress)"""
+    def __init__(self, device_id, level, on, source, confidence, updated):
+        self.device_id = device_id
+        self.level = level
+        self.on = on
+        self.source = source
+        self.confidence = confidence
+        self.updated = updated
+
+
+    def age(self, now=None):
+        """Seconds since the state was learned"""
+        return (now or time()) - self.updated
+
+
+    def as_status(self):
+        """Status record with the fields get_device_status returns, with the
+        level in cmd2"""
+        status = status_record(self.device_id, '00', self.level)
+        status['source'] = self.source
+        status['confidence'] = self.confidence
+        status['updated'] = self.updated
+        return status
+
+
+    def as_dict(self):
+        """State as a plain dict"""
+        return {
+            'device_id': self.device_id,
+            'level': self.level,
+            'on': self.on,
+            'source': self.source,
+            'confidence': self.confidence,
+            'updated': self.updated,
+        }
+
+
+class StateTracker(object):
+    """Per-device state inferred from traffic that passes through the
+    buffer anyway: acks of commands we sent, status responses, and the
+    group broadcasts and cleanups devices send when someone uses their
+    paddle. Lets status requests be answered without powerline traffic"""
+    def __init__(self, logger, registry=None, max_age=STATE_MAX_AGE,
+                 min_confidence=MIN_CONFIDENCE):
+        self.logger = logger
+        self.registry = registry
+        self.max_age = max_age
+        self.min_confidence = min_confidence
+        self.lock = threading.Lock()
+        self.states = {}
+        self.listeners = []
+        self.updates = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def add_listener(self, callback):
+        """Call callback(state) whenever a device state changes"""
+        with self.lock:
+            self.listeners.append(callback)
+
+
+    def remove_listener(self, callback):
+        """Stop calling callback"""
+        with self.lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+
+    def update(self, device_id, level, on, source, confidence, updated=None):
+        """Record a device state"""
+        state = DeviceState(device_id, level, on, source, confidence, updated or time())
+        with self.lock:
+            self.states[device_id] = state
+            self.updates += 1
+            listeners = list(self.listeners)
+
+        self.logger.info("state: device %s level %s on %s from %s", device_id, level,
+                         on, source)
+        for callback in listeners:
+            try:
+                callback(state)
+            except Exception as err: # pylint: disable=broad-except
+                self.logger.error("state: listener failed: %s", err)
+        return state
+
+
+    def forget(self, device_id):
+        """Drop what is known about a device"""
+        with self.lock:
+            self.states.pop(device_id, None)
+
+
+    def clear(self):
+        """Drop what is known about all devices. Returns their addresses"""
+        with self.lock:
+            device_ids = list(self.states)
+            self.states.clear()
+        return device_ids
+
+
+    def state(self, device_id):
+        """Last known state of a device, however old, or None"""
+        with self.lock:
+            return self.states.get(device_id)
+
+
+    def known_level(self, device_id, max_age=None):
+        """State with a known level, fresh and confident enough to answer a
+        status request, or None"""
+        max_age = self.max_age if max_age is None else max_age
+        with self.lock:
+            state = self.states.get(device_id)
+            if state is None or state.level is UNKNOWN \
+               or state.confidence < self.min_confidence or state.age() > max_age:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return state
+
+
+    def confirmed_level(self, device_id, max_age=SKIP_MAX_AGE):
+        """State with a known level the device itself acked or reported
+        within max_age seconds, or None"""
+        with self.lock:
+            state = self.states.get(device_id)
+        if state is None or state.level is UNKNOWN \
+           or state.source not in CONFIRMED_SOURCES or state.age() > max_age:
+            return None
+        return state
+
+
+    def command_acked(self, pending, record):
+        """Learn from the direct ack of a command we sent. Acks of extended
+        commands address a sub-load like a FanLinc fan or the bottom outlet
+        and are skipped"""
+        if pending.extended:
+            return
+        cmd1 = pending.cmd1
+        cmd2 = record.get('cmd2', '')
+        device_id = pending.device_id
+
+        if cmd1 == '19':
+            # level for 19 00 only, 19 01 answers with LED flags
+            if pending.cmd2 == '00':
+                self.update(device_id, cmd2, cmd2 != OFF_LEVEL, 'status', STATUS)
+        elif cmd1 in ('11', '21'):
+            self.update(device_id, cmd2, cmd2 != OFF_LEVEL, 'ack', ACK)
+        elif cmd1 == '12':
+            self.update(device_id, ON_FAST_LEVEL, True, 'ack', ACK)
+        elif cmd1 in ('13', '14'):
+            self.update(device_id, OFF_LEVEL, False, 'ack', ACK)
+        elif cmd1 in ('15', '16', '17', '18'):
+            self.update(device_id, UNKNOWN, UNKNOWN, 'ack', ACK)
+
+
+    def observe(self, records):
+        """Learn from new buffer messages: group broadcasts (flag C) and
+        cleanups (flag 4) of group 1 from paddle presses"""
+        for record in records:
+            if record.get('im_code', '') != '50':
+                continue
+            flag = record.get('flag1', '')
+            if flag == GROUP_BROADCAST_FLAG:
+                # to address is 0000<group>
+                group = record.get('id_low', '')
+                source, confidence = 'broadcast', BROADCAST
+            elif flag == GROUP_CLEANUP_FLAG:
+                group = record.get('cmd2', '')
+                source, confidence = 'cleanup', CLEANUP
+            else:
+                continue
+            if group != LOAD_GROUP:
+                continue
+            self.group_command(record.get('id_from', ''), record.get('cmd1', ''),
+                               source, confidence)
+
+
+    def group_command(self, device_id, cmd1, source, confidence):
+        """Apply a group command a device sent about its own load"""
+        if cmd1 == '11':
+            # a dimmer goes to its local on level, a switch to full on
+            if self.is_switch(device_id):
+                self.update(device_id, ON_FAST_LEVEL, True, source, confidence)
+            else:
+                self.update(device_id, UNKNOWN, True, source, confidence)
+        elif cmd1 == '12':
+            self.update(device_id, ON_FAST_LEVEL, True, source, confidence)
+        elif cmd1 in ('13', '14'):
+            self.update(device_id, OFF_LEVEL, False, source, confidence)
+        elif cmd1 in ('17', '18'):
+            # manual dimming, the final level is unknown but the load is on
+            self.update(device_id, UNKNOWN, cmd1 == '18' or UNKNOWN, source, confidence)
+
+
+    def is_switch(self, device_id):
+        """Check the registry for an on/off device"""
+        if self.registry is None:
+            return False
+        entry = self.registry.get(device_id)
+        return entry is not None and entry.get('cat') == SWITCH_CATEGORY
+
+
+    def stats(self):
+        """Return tracker counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'devices': len(self.states),
+                'updates': self.updates,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
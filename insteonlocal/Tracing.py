@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+from time import time
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+def new_id():
+    """Random 64 bit id as hex"""
+    return os.urandom(8).hex()
+
+
+class NullSpan(object):
+    """Span that records nothing"""
+    __slots__ = ()
+
+    def set(self, key, value):
+        """Ignore an attribute"""
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+class NullTracer(object):
+    """Default tracer. Hands out one shared do-nothing span, so untraced
+    hubs pay a method call per stage"""
+    enabled = False
+
+    def span(self, name, **attributes):
+        """Return the no-op span"""
+        return NULL_SPAN
+
+
+    def task_span(self, name, **attributes):
+        """Return the no-op span"""
+        return NULL_SPAN
+
+
+class Span(object):
+    """One timed stage of a command, with attributes like device, cmd1,
+    cmd2, hops and outcome"""
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'start', 'end',
+                 'attributes', 'thread', 'detached')
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes, detached=False):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.start = None
+        self.end = None
+        self.attributes = attributes
+        self.thread = threading.current_thread().name
+        self.detached = detached # not the parent of later spans in its thread
+
+
+    def set(self, key, value):
+        """Set an attribute"""
+        self.attributes[key] = value
+
+
+    @property
+    def duration(self):
+        """Seconds from start to end"""
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+
+    def __enter__(self):
+        if not self.detached:
+            self.tracer.push(self)
+        self.start = time()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time()
+        if exc_type is not None:
+            self.attributes.setdefault('outcome', 'error')
+            self.attributes['error'] = '%s: %s' % (exc_type.__name__, exc_value)
+        self.tracer.pop(self)
+        return False
+
+
+    def as_dict(self):
+        """Span as a JSON friendly dict"""
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.duration,
+            'thread': self.thread,
+            'attributes': self.attributes,
+        }
+
+
+class Tracer(object):
+    """Creates spans and hands finished ones to the exporter. Spans opened
+    while another is active in the same thread become its children, so a
+    Dimmer.on call and the hub stages under it share one trace"""
+    enabled = True
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.local = threading.local()
+
+
+    def stack(self):
+        """Active spans of the calling thread"""
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+
+    def span(self, name, **attributes):
+        """Return a span to use as a context manager"""
+        stack = self.stack()
+        if stack:
+            parent = stack[-1]
+            return Span(self, name, parent.trace_id, parent.span_id, attributes)
+        return Span(self, name, new_id(), None, attributes)
+
+
+    def task_span(self, name, **attributes):
+        """Return a span for an asyncio coroutine. Other coroutines run in
+        the same thread while it waits, so it is never made the parent of
+        spans opened after it"""
+        stack = self.stack()
+        if stack:
+            parent = stack[-1]
+            return Span(self, name, parent.trace_id, parent.span_id, attributes, True)
+        return Span(self, name, new_id(), None, attributes, True)
+
+
+    def push(self, span):
+        """Make span the active span of this thread"""
+        self.stack().append(span)
+
+
+    def pop(self, span):
+        """Close span and export it"""
+        stack = self.stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            stack.remove(span)
+        self.exporter.export(span)
+
+
+class MemoryExporter(object):
+    """Keeps the last finished spans in a list"""
+    def __init__(self, max_spans=1000):
+        self.max_spans = max_spans
+        self.lock = threading.Lock()
+        self.spans = []
+
+
+    def export(self, span):
+        """Store a finished span"""
+        with self.lock:
+            self.spans.append(span)
+            if len(self.spans) > self.max_spans:
+                del self.spans[0]
+
+
+    def clear(self):
+        """Drop stored spans"""
+        with self.lock:
+            self.spans = []
+
+
+class JsonLinesExporter(object):
+    """Writes each finished span as one JSON object per line"""
+    def __init__(self, path=None, stream=None):
+        if stream is None:
+            stream = open(path, 'a')
+            self.owned = True
+        else:
+            self.owned = False
+        self.stream = stream
+        self.lock = threading.Lock()
+
+
+    def export(self, span):
+        """Write a finished span"""
+        line = json.dumps(span.as_dict(), sort_keys=True, default=str)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+    def close(self):
+        """Close the file if this exporter opened it"""
+        if self.owned:
+            self.stream.close()
@@ -14,6 +14,7 @@ setup(
   requires = ['requests', 'time', 'pprint', 'logging', 'logging.handlers', 'sys', 'json', 'collections'],
   provides = ['insteonlocal'],
   install_requires = [],
+  python_requires = '>=3.9', # executor.shutdown(cancel_futures=True)
 #  packages=find_packages(exclude=['tests', 'tests.*']),
   packages=['insteonlocal'],
   include_package_data=True, # use MANIFEST.in during install
@@ -0,0 +1,101 @@
+import logging
+import unittest
+from insteonlocal.BufferReader import BufferReader
+from insteonlocal.HubSimulator import HubSimulator
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+LOGGER = logging.getLogger('insteonlocal.tests')
+
+def write_exchanges(sim, first, count):
+    """Write the echo and ack of an on command for count devices, 40 chars
+    each, like the hub does"""
+    for index in range(first, first + count):
+        device_id = '1122%02X' % index
+        sim.write('0262' + device_id + '0F117F06')
+        sim.write('0250' + device_id + '44AA11' + '2B117F')
+
+
+def acked_devices(records):
+    """Devices whose ack is among records, in buffer order"""
+    return [record['id_from'] for record in records if record.get('im_code') == '50']
+
+
+class RingBufferTest(unittest.TestCase):
+    """BufferReader against the simulator's 2015 hub ring buffer"""
+    def setUp(self):
+        # the server is never started, only its buffer is used
+        self.sim = HubSimulator(ring=True)
+        self.reader = BufferReader(LOGGER)
+
+
+    def tearDown(self):
+        self.sim.server.server_close()
+
+
+    def test_first_read_before_wrap(self):
+        write_exchanges(self.sim, 0, 2)
+        records = self.reader.read(self.sim.buffer_text())
+        self.assertEqual(len(records), 4)
+        self.assertEqual(acked_devices(records), ['112200', '112201'])
+        self.assertFalse(self.reader.gap)
+
+
+    def test_first_read_unwraps_full_ring(self):
+        # 286 chars, so the pointer went around the 200 char ring once
+        write_exchanges(self.sim, 0, 7)
+        self.sim.write('025806')
+        records = self.reader.read(self.sim.buffer_text())
+        self.assertTrue(self.reader.gap)
+        # the ring holds the last 200 chars, starting inside the echo of
+        # the third exchange. Everything after that cut comes back in order
+        self.assertEqual(acked_devices(records), ['1122%02X' % index for index in range(2, 7)])
+        self.assertEqual(records[0]['im_code'], '50')
+        self.assertEqual(records[-1]['im_code'], '58')
+        for record in records:
+            self.assertIn('im_code_desc', record)
+
+
+    def test_read_across_end_of_ring(self):
+        write_exchanges(self.sim, 0, 4)
+        self.reader.read(self.sim.buffer_text())
+        # pointer moves from 160 past the end to 40
+        write_exchanges(self.sim, 4, 2)
+        records = self.reader.read(self.sim.buffer_text())
+        self.assertEqual(acked_devices(records), ['112204', '112205'])
+        self.assertEqual(len(records), 4)
+        self.assertFalse(self.reader.lost)
+        self.assertFalse(self.reader.gap)
+
+
+    def test_lap_between_reads(self):
+        write_exchanges(self.sim, 0, 2)
+        self.reader.read(self.sim.buffer_text())
+        write_exchanges(self.sim, 2, 8)
+        records = self.reader.read(self.sim.buffer_text())
+        self.assertTrue(self.reader.lost)
+        self.assertTrue(self.reader.gap)
+        self.assertEqual(acked_devices(records)[-1], '112209')
+
+
+    def test_nothing_new(self):
+        write_exchanges(self.sim, 0, 3)
+        self.reader.read(self.sim.buffer_text())
+        mark = self.reader.mark()
+        self.assertEqual(self.reader.read(self.sim.buffer_text()), [])
+        self.assertEqual(self.reader.messages_since(mark), ([], mark))
+
+
+if __name__ == '__main__':
+    unittest.main()
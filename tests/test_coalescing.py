@@ -0,0 +1,88 @@
+import logging
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from insteonlocal.DeviceRegistry import DeviceRegistry
+from insteonlocal.Hub import Hub
+from insteonlocal.HubSimulator import HubSimulator
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+LOGGER = logging.getLogger('insteonlocal.tests')
+DEVICE_ID = '112233'
+WINDOW = 0.3 #seconds a level change waits for newer ones
+
+class CoalescingTest(unittest.TestCase):
+    """Two callers changing one dimmer at about the same time"""
+    def setUp(self):
+        self.sim = HubSimulator(latency=0.02).start()
+        self.sim.add_device(DEVICE_ID, 'dimmer')
+        self.hub = None
+
+
+    def tearDown(self):
+        if self.hub is not None:
+            self.hub.close()
+        self.sim.stop()
+
+
+    def make_hub(self, **kwargs):
+        """Hub talking to the simulator"""
+        self.hub = Hub('127.0.0.1', 'admin', 'password', port=str(self.sim.port),
+                       logger=LOGGER, registry=DeviceRegistry(LOGGER, path=False), **kwargs)
+        return self.hub.dimmer(DEVICE_ID)
+
+
+    def run_both(self, first, second):
+        """Start first, then second while first still waits. Returns both
+        results"""
+        with ThreadPoolExecutor(2) as pool:
+            first_result = pool.submit(first)
+            sleep(WINDOW / 3)
+            second_result = pool.submit(second)
+            return first_result.result(), second_result.result()
+
+
+    def test_replaced_level_reports_failure(self):
+        dimmer = self.make_hub(coalesce=True, coalesce_window=WINDOW)
+        results = self.run_both(lambda: dimmer.on(20), lambda: dimmer.on(80))
+        self.assertEqual(results, (False, True))
+        self.assertEqual(self.sim.devices[DEVICE_ID].level, 'CC')
+        self.assertEqual(self.hub.correlator.stats()['superseded'], 1)
+
+
+    def test_off_drops_waiting_level(self):
+        dimmer = self.make_hub(coalesce=True, coalesce_window=WINDOW)
+        results = self.run_both(lambda: dimmer.on(20), dimmer.off)
+        self.assertEqual(results, (False, True))
+        self.assertEqual(self.sim.devices[DEVICE_ID].level, '00')
+        self.assertEqual(self.hub.correlator.stats()['superseded'], 1)
+
+
+    def test_on_after_off_is_sent(self):
+        dimmer = self.make_hub(coalesce=True, coalesce_window=WINDOW)
+        results = self.run_both(dimmer.off, lambda: dimmer.on(20))
+        self.assertEqual(results, (True, True))
+        self.assertEqual(self.sim.devices[DEVICE_ID].level, '33')
+
+
+    def test_off_by_default(self):
+        dimmer = self.make_hub()
+        results = self.run_both(lambda: dimmer.on(20), lambda: dimmer.on(80))
+        self.assertEqual(results, (True, True))
+        self.assertEqual(self.sim.devices[DEVICE_ID].level, 'CC')
+
+
+if __name__ == '__main__':
+    unittest.main()
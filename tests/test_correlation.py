@@ -0,0 +1,138 @@
+import logging
+import sys
+import threading
+import unittest
+from insteonlocal.CommandCorrelator import CommandCorrelator, CommandNak
+from insteonlocal.DeviceRegistry import DeviceRegistry
+from insteonlocal.Hub import Hub
+from insteonlocal.HubSimulator import HubSimulator
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+LOGGER = logging.getLogger('insteonlocal.tests')
+
+def echo(device_id, cmd1, cmd2, ack_or_nak='06'):
+    """IM echo record of a sent standard message"""
+    return {'im_code': '62', 'id': device_id, 'flags': '0F', 'cmd1': cmd1, 'cmd2': cmd2,
+            'ack_or_nak': ack_or_nak}
+
+
+def response(device_id, cmd1, cmd2, flag1='2'):
+    """Direct ack (or nak with flag1 A) from a device"""
+    return {'im_code': '50', 'id_from': device_id, 'flag1': flag1, 'flag2': 'B',
+            'cmd1': cmd1, 'cmd2': cmd2}
+
+
+class CorrelatorTest(unittest.TestCase):
+    """Matching buffer records to pending commands"""
+    def setUp(self):
+        self.correlator = CommandCorrelator(LOGGER)
+
+
+    def test_records_before_mark_are_ignored(self):
+        stale = [echo('112233', '11', '7F'), response('112233', '11', '7F')]
+        pending = self.correlator.register('112233', '11', '7F', fresh=True)
+        self.correlator.posted(pending, 2)
+        self.correlator.match(stale, 0)
+        self.assertFalse(pending.future.done())
+
+        self.correlator.match(stale, 2)
+        self.assertTrue(pending.future.done())
+        self.assertEqual(pending.future.result()['cmd2'], '7F')
+
+
+    def test_ack_needs_echo(self):
+        pending = self.correlator.register('112233', '11', '7F', fresh=True)
+        self.correlator.posted(pending, 0)
+        self.correlator.match([response('112233', '11', '7F')], 0)
+        self.assertFalse(pending.future.done())
+
+
+    def test_gap_waives_echo(self):
+        pending = self.correlator.register('112233', '11', '7F', fresh=True)
+        self.correlator.posted(pending, 0)
+        self.correlator.match([response('112233', '11', '7F')], 3, gap=True)
+        self.assertTrue(pending.future.done())
+
+
+    def test_nak(self):
+        pending = self.correlator.register('112233', '11', '7F', fresh=True)
+        self.correlator.posted(pending, 0)
+        self.correlator.match([echo('112233', '11', '7F'),
+                               response('112233', '11', '7F', flag1='A')], 0)
+        self.assertIsInstance(pending.future.exception(), CommandNak)
+        self.assertEqual(self.correlator.stats()['naks'], 1)
+
+
+    def test_concurrent_match(self):
+        device_ids = ['1122%02X' % index for index in range(20)]
+        records = []
+        for device_id in device_ids:
+            records += [echo(device_id, '11', 'FF'), response(device_id, '11', 'FF')]
+        errors = []
+
+        def match():
+            try:
+                self.correlator.match(records, 0)
+            except Exception as err: # pylint: disable=broad-except
+                errors.append(err)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(50):
+                self.correlator = CommandCorrelator(LOGGER)
+                for device_id in device_ids:
+                    pending = self.correlator.register(device_id, '11', 'FF', fresh=True)
+                    self.correlator.posted(pending, 0)
+                threads = [threading.Thread(target=match) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(errors, [])
+                self.assertEqual(self.correlator.stats()['acks'], 20)
+        finally:
+            sys.setswitchinterval(interval)
+
+
+class HubCorrelationTest(unittest.TestCase):
+    """Acks read from the simulated hub's buffer"""
+    def check_stale_ack(self, ring):
+        with HubSimulator(ring=ring, latency=0.02) as sim:
+            sim.add_device('112233', 'dimmer')
+            hub = Hub('127.0.0.1', 'admin', 'password', port=str(sim.port), logger=LOGGER,
+                      registry=DeviceRegistry(LOGGER, path=False))
+            try:
+                dimmer = hub.dimmer('112233')
+                self.assertTrue(dimmer.on(50))
+                # the identical echo and ack of the last on are still in
+                # the buffer, but nothing was sent since
+                self.assertFalse(hub.check_success('112233', '11', '7F', timeout=0.5))
+                self.assertTrue(dimmer.on(50))
+                self.assertEqual(sim.devices['112233'].level, '7F')
+            finally:
+                hub.close()
+
+
+    def test_stale_ack_ring(self):
+        self.check_stale_ack(True)
+
+
+    def test_stale_ack_linear(self):
+        self.check_stale_ack(False)
+
+
+if __name__ == '__main__':
+    unittest.main()